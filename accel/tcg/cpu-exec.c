@@ -31,6 +31,9 @@
 #include "exec/tb-hash.h"
 #include "exec/tb-lookup.h"
 #include "exec/log.h"
+#ifdef CONFIG_USER_ONLY
+#include "exec/sym-tb-cache.h"
+#endif
 #include "qemu/main-loop.h"
 #if defined(TARGET_I386) && !defined(CONFIG_USER_ONLY)
 #include "hw/i386/apic.h"
@@ -407,6 +410,9 @@ static inline TranslationBlock *tb_find(CPUState *cpu,
     if (tb == NULL) {
         mmap_lock();
         tb = tb_gen_code(cpu, pc, cs_base, flags, cf_mask);
+#ifdef CONFIG_USER_ONLY
+        sym_tb_cache_record(tb, cf_mask);
+#endif
         mmap_unlock();
         /* We add the TB in the virtual pc hash table for the fast lookup */
         atomic_set(&cpu->tb_jmp_cache[tb_jmp_cache_hash_func(pc)], tb);
@@ -0,0 +1,235 @@
+/*
+ * This file is part of SymQEMU.
+ *
+ * SymQEMU is free software: you can redistribute it and/or modify it under the
+ * terms of the GNU General Public License as published by the Free Software
+ * Foundation, either version 2 of the License, or (at your option) any later
+ * version.
+ *
+ * SymQEMU is distributed in the hope that it will be useful, but WITHOUT ANY
+ * WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ * A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along with
+ * SymQEMU. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+#include "qemu/osdep.h"
+#include <sys/file.h>
+#include "cpu.h"
+#include "exec/exec-all.h"
+#include "exec/sym-tb-cache.h"
+#include "tcg.h"
+
+static const char *tb_cache_file;
+
+/* The CPU of the fork server, which translates the cached blocks. */
+static CPUState *preload_cpu;
+
+/* Blocks translated on demand during this run (SymTBCacheEntry). */
+static GArray *recorded_entries;
+
+/* The blocks of the cache file and the recorded ones (set of
+ * SymTBCacheEntry), so that each block is written to the file only once. */
+static GHashTable *known_entries;
+
+static guint tb_cache_entry_hash(gconstpointer key)
+{
+    const SymTBCacheEntry *entry = key;
+
+    return g_int64_hash(&entry->pc) ^ g_int64_hash(&entry->cs_base) ^
+           g_int_hash(&entry->flags) ^ (g_int_hash(&entry->cflags) << 1);
+}
+
+static gboolean tb_cache_entry_equal(gconstpointer a, gconstpointer b)
+{
+    const SymTBCacheEntry *entry_a = a, *entry_b = b;
+
+    return entry_a->pc == entry_b->pc && entry_a->cs_base == entry_b->cs_base &&
+           entry_a->flags == entry_b->flags &&
+           entry_a->cflags == entry_b->cflags;
+}
+
+/* Add an entry to the known ones; return false if it was already known. */
+static bool tb_cache_add_known(const SymTBCacheEntry *entry)
+{
+    SymTBCacheEntry *key;
+
+    if (g_hash_table_contains(known_entries, entry)) {
+        return false;
+    }
+    key = g_memdup(entry, sizeof(*entry));
+    g_hash_table_add(known_entries, key);
+    return true;
+}
+
+void sym_tb_cache_init(void)
+{
+    tb_cache_file = getenv("SYMQEMU_TB_CACHE_FILE");
+}
+
+void sym_tb_cache_record(TranslationBlock *tb, uint32_t cflags)
+{
+    SymTBCacheEntry entry = {
+        .pc = tb->pc,
+        .cs_base = tb->cs_base,
+        .flags = tb->flags,
+        .cflags = cflags,
+        .size = tb->size,
+    };
+
+    if (recorded_entries == NULL || !tb_cache_add_known(&entry)) {
+        return;
+    }
+
+    g_array_append_val(recorded_entries, entry);
+}
+
+/*
+ * Open the cache file and lock it with flock `operation`. tb_cache.py compacts
+ * the file under an exclusive lock and replaces it, so a file that is no longer
+ * the one at the path once locked is opened again. Returns -1 on error; if the
+ * file system can't lock, the file is returned unlocked.
+ */
+static int tb_cache_open_locked(int flags, int operation)
+{
+    struct stat fd_stat, path_stat;
+    int fd;
+
+    for (;;) {
+        fd = open(tb_cache_file, flags, 0644);
+        if (fd < 0 || flock(fd, operation) != 0) {
+            return fd;
+        }
+        if (fstat(fd, &fd_stat) == 0 && stat(tb_cache_file, &path_stat) == 0 &&
+            fd_stat.st_dev == path_stat.st_dev &&
+            fd_stat.st_ino == path_stat.st_ino) {
+            return fd;
+        }
+        close(fd);
+    }
+}
+
+/*
+ * Translate the entries added to the cache file since the last call, and add
+ * them to the known ones. The whole file is read again after a compaction.
+ */
+static void tb_cache_load(void)
+{
+    static dev_t loaded_dev;
+    static ino_t loaded_ino;
+    static off_t loaded_size;
+    struct stat file_stat;
+    SymTBCacheEntry *entries;
+    size_t count, i;
+    int fd;
+
+    fd = tb_cache_open_locked(O_RDONLY, LOCK_SH);
+    if (fd < 0) {
+        return;
+    }
+    if (fstat(fd, &file_stat) != 0) {
+        close(fd);
+        return;
+    }
+    if (file_stat.st_dev != loaded_dev || file_stat.st_ino != loaded_ino ||
+        file_stat.st_size < loaded_size) {
+        loaded_dev = file_stat.st_dev;
+        loaded_ino = file_stat.st_ino;
+        loaded_size = 0;
+    }
+
+    count = (file_stat.st_size - loaded_size) / sizeof(SymTBCacheEntry);
+    entries = g_new(SymTBCacheEntry, count);
+    if (count == 0 ||
+        pread(fd, entries, count * sizeof(SymTBCacheEntry), loaded_size) !=
+        (ssize_t)(count * sizeof(SymTBCacheEntry))) {
+        g_free(entries);
+        close(fd);
+        return;
+    }
+    close(fd);
+    loaded_size += count * sizeof(SymTBCacheEntry);
+
+    mmap_lock();
+    for (i = 0; i < count; i++) {
+        SymTBCacheEntry *entry = &entries[i];
+
+        /* The entries of the file are never written again, even those that
+         * are skipped here and translated during a run. */
+        if (!tb_cache_add_known(entry)) {
+            continue;
+        }
+
+        /* Running out of code buffer space makes tb_gen_code flush and exit
+         * to the CPU loop, which we are not in yet. Keep room for the run. */
+        if (tcg_code_size() > tcg_code_capacity() / 2) {
+            continue;
+        }
+
+        /* Libraries may not be loaded yet, and the cache may be stale. */
+        if (entry->size == 0 ||
+            page_check_range(entry->pc, entry->size, PAGE_EXEC) != 0) {
+            continue;
+        }
+
+        if (tb_htable_lookup(preload_cpu, entry->pc, entry->cs_base,
+                             entry->flags, entry->cflags) != NULL) {
+            continue;
+        }
+
+        tb_gen_code(preload_cpu, entry->pc, entry->cs_base, entry->flags,
+                    entry->cflags);
+    }
+    mmap_unlock();
+
+    g_free(entries);
+}
+
+void sym_tb_cache_preload(CPUState *cpu)
+{
+    if (tb_cache_file == NULL) {
+        return;
+    }
+
+    /* Record from here on: the runs forked by the fork server inherit the
+     * known entries and only write the blocks that are new. */
+    preload_cpu = cpu;
+    recorded_entries = g_array_new(FALSE, FALSE, sizeof(SymTBCacheEntry));
+    known_entries = g_hash_table_new_full(tb_cache_entry_hash,
+                                          tb_cache_entry_equal, g_free, NULL);
+    tb_cache_load();
+}
+
+void sym_tb_cache_update(void)
+{
+    if (recorded_entries == NULL) {
+        return;
+    }
+
+    /* The blocks written by the last run, and by concurrent fork servers. */
+    tb_cache_load();
+}
+
+void sym_tb_cache_dump(void)
+{
+    int fd;
+    size_t size;
+
+    if (recorded_entries == NULL || recorded_entries->len == 0) {
+        return;
+    }
+
+    /* A single write in append mode, so that concurrent runs sharing the
+     * cache file don't interleave their entries. */
+    size = recorded_entries->len * sizeof(SymTBCacheEntry);
+    fd = tb_cache_open_locked(O_WRONLY | O_CREAT | O_APPEND, LOCK_SH);
+    if (fd < 0 || write(fd, recorded_entries->data, size) != (ssize_t)size) {
+        fprintf(stderr, "Failed to write the translation cache to %s\n",
+                tb_cache_file);
+    }
+    if (fd >= 0) {
+        close(fd);
+    }
+    g_array_set_size(recorded_entries, 0);
+}
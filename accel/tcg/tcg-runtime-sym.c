@@ -21,6 +21,7 @@
 #include "qemu/qemu-print.h"
 #include "tcg.h"
 #include "exec/exec-all.h"
+#include "exec/sym-coverage.h"
 
 
 /* Include the symbolic backend, using void* as expression type. */
@@ -650,11 +651,62 @@ void HELPER(sym_notify_return)(uint64_t return_address)
     _sym_notify_ret(return_address);
 }
 
+/* The block coverage bitmap (see exec/sym-coverage.h), or NULL if coverage is
+ * disabled. */
+static uint8_t *coverage_map;
+static const char *coverage_file;
+static uint64_t coverage_previous_location;
+
+void sym_coverage_init(void)
+{
+    coverage_file = getenv("SYMQEMU_COVERAGE_FILE");
+    if (coverage_file != NULL) {
+        coverage_map = g_malloc0(SYM_COVERAGE_MAP_SIZE);
+    }
+}
+
+void sym_coverage_dump(void)
+{
+    FILE *f;
+
+    if (coverage_map == NULL) {
+        return;
+    }
+
+    f = fopen(coverage_file, "wb");
+    if (f == NULL ||
+        fwrite(coverage_map, SYM_COVERAGE_MAP_SIZE, 1, f) != 1) {
+        fprintf(stderr, "Failed to write the coverage bitmap to %s\n",
+                coverage_file);
+    }
+    if (f != NULL) {
+        fclose(f);
+    }
+}
+
+static void sym_coverage_record(target_ulong pc)
+{
+    /* Same scheme as AFL's QEMU mode: scramble the address a little, then
+     * index the bitmap with the XOR of the current and the (shifted) previous
+     * location so that A->B and B->A are different edges. */
+    uint64_t location = ((pc >> 4) ^ (pc << 8)) & (SYM_COVERAGE_MAP_SIZE - 1);
+    uint8_t *counter = &coverage_map[location ^ coverage_previous_location];
+
+    if (*counter != UINT8_MAX) {
+        (*counter)++;
+    }
+    coverage_previous_location = location >> 1;
+}
+
 void HELPER(sym_notify_block)(uint64_t block_id)
 {
     _sym_notify_basic_block(block_id);
     TranslationBlock *block = (TranslationBlock *) block_id;
     _sym_trace_execution(block->pc);
+
+    if (coverage_map != NULL) {
+        sym_coverage_record(block->pc);
+    }
 }
 
 void HELPER(sym_collect_garbage)(void)
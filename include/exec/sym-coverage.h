@@ -0,0 +1,39 @@
+/*
+ * This file is part of SymQEMU.
+ *
+ * SymQEMU is free software: you can redistribute it and/or modify it under the
+ * terms of the GNU General Public License as published by the Free Software
+ * Foundation, either version 2 of the License, or (at your option) any later
+ * version.
+ *
+ * SymQEMU is distributed in the hope that it will be useful, but WITHOUT ANY
+ * WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ * A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along with
+ * SymQEMU. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+#ifndef SYM_COVERAGE_H
+#define SYM_COVERAGE_H
+
+/* Size in bytes of the block coverage bitmap; must be a power of two. */
+#define SYM_COVERAGE_MAP_SIZE (1 << 16)
+
+/*
+ * Block coverage export.
+ *
+ * If the environment variable SYMQEMU_COVERAGE_FILE is set, every executed
+ * translation block is recorded in an AFL-style edge bitmap: each byte of the
+ * bitmap is a saturating hit counter for a hash of the transition between two
+ * consecutive blocks, computed from their guest addresses. The bitmap is
+ * written to SYMQEMU_COVERAGE_FILE when the guest exits.
+ */
+
+/* Read the configuration from the environment; call once at startup. */
+void sym_coverage_init(void);
+
+/* Write the bitmap to the coverage file, if coverage is enabled. */
+void sym_coverage_dump(void);
+
+#endif
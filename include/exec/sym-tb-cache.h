@@ -0,0 +1,73 @@
+/*
+ * This file is part of SymQEMU.
+ *
+ * SymQEMU is free software: you can redistribute it and/or modify it under the
+ * terms of the GNU General Public License as published by the Free Software
+ * Foundation, either version 2 of the License, or (at your option) any later
+ * version.
+ *
+ * SymQEMU is distributed in the hope that it will be useful, but WITHOUT ANY
+ * WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ * A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along with
+ * SymQEMU. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+#ifndef SYM_TB_CACHE_H
+#define SYM_TB_CACHE_H
+
+/*
+ * Persistent cache of translated blocks (user mode only).
+ *
+ * Generated host code can't be saved as is: it embeds host pointers (helpers,
+ * the TranslationBlock itself, the CPU state) that are only valid in one
+ * process. What we persist instead is the list of guest blocks that have been
+ * translated, with everything needed to translate them again. A fork server
+ * translates all the cached blocks before it starts forking, so that every
+ * run inherits the instrumented translations instead of redoing them.
+ *
+ * The cache is only used by fork servers. If the environment variable
+ * SYMQEMU_TB_CACHE_FILE is set, the fork server preloads the blocks of that
+ * file, and the blocks that its runs translate on demand and that are not
+ * known yet are appended to it when the guest exits. Between runs, the fork
+ * server loads the entries appended since, so that later runs neither
+ * translate nor write them again. The file is a sequence of SymTBCacheEntry
+ * in host byte order; concurrent runs may still append the same block, so it
+ * may contain duplicates. tests/symqemu/tb_cache.py compacts it under an
+ * exclusive flock; the fork server reads and appends under a shared one. The
+ * harness is responsible for using one file per guest binary.
+ */
+
+typedef struct {
+    uint64_t pc;
+    uint64_t cs_base;
+    uint32_t flags;
+    uint32_t cflags;
+    uint32_t size;
+    uint32_t reserved;
+} SymTBCacheEntry;
+
+/* Read the configuration from the environment; call once at startup. */
+void sym_tb_cache_init(void);
+
+/* Record a block translated on demand; called with mmap_lock held. */
+void sym_tb_cache_record(struct TranslationBlock *tb, uint32_t cflags);
+
+/*
+ * Translate the cached blocks whose code is mapped, and start recording the
+ * blocks that are not cached. Call in the fork server after the guest has
+ * been loaded and before forking.
+ */
+void sym_tb_cache_preload(CPUState *cpu);
+
+/*
+ * Translate the blocks appended to the cache file since the last run, in the
+ * fork server between runs; no-op when not recording.
+ */
+void sym_tb_cache_update(void);
+
+/* Append the recorded blocks to the cache file; no-op when not recording. */
+void sym_tb_cache_dump(void);
+
+#endif
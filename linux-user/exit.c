@@ -18,6 +18,8 @@
  */
 #include "qemu/osdep.h"
 #include "qemu.h"
+#include "exec/sym-coverage.h"
+#include "exec/sym-tb-cache.h"
 #ifdef TARGET_GPROF
 #include <sys/gmon.h>
 #endif
@@ -35,4 +37,6 @@ void preexit_cleanup(CPUArchState *env, int code)
         __gcov_dump();
 #endif
         gdb_exit(env, code);
+        sym_coverage_dump();
+        sym_tb_cache_dump();
 }
@@ -0,0 +1,125 @@
+/*
+ * This file is part of SymQEMU.
+ *
+ * SymQEMU is free software: you can redistribute it and/or modify it under the
+ * terms of the GNU General Public License as published by the Free Software
+ * Foundation, either version 2 of the License, or (at your option) any later
+ * version.
+ *
+ * SymQEMU is distributed in the hope that it will be useful, but WITHOUT ANY
+ * WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ * A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along with
+ * SymQEMU. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+#include "qemu/osdep.h"
+#include <sys/resource.h>
+#include <sys/wait.h>
+#include "qemu.h"
+#include "exec/sym-tb-cache.h"
+
+/*
+ * Fork server, in the style of AFL.
+ *
+ * When SYMQEMU_FORKSERVER is set, the emulator loads the guest binary and then
+ * stops before executing any guest code. From then on, each run is a fork of
+ * this snapshot, so that runs don't pay for the emulator startup and guest
+ * loading again.
+ *
+ * The harness talks to the fork server over two pipes that it passes as file
+ * descriptors FORKSERVER_CONTROL_FD (harness to fork server) and
+ * FORKSERVER_STATUS_FD (fork server to harness):
+ *
+ * 1. The fork server writes a 4-byte hello message to the status pipe.
+ * 2. For each run, the harness writes 4 bytes (ignored) to the control pipe.
+ *    The fork server forks; the child runs the guest, while the fork server
+ *    writes the child's PID (int32_t) to the status pipe, waits for the child
+ *    and writes a ForkServerReport to the status pipe.
+ * 3. The fork server exits when the control pipe is closed.
+ *
+ * All values are in host byte order.
+ */
+
+#define FORKSERVER_CONTROL_FD 198
+#define FORKSERVER_STATUS_FD (FORKSERVER_CONTROL_FD + 1)
+
+typedef struct {
+    int32_t status;          /* as returned by waitpid */
+    uint32_t reserved;
+    uint64_t user_time_us;
+    uint64_t sys_time_us;
+    uint64_t max_rss_kb;
+} ForkServerReport;
+
+bool forkserver_enabled(void)
+{
+    return getenv("SYMQEMU_FORKSERVER") != NULL;
+}
+
+static void forkserver_write(const void *buf, size_t len)
+{
+    if (write(FORKSERVER_STATUS_FD, buf, len) != (ssize_t)len) {
+        /* The harness is gone. */
+        exit(EXIT_FAILURE);
+    }
+}
+
+void forkserver_run(void)
+{
+    uint32_t hello = 0;
+
+    if (write(FORKSERVER_STATUS_FD, &hello, sizeof(hello)) != sizeof(hello)) {
+        /* No harness listening: run the guest in this process. */
+        return;
+    }
+
+    for (;;) {
+        uint32_t request;
+        int32_t child_pid;
+        int status;
+        struct rusage usage;
+        ForkServerReport report = {};
+        pid_t child;
+
+        if (read(FORKSERVER_CONTROL_FD, &request, sizeof(request)) !=
+            sizeof(request)) {
+            exit(EXIT_SUCCESS);
+        }
+
+        /* Same sequence as a guest fork() in do_fork. */
+        fork_start();
+        child = fork();
+        if (child < 0) {
+            perror("fork server: fork");
+            exit(EXIT_FAILURE);
+        }
+        if (child == 0) {
+            fork_end(1);
+            close(FORKSERVER_CONTROL_FD);
+            close(FORKSERVER_STATUS_FD);
+            return;
+        }
+        fork_end(0);
+
+        child_pid = child;
+        forkserver_write(&child_pid, sizeof(child_pid));
+
+        if (wait4(child, &status, 0, &usage) < 0) {
+            perror("fork server: wait4");
+            exit(EXIT_FAILURE);
+        }
+
+        report.status = status;
+        report.user_time_us = usage.ru_utime.tv_sec * 1000000ULL +
+                              usage.ru_utime.tv_usec;
+        report.sys_time_us = usage.ru_stime.tv_sec * 1000000ULL +
+                             usage.ru_stime.tv_usec;
+        report.max_rss_kb = usage.ru_maxrss;
+        forkserver_write(&report, sizeof(report));
+
+        /* Let the next runs inherit the blocks translated by this one. */
+        sym_tb_cache_update();
+    }
+}
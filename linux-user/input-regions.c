@@ -0,0 +1,184 @@
+/*
+ * This file is part of SymQEMU.
+ *
+ * SymQEMU is free software: you can redistribute it and/or modify it under the
+ * terms of the GNU General Public License as published by the Free Software
+ * Foundation, either version 2 of the License, or (at your option) any later
+ * version.
+ *
+ * SymQEMU is distributed in the hope that it will be useful, but WITHOUT ANY
+ * WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+ * A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License along with
+ * SymQEMU. If not, see <https://www.gnu.org/licenses/>.
+ */
+
+#include "qemu/osdep.h"
+#include "qemu/cutils.h"
+#include "qemu.h"
+
+#define SymExpr void*
+#include "RuntimeCommon.h"
+
+/*
+ * Symbolic input regions.
+ *
+ * By default, every byte of the symbolic input (the file SYMCC_INPUT_FILE, or
+ * standard input) is symbolic. If the environment variable
+ * SYMQEMU_SYMBOLIC_REGIONS is set to a comma-separated list of byte ranges
+ * "<start>-<end>" (end excluded, decimal or 0x-prefixed), only the input bytes
+ * in those ranges stay symbolic. After each read from the input, the backend
+ * forgets the expressions of the other bytes, so the guest computes on them
+ * concretely and they never reach the solver.
+ */
+
+ssize_t read_symbolized(int fildes, void *buf, size_t nbyte);
+
+typedef struct {
+    uint64_t start;
+    uint64_t end;
+} InputRegion;
+
+/* Sorted and disjoint; NULL if the whole input is symbolic. */
+static GArray *input_regions;
+
+static bool input_is_stdin;
+static struct stat input_file_stat;
+static uint64_t stdin_offset;
+
+static gint input_region_compare(gconstpointer a, gconstpointer b)
+{
+    const InputRegion *region_a = a, *region_b = b;
+
+    if (region_a->start != region_b->start) {
+        return region_a->start < region_b->start ? -1 : 1;
+    }
+    return 0;
+}
+
+static void parse_input_regions(const char *spec)
+{
+    gchar **ranges = g_strsplit(spec, ",", -1);
+    GArray *regions = g_array_new(FALSE, FALSE, sizeof(InputRegion));
+    guint i;
+
+    for (i = 0; ranges[i] != NULL; i++) {
+        InputRegion region;
+        const char *end;
+
+        if (ranges[i][0] == '\0') {
+            continue;
+        }
+        if (qemu_strtou64(ranges[i], &end, 0, &region.start) != 0 ||
+            *end != '-' ||
+            qemu_strtou64(end + 1, NULL, 0, &region.end) != 0 ||
+            region.end < region.start) {
+            fprintf(stderr, "Invalid range \"%s\" in SYMQEMU_SYMBOLIC_REGIONS\n",
+                    ranges[i]);
+            exit(EXIT_FAILURE);
+        }
+        if (region.end > region.start) {
+            g_array_append_val(regions, region);
+        }
+    }
+    g_strfreev(ranges);
+
+    /* Merge overlapping and adjacent regions. */
+    g_array_sort(regions, input_region_compare);
+    input_regions = g_array_new(FALSE, FALSE, sizeof(InputRegion));
+    for (i = 0; i < regions->len; i++) {
+        InputRegion *region = &g_array_index(regions, InputRegion, i);
+        InputRegion *last = input_regions->len == 0 ? NULL :
+            &g_array_index(input_regions, InputRegion, input_regions->len - 1);
+
+        if (last != NULL && region->start <= last->end) {
+            last->end = MAX(last->end, region->end);
+        } else {
+            g_array_append_val(input_regions, *region);
+        }
+    }
+    g_array_free(regions, TRUE);
+}
+
+void input_regions_init(void)
+{
+    const char *spec = getenv("SYMQEMU_SYMBOLIC_REGIONS");
+    const char *input_file = getenv("SYMCC_INPUT_FILE");
+
+    if (spec == NULL) {
+        return;
+    }
+    parse_input_regions(spec);
+
+    if (input_file == NULL) {
+        input_is_stdin = true;
+    } else if (stat(input_file, &input_file_stat) != 0) {
+        perror("SYMQEMU_SYMBOLIC_REGIONS: stat of SYMCC_INPUT_FILE");
+        exit(EXIT_FAILURE);
+    }
+}
+
+/*
+ * Return the offset in the symbolic input of the next read from fd, or -1 if
+ * fd doesn't read the symbolic input.
+ */
+static int64_t input_offset(int fd)
+{
+    struct stat fd_stat;
+
+    if (input_is_stdin) {
+        return fd == 0 ? stdin_offset : -1;
+    }
+    if (fstat(fd, &fd_stat) != 0 ||
+        fd_stat.st_dev != input_file_stat.st_dev ||
+        fd_stat.st_ino != input_file_stat.st_ino) {
+        return -1;
+    }
+    return lseek(fd, 0, SEEK_CUR);
+}
+
+static void concretize(uint8_t *buf, uint64_t offset, uint64_t start,
+                       uint64_t end)
+{
+    if (end > start) {
+        _sym_write_memory(buf + (start - offset), end - start, NULL, true);
+    }
+}
+
+ssize_t input_regions_read(int fd, void *buf, size_t nbyte)
+{
+    int64_t offset;
+    ssize_t ret;
+    uint64_t position, end;
+    guint i;
+
+    if (input_regions == NULL) {
+        return read_symbolized(fd, buf, nbyte);
+    }
+
+    offset = input_offset(fd);
+    ret = read_symbolized(fd, buf, nbyte);
+    if (offset < 0 || ret <= 0) {
+        return ret;
+    }
+    if (input_is_stdin) {
+        stdin_offset += ret;
+    }
+
+    /* Concretize the gaps between the regions within [offset, offset + ret). */
+    position = offset;
+    end = offset + ret;
+    for (i = 0; i < input_regions->len && position < end; i++) {
+        InputRegion *region = &g_array_index(input_regions, InputRegion, i);
+
+        if (region->end <= position) {
+            continue;
+        }
+        concretize(buf, offset, position, MIN(region->start, end));
+        position = MAX(position, region->end);
+    }
+    concretize(buf, offset, position, end);
+
+    return ret;
+}
@@ -44,6 +44,8 @@
 #include "target_elf.h"
 #include "cpu_loop-common.h"
 #include "crypto/init.h"
+#include "exec/sym-coverage.h"
+#include "exec/sym-tb-cache.h"
 
 #define SymExpr void*
 #include "RuntimeCommon.h"
@@ -678,8 +680,14 @@ int main(int argc, char **argv, char **envp)
     }
     trace_init_file(trace_file);
 
-    /* Initialize the symbolic backend */
-    _sym_initialize();
+    /* Initialize the symbolic backend. A fork server defers this to its
+     * children, because the backend reads the symbolic input and sets up the
+     * output when it is initialized. */
+    if (!forkserver_enabled()) {
+        _sym_initialize();
+        sym_coverage_init();
+        input_regions_init();
+    }
 
     /* Zero out regs */
     memset(regs, 0, sizeof(struct target_pt_regs));
@@ -877,6 +885,16 @@ int main(int argc, char **argv, char **envp)
 
     save_memory_areas((void *) env, info);
 
+    sym_tb_cache_init();
+
+    if (forkserver_enabled()) {
+        sym_tb_cache_preload(cpu);
+        forkserver_run();
+        _sym_initialize();
+        sym_coverage_init();
+        input_regions_init();
+    }
+
     cpu_loop(env);
     /* never exits */
     return 0;
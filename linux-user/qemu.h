@@ -669,6 +669,35 @@ static inline int is_error(abi_long ret)
  */
 void preexit_cleanup(CPUArchState *env, int code);
 
+/* forkserver.c */
+
+/**
+ * forkserver_enabled: whether SymQEMU runs as a fork server
+ */
+bool forkserver_enabled(void);
+
+/**
+ * forkserver_run: serve fork requests from the harness
+ *
+ * Returns in each forked child, or immediately if no harness is listening.
+ * Only returns in the fork server process itself in the latter case.
+ */
+void forkserver_run(void);
+
+/* input-regions.c */
+
+/**
+ * input_regions_init: read SYMQEMU_SYMBOLIC_REGIONS from the environment
+ */
+void input_regions_init(void);
+
+/**
+ * input_regions_read: read from fd like read_symbolized
+ *
+ * Bytes of the symbolic input outside the symbolic regions are made concrete.
+ */
+ssize_t input_regions_read(int fd, void *buf, size_t nbyte);
+
 /* Include target-specific struct and function definitions;
  * they may need access to the target-independent structures
  * above, so include them last.
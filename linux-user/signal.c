@@ -24,6 +24,8 @@
 #include "qemu.h"
 #include "trace.h"
 #include "signal-common.h"
+#include "exec/sym-coverage.h"
+#include "exec/sym-tb-cache.h"
 
 static struct target_sigaction sigact_table[TARGET_NSIG];
 
@@ -580,6 +582,8 @@ static void QEMU_NORETURN dump_core_and_abort(int target_sig)
     host_sig = target_to_host_signal(target_sig);
     trace_user_force_sig(env, target_sig, host_sig);
     gdb_signalled(env, target_sig);
+    sym_coverage_dump();
+    sym_tb_cache_dump();
 
     /* dump core if supported by target binary format */
     if (core_dump_signal(target_sig) && (ts->bprm->core_dump != NULL)) {
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 # Pretty print 9p simpletrace log
-# Usage: ./analyse-9p-simpletrace <trace-events> <trace-pid>
+# Usage: ./analyse-9p-simpletrace [--stats] <trace-events> <trace-pid>
+#
+# With --stats, print request latency and throughput statistics as JSON
+# instead.
 #
 # Author: Harsh Prateek Bora
 from __future__ import print_function
+import json
 import os
+import sys
 import simpletrace
 
 symbol_9p = {
@@ -211,4 +216,164 @@ class VirtFSRequestTracker(simpletrace.Analyzer):
         def v9fs_readlink_return(self, tag, id, target):
                 print("RREADLINK (tag =", tag, ", target =", target, ")")
 
-simpletrace.run(VirtFSRequestTracker())
+# Requests whose completion is traced by a <request>_return event
+returning_requests = ('version', 'attach', 'stat', 'getattr', 'walk', 'open',
+                      'lcreate', 'read', 'readdir', 'write', 'create',
+                      'symlink', 'mknod', 'lock', 'getlock', 'mkdir',
+                      'xattrwalk', 'readlink', 'setattr')
+
+class VirtFSStatsAnalyzer(simpletrace.Analyzer):
+        """Request latency and throughput statistics, printed as JSON.
+
+        Each request is matched by tag with its _return event, or with
+        v9fs_rerror if it fails.  Latencies are counted per operation in
+        streaming histograms.  The timeline holds, per interval of `interval`
+        ns, the number of completed requests, the bytes read and written and
+        the maximum and mean number of outstanding requests."""
+
+        event_names = set(['v9fs_rerror'] +
+                          ['v9fs_' + request for request in returning_requests] +
+                          ['v9fs_%s_return' % request for request in returning_requests])
+
+        def __init__(self, interval=10**9, top=10):
+                self.interval = interval
+                self.top = top
+
+        def begin(self):
+                self.pending = {}       # (pid, tag) -> (operation, fid, timestamp)
+                self.handlers = {}
+                self.operations = {}
+                self.fids = {}
+                self.timeline = {}
+                self.unmatched = 0
+                self.depth = 0
+                self.first_timestamp = None
+                self.last_timestamp = None
+
+        def build_handler(self, event):
+                args = [name for _, name in event.args]
+                if event.name == 'v9fs_rerror':
+                        return lambda rec: self.complete(rec, error=True)
+                if event.name.endswith('_return'):
+                        if event.name in ('v9fs_read_return', 'v9fs_write_return'):
+                                return lambda rec: self.complete(rec, size=rec[5])
+                        return self.complete
+                operation = event.name[len('v9fs_'):]
+                fid = 3 + args.index('fid') if 'fid' in args else None
+                return lambda rec: self.start(rec, operation, fid)
+
+        def catchall(self, event, rec):
+                handler = self.handlers.get(event.name)
+                if handler is None:
+                        handler = self.handlers[event.name] = self.build_handler(event)
+                handler(rec)
+
+        def advance(self, timestamp):
+                "Account the outstanding requests up to timestamp"
+                if self.first_timestamp is None:
+                        self.first_timestamp = self.last_timestamp = timestamp
+                while self.depth and self.last_timestamp < timestamp:
+                        bucket = self.last_timestamp // self.interval
+                        end = min(timestamp, (bucket + 1) * self.interval)
+                        self.get_bucket(bucket)["depth_time"] += \
+                            self.depth * (end - self.last_timestamp)
+                        self.last_timestamp = end
+                self.last_timestamp = max(self.last_timestamp, timestamp)
+
+        def get_bucket(self, bucket):
+                if bucket not in self.timeline:
+                        self.timeline[bucket] = {"requests": 0, "read_bytes": 0,
+                                                 "write_bytes": 0, "max_depth": 0,
+                                                 "depth_time": 0}
+                return self.timeline[bucket]
+
+        def start(self, rec, operation, fid):
+                timestamp = rec[1]
+                self.advance(timestamp)
+                key = (rec[2], rec[3])
+                if key in self.pending:
+                        self.unmatched += 1
+                else:
+                        self.depth += 1
+                self.pending[key] = (operation, rec[fid] if fid else None, timestamp)
+                bucket = self.get_bucket(timestamp // self.interval)
+                bucket["max_depth"] = max(bucket["max_depth"], self.depth)
+
+        def complete(self, rec, error=False, size=0):
+                timestamp = rec[1]
+                request = self.pending.pop((rec[2], rec[3]), None)
+                if request is None:
+                        return
+                self.advance(timestamp)
+                self.depth -= 1
+                operation, fid, start = request
+                latency = max(timestamp - start, 0)
+
+                if operation not in self.operations:
+                        self.operations[operation] = {"errors": 0, "bytes": 0,
+                                                      "latency": simpletrace.LatencyHistogram()}
+                stats = self.operations[operation]
+                stats["latency"].record(latency)
+                bucket = self.get_bucket(timestamp // self.interval)
+                bucket["requests"] += 1
+                if error:
+                        stats["errors"] += 1
+                elif size > 0 and size < 1 << 31:
+                        stats["bytes"] += size
+                        bucket[operation + "_bytes"] += size
+
+                if fid is not None:
+                        fid_stats = self.fids.setdefault(fid, [0, 0, 0])
+                        fid_stats[0] += 1
+                        fid_stats[1] += latency
+                        fid_stats[2] = max(fid_stats[2], latency)
+
+        def end(self):
+                duration = 0
+                if self.first_timestamp is not None:
+                        duration = self.last_timestamp - self.first_timestamp
+                seconds = duration / 1e9
+
+                operations = {}
+                for operation, stats in sorted(self.operations.items()):
+                        operations[operation] = {
+                            "count": stats["latency"].count,
+                            "errors": stats["errors"],
+                            "latency_ns": stats["latency"].summary(),
+                        }
+                        if operation in ("read", "write"):
+                                operations[operation]["bytes"] = stats["bytes"]
+                                operations[operation]["bytes_per_second"] = \
+                                    stats["bytes"] / seconds if seconds else 0.0
+
+                timeline = []
+                for bucket, stats in sorted(self.timeline.items()):
+                        timeline.append({"time_ns": bucket * self.interval,
+                                         "requests": stats["requests"],
+                                         "read_bytes": stats["read_bytes"],
+                                         "write_bytes": stats["write_bytes"],
+                                         "max_depth": stats["max_depth"],
+                                         "mean_depth": stats["depth_time"] / float(self.interval)})
+
+                fids = sorted(self.fids.items(), key=lambda fid_stats: -fid_stats[1][1])
+                slowest_fids = [{"fid": fid, "requests": count,
+                                 "total_latency_ns": total,
+                                 "mean_latency_ns": total / float(count),
+                                 "max_latency_ns": longest}
+                                for fid, (count, total, longest) in fids[:self.top]]
+
+                json.dump({"duration_ns": duration,
+                           "requests": sum(op["count"] for op in operations.values()),
+                           "unmatched": self.unmatched,
+                           "pending": len(self.pending),
+                           "operations": operations,
+                           "timeline": timeline,
+                           "slowest_fids": slowest_fids},
+                          sys.stdout, indent=2, sort_keys=True)
+                print()
+
+if len(sys.argv) > 1 and sys.argv[1] == '--stats':
+        del sys.argv[1]
+        simpletrace.run(VirtFSStatsAnalyzer())
+else:
+        simpletrace.run(VirtFSRequestTracker())
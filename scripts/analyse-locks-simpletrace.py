@@ -9,58 +9,120 @@
 from __future__ import print_function
 import simpletrace
 import argparse
-import numpy as np
 
-class MutexAnalyser(simpletrace.Analyzer):
-    "A simpletrace Analyser for checking locks."
+class WaitStats(object):
+    "Acquire and held time histograms of a mutex or of a call site."
 
     def __init__(self):
+        self.acquire_times = simpletrace.LatencyHistogram()
+        self.held_times = simpletrace.LatencyHistogram()
+
+class MutexAnalyser(simpletrace.Analyzer):
+    """A simpletrace Analyser for checking locks.
+
+    Acquire times (from qemu_mutex_lock to qemu_mutex_locked) and held times
+    (from qemu_mutex_locked to qemu_mutex_unlock) are counted in streaming
+    histograms, per mutex and per call site (acquire times at the call site
+    of the lock, held times at the call site of the locked event), so memory
+    does not grow with the number of lock events.  The wait-for timeline
+    sums the acquire times per interval of timeline_interval ns, at the time
+    the mutex is taken."""
+
+    event_names = ('qemu_mutex_lock', 'qemu_mutex_locked', 'qemu_mutex_unlock')
+
+    def __init__(self, timeline_interval=None):
         self.locks = 0
         self.locked = 0
         self.unlocks = 0
         self.mutex_records = {}
+        self.sites = {}
+        self.timeline_interval = timeline_interval
+        self.timeline = {}
 
     def _get_mutex(self, mutex):
         if not mutex in self.mutex_records:
             self.mutex_records[mutex] = {"locks": 0,
                                          "lock_time": 0,
-                                         "acquire_times": [],
                                          "locked": 0,
                                          "locked_time": 0,
-                                         "held_times": [],
-                                         "unlocked": 0}
+                                         "unlocked": 0,
+                                         "stats": WaitStats()}
 
         return self.mutex_records[mutex]
 
+    def _get_site(self, filename, line):
+        site = (filename, line)
+        if not site in self.sites:
+            self.sites[site] = WaitStats()
+        return self.sites[site]
+
     def qemu_mutex_lock(self, timestamp, mutex, filename, line):
         self.locks += 1
         rec = self._get_mutex(mutex)
         rec["locks"] += 1
-        rec["lock_time"] = timestamp[0]
+        rec["lock_time"] = timestamp
         rec["lock_loc"] = (filename, line)
 
     def qemu_mutex_locked(self, timestamp, mutex, filename, line):
         self.locked += 1
         rec = self._get_mutex(mutex)
         rec["locked"] += 1
-        rec["locked_time"] = timestamp[0]
-        acquire_time = rec["locked_time"] - rec["lock_time"]
+        rec["locked_time"] = timestamp
         rec["locked_loc"] = (filename, line)
-        rec["acquire_times"].append(acquire_time)
+        if "lock_loc" not in rec:
+            return
+        acquire_time = max(timestamp - rec["lock_time"], 0)
+        rec["stats"].acquire_times.record(acquire_time)
+        self._get_site(*rec["lock_loc"]).acquire_times.record(acquire_time)
+
+        if self.timeline_interval:
+            interval = timestamp // self.timeline_interval
+            waits = self.timeline.setdefault(interval, [0, 0, 0])
+            waits[0] += 1
+            waits[1] += acquire_time
+            waits[2] = max(waits[2], acquire_time)
 
     def qemu_mutex_unlock(self, timestamp, mutex, filename, line):
         self.unlocks += 1
         rec = self._get_mutex(mutex)
         rec["unlocked"] += 1
-        held_time = timestamp[0] - rec["locked_time"]
-        rec["held_times"].append(held_time)
         rec["unlock_loc"] = (filename, line)
-
+        if "locked_loc" not in rec:
+            return
+        held_time = max(timestamp - rec["locked_time"], 0)
+        rec["stats"].held_times.record(held_time)
+        self._get_site(*rec["locked_loc"]).held_times.record(held_time)
+
+
+def format_site(site):
+    "filename:line of a call site"
+    filename, line = site
+    if isinstance(filename, bytes):
+        filename = filename.decode(errors="replace")
+    return "%s:%s" % (filename, line)
+
+def format_times(name, histogram):
+    "Summarise a histogram of times in ns"
+    return ("  %s: min:%d median:%d avg:%.2f p99:%d max:%d total:%d" %
+            (name, histogram.min, histogram.percentile(50), histogram.mean(),
+             histogram.percentile(99), histogram.max, histogram.total))
+
+def top(items, n):
+    "The n items with the largest total acquire time, or all if n is 0"
+    items = sorted(items, key=lambda item: -item[1].acquire_times.total)
+    return items[:n] if n > 0 else items
 
 def get_args():
     "Grab options"
     parser = argparse.ArgumentParser()
     parser.add_argument("--output", "-o", type=str, help="Render plot to file")
+    parser.add_argument("--top", "-n", type=int, default=10,
+                        help="report the N most contended locks and call "
+                             "sites (0 for all)")
+    parser.add_argument("--timeline", type=str,
+                        help="write the wait-for timeline to this CSV file")
+    parser.add_argument("--timeline-interval", type=int, default=10**9,
+                        help="interval of the timeline in ns")
     parser.add_argument("events", type=str, help='trace file read from')
     parser.add_argument("tracefile", type=str, help='trace file read from')
     return parser.parse_args()
@@ -69,31 +131,45 @@ if __name__ == '__main__':
     args = get_args()
 
     # Gather data from the trace
-    analyser = MutexAnalyser()
+    analyser = MutexAnalyser(args.timeline_interval if args.timeline else None)
     simpletrace.process(args.events, args.tracefile, analyser)
 
     print ("Total locks: %d, locked: %d, unlocked: %d" %
            (analyser.locks, analyser.locked, analyser.unlocks))
 
-    # Now dump the individual lock stats
-    for key, val in sorted(analyser.mutex_records.iteritems(),
-                           key=lambda k_v: k_v[1]["locks"]):
+    # Now dump the stats of the most contended locks
+    mutexes = [(key, val["stats"]) for key, val in analyser.mutex_records.items()]
+    for key, stats in top(mutexes, args.top):
+        val = analyser.mutex_records[key]
         print ("Lock: %#x locks: %d, locked: %d, unlocked: %d" %
                (key, val["locks"], val["locked"], val["unlocked"]))
 
-        acquire_times = np.array(val["acquire_times"])
-        if len(acquire_times) > 0:
-            print ("  Acquire Time: min:%d median:%d avg:%.2f max:%d" %
-                   (acquire_times.min(), np.median(acquire_times),
-                    acquire_times.mean(), acquire_times.max()))
+        if stats.acquire_times.count > 0:
+            print (format_times("Acquire Time", stats.acquire_times))
 
-        held_times = np.array(val["held_times"])
-        if len(held_times) > 0:
-            print ("  Held Time: min:%d median:%d avg:%.2f max:%d" %
-                   (held_times.min(), np.median(held_times),
-                    held_times.mean(), held_times.max()))
+        if stats.held_times.count > 0:
+            print (format_times("Held Time", stats.held_times))
 
         # Check if any locks still held
         if val["locks"] > val["locked"]:
-            print ("  LOCK HELD (%s:%s)" % (val["locked_loc"]))
-            print ("  BLOCKED   (%s:%s)" % (val["lock_loc"]))
+            print ("  LOCK HELD (%s)" % format_site(val.get("locked_loc", ("?", "?"))))
+            print ("  BLOCKED   (%s)" % format_site(val["lock_loc"]))
+
+    # And the call sites that wait or hold locks the longest
+    for site, stats in top(analyser.sites.items(), args.top):
+        print ("Site: %s acquires: %d, holds: %d" %
+               (format_site(site), stats.acquire_times.count,
+                stats.held_times.count))
+
+        if stats.acquire_times.count > 0:
+            print (format_times("Acquire Time", stats.acquire_times))
+
+        if stats.held_times.count > 0:
+            print (format_times("Held Time", stats.held_times))
+
+    if args.timeline:
+        with open(args.timeline, "w") as f:
+            f.write("time_ns,acquires,total_wait_ns,max_wait_ns\n")
+            for interval, (count, total, longest) in sorted(analyser.timeline.items()):
+                f.write("%d,%d,%d,%d\n" % (interval * args.timeline_interval,
+                                           count, total, longest))
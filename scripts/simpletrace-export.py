@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+#
+# Export a simple trace backend file as columnar NumPy arrays
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or later.
+# See the COPYING file in the top-level directory.
+#
+# For help see docs/devel/tracing.txt
+
+from __future__ import print_function
+import argparse
+import simpletrace
+
+def get_args():
+    "Grab options"
+    parser = argparse.ArgumentParser(
+        description="Export the records of a trace file to a NumPy .npz "
+                    "file, with one array per event and column.")
+    parser.add_argument("--event", "-e", action="append", dest="events",
+                        help="export only this event (may be repeated)")
+    parser.add_argument("--compress", "-z", action="store_true",
+                        help="compress the arrays")
+    parser.add_argument("--no-header", action="store_true",
+                        help="the trace file has no header (old format)")
+    parser.add_argument("eventsfile", type=str, help='trace-events-all file')
+    parser.add_argument("tracefile", type=str, help='trace file to export')
+    parser.add_argument("outfile", type=str, help='.npz file to write')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+
+    simpletrace.export_columns(args.eventsfile, args.tracefile, args.outfile,
+                               event_names=args.events,
+                               read_header=not args.no_header,
+                               compress=args.compress)
+
+    for name, columns in sorted(simpletrace.load_columns(args.outfile).items()):
+        print("%s: %d records" % (name, len(columns['timestamp'])))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+#
+# Build or inspect the sidecar index of a simple trace backend file
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or later.
+# See the COPYING file in the top-level directory.
+#
+# For help see docs/devel/tracing.txt
+
+from __future__ import print_function
+import argparse
+import os
+import simpletrace
+
+def get_args():
+    "Grab options"
+    parser = argparse.ArgumentParser(
+        description="Build the index of a trace file (<trace-file>.idx), "
+                    "or print a summary of an existing index.")
+    parser.add_argument("--interval", "-n", type=int,
+                        default=simpletrace.default_index_interval,
+                        help="index one record out of this many")
+    parser.add_argument("--info", action="store_true",
+                        help="print the time range and event counts of the "
+                             "trace, building the index if needed")
+    parser.add_argument("tracefile", type=str, help='trace file to index')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+
+    index_path = args.tracefile + '.idx'
+    if args.info and os.path.exists(index_path):
+        with simpletrace.TraceIndex(index_path) as index:
+            stale = index.trace_size != os.path.getsize(args.tracefile)
+    else:
+        stale = True
+    if stale:
+        simpletrace.build_index(args.tracefile, index_path, args.interval)
+
+    with simpletrace.TraceIndex(index_path) as index:
+        if len(index) == 0:
+            print("%s: no records" % args.tracefile)
+        else:
+            print("%s: %d blocks of %d records, timestamps %d to %d" %
+                  (index_path, len(index), index.interval,
+                   index.entry(0)[1], index.entry(len(index) - 1)[1]))
+        if args.info:
+            for name, count in sorted(index.event_counts().items(),
+                                      key=lambda name_count: -name_count[1]):
+                print("  %s: %d" % (name, count))
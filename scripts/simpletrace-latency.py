@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Latency distributions of paired start and end events of a simple trace
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or later.
+# See the COPYING file in the top-level directory.
+#
+# For help see docs/devel/tracing.txt
+
+from __future__ import print_function
+import argparse
+import simpletrace
+
+def get_args():
+    "Grab options"
+    parser = argparse.ArgumentParser(
+        description="Print the latency distribution between start and end "
+                    "events, e.g. --pair v9fs_read:v9fs_read_return:tag,id")
+    parser.add_argument("--pair", "-p", action="append", required=True,
+                        type=simpletrace.Pairing.parse,
+                        help="start:end[:key,...[:group,...]], the key "
+                             "arguments pairing the records and the group "
+                             "arguments splitting the distribution")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of processes reading the trace")
+    parser.add_argument("events", type=str, help='trace-events-all file')
+    parser.add_argument("tracefile", type=str, help='trace file to analyse')
+    return parser.parse_args()
+
+def format_group(pairing, group):
+    if not pairing.group:
+        return "all"
+    return " ".join("%s=%s" % (name, value if isinstance(value, str) or
+                               isinstance(value, bytes) else hex(value))
+                    for name, value in zip(pairing.group, group))
+
+if __name__ == '__main__':
+    args = get_args()
+
+    analyzer = simpletrace.PairingAnalyzer(args.pair)
+    if args.jobs > 1:
+        simpletrace.process_parallel(args.events, args.tracefile, analyzer,
+                                     jobs=args.jobs)
+    else:
+        simpletrace.process(args.events, args.tracefile, analyzer)
+
+    for pairing in args.pair:
+        state = analyzer.states[pairing.name]
+        print("%s -> %s: %d pairs, %d unmatched starts, %d unpaired ends, "
+              "%d pending" %
+              (pairing.start, pairing.end,
+               sum(h.count for h in state.histograms.values()),
+               state.unmatched, state.orphan_count, len(state.pending)))
+        for group, histogram in sorted(state.histograms.items(),
+                                       key=lambda item: -item[1].count):
+            summary = histogram.summary()
+            print("  %s: count %d min %d mean %.1f p50 %d p90 %d p99 %d "
+                  "p99.9 %d max %d (ns)" %
+                  (format_group(pairing, group), summary['count'],
+                   summary['min'], summary['mean'], summary['p50'],
+                   summary['p90'], summary['p99'], summary['p99.9'],
+                   summary['max']))
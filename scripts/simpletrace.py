@@ -12,9 +12,16 @@
 from __future__ import print_function
 import struct
 import inspect
+import mmap
+import os
+import time
+import zlib
 from tracetool import read_events, Event
 from tracetool.backend.simple import is_string
 
+# inspect.getargspec is gone in Python 3.11
+getargspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+
 header_event_id = 0xffffffffffffffff
 header_magic    = 0xf2b177cb0aa429b4
 dropped_event_id = 0xfffffffffffffffe
@@ -25,6 +32,44 @@ record_type_event = 1
 log_header_fmt = '=QQQ'
 rec_header_fmt = '=QQII'
 
+# Version of block-compressed trace files, see BlockReader.  Their blocks
+# start with the compressed length, the decompressed length and the
+# timestamp of the first event record (0 if there is none).
+compressed_log_version = 5
+block_header_struct = struct.Struct('=LLQ')
+default_block_size = 256 * 1024
+
+# Record type followed by the record header, and by the mapping header
+event_struct = struct.Struct('=Q' + rec_header_fmt[1:])
+mapping_struct = struct.Struct('=QQL')
+u64_struct = struct.Struct('=Q')
+u32_struct = struct.Struct('=L')
+
+# Size of the reads done by read_trace_records
+read_chunk_size = 4 * 1024 * 1024
+
+# Polling interval of FollowReader, in seconds
+follow_interval = 0.1
+
+# Sidecar index files, see TraceIndex
+index_magic = b'QTRACEIX'
+index_version = 1
+index_header_struct = struct.Struct('=8sQQQQQQ')
+index_entry_struct = struct.Struct('=QQQQ')
+index_count_struct = struct.Struct('=QQ')
+default_index_interval = 4096
+
+# Resynchronization on record boundaries, see find_record_boundary: bytes
+# searched, records that must decode consistently, largest plausible record
+resync_window = 1024 * 1024
+resync_records = 16
+resync_max_record_size = 1024 * 1024
+
+# Records written by concurrent threads can be slightly out of order, so
+# reading a time window only stops after this many consecutive records later
+# than its end, see read_trace_records
+window_end_records = default_index_interval
+
 def read_header(fobj, hfmt):
     '''Read a trace record header'''
     hlen = struct.calcsize(hfmt)
@@ -91,36 +136,538 @@ def read_trace_header(fobj):
                          (header[1], header_magic))
 
     log_version = header[2]
-    if log_version not in [0, 2, 3, 4]:
+    if log_version not in [0, 2, 3, 4, compressed_log_version]:
         raise ValueError('Unknown version of tracelog format!')
-    if log_version != 4:
+    if log_version not in [4, compressed_log_version]:
         raise ValueError('Log format %d not supported with this QEMU release!'
                          % log_version)
+    return log_version
+
+def build_args_decoder(event):
+    """Return a function decoding the arguments of a record of `event`.
+
+    The function takes a buffer and the offset of the arguments in it, and
+    returns the tuple of arguments.  Consecutive integer arguments are decoded
+    with a single precompiled struct."""
+    steps = []
+    for type, name in event.args:
+        if is_string(type):
+            steps.append(None)
+        elif steps and steps[-1] is not None:
+            steps[-1] += 'Q'
+        else:
+            steps.append('=Q')
+
+    if steps == [] or steps == ['=' + 'Q' * len(event.args)]:
+        return struct.Struct('=' + 'Q' * len(event.args)).unpack_from
+
+    steps = [struct.Struct(fmt) if fmt is not None else None for fmt in steps]
+    unpack_u32 = u32_struct.unpack_from
+    def decode(buf, offset):
+        args = []
+        for step in steps:
+            if step is None:
+                (length,) = unpack_u32(buf, offset)
+                offset += 4
+                args.append(buf[offset:offset + length])
+                offset += length
+            else:
+                args.extend(step.unpack_from(buf, offset))
+                offset += step.size
+        return tuple(args)
+    return decode
+
+def fill_buffer(fobj, buf, pos, size):
+    """Return (buf, pos) such that buf[pos:] holds the unread part of the
+    given buffer followed by new data from fobj, at least `size` bytes unless
+    the file ends first."""
+    if len(buf) - pos >= size:
+        return buf, pos
+    chunks = [buf[pos:]]
+    available = len(chunks[0])
+    while available < size:
+        chunk = fobj.read(max(read_chunk_size, size - available))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        available += len(chunk)
+    return b''.join(chunks), 0
+
+def get_event_name(idtoname, event_id):
+    """Return the name of an event ID."""
+    if event_id == dropped_event_id:
+        return "dropped"
+    return idtoname[event_id]
+
+def get_decoder(edict, idtoname, event_id):
+    """Return the name of an event ID and the decoder of its arguments."""
+    if event_id == dropped_event_id:
+        return "dropped", u64_struct.unpack_from
+    name = idtoname[event_id]
+    try:
+        event = edict[name]
+    except KeyError as e:
+        import sys
+        sys.stderr.write('%s event is logged but is not declared ' \
+                         'in the trace events file, try using ' \
+                         'trace-events-all instead.\n' % str(e))
+        sys.exit(1)
+    return name, build_args_decoder(event)
+
+class BoundedReader(object):
+    """File wrapper whose reads stop at a given offset of the file."""
+
+    def __init__(self, fobj, end):
+        self.fobj = fobj
+        self.remaining = max(end - fobj.tell(), 0)
+
+    def read(self, size):
+        data = self.fobj.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+class FollowReader(object):
+    """File wrapper for a trace file that is still being written.
 
-def read_trace_records(edict, idtoname, fobj):
+    At the end of the file, read() polls the file every `interval` seconds
+    until new data arrives, instead of returning an empty string, so that
+    read_trace_records() yields the records as QEMU writes them.  If
+    `timeout` is given, read() returns an empty string once no data has
+    arrived for that many seconds."""
+
+    def __init__(self, fobj, interval=follow_interval, timeout=None):
+        self.fobj = fobj
+        self.interval = interval
+        self.timeout = timeout
+
+    def read(self, size):
+        waited = 0
+        while True:
+            data = self.fobj.read(size)
+            if data:
+                return data
+            if self.timeout is not None and waited >= self.timeout:
+                return b''
+            time.sleep(self.interval)
+            waited += self.interval
+
+    def close(self):
+        self.fobj.close()
+
+def read_exactly(fobj, size):
+    """Read `size` bytes from a file, or less if the file ends first."""
+    data = fobj.read(size)
+    while 0 < len(data) < size:
+        chunk = fobj.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+class BlockReader(object):
+    """File wrapper decompressing the blocks of a compressed trace file.
+
+    Compressed trace files (written with "-trace compress=on") hold the
+    records in a sequence of zlib-compressed blocks that end on record
+    boundaries.  read() returns the decompressed records, so that
+    read_trace_records() can decode them, starting from the block at the
+    current position of the file.  Reading stops at a truncated block.
+    tell() returns the offset in the decompressed records."""
+
+    def __init__(self, fobj):
+        self.fobj = fobj
+        self.data = b''
+        self.pos = 0
+        self.offset = 0
+
+    def read(self, size):
+        while self.pos == len(self.data):
+            header = read_exactly(self.fobj, block_header_struct.size)
+            if len(header) < block_header_struct.size:
+                return b''
+            compressed_length, _, _ = block_header_struct.unpack(header)
+            compressed = read_exactly(self.fobj, compressed_length)
+            if len(compressed) < compressed_length:
+                return b''
+            self.data = zlib.decompress(compressed)
+            self.pos = 0
+        data = self.data[self.pos:self.pos + size]
+        self.pos += len(data)
+        self.offset += len(data)
+        return data
+
+    def tell(self):
+        return self.offset
+
+    def close(self):
+        self.fobj.close()
+
+def read_block_index(fobj):
+    """Return (offset, timestamp) for each block of a compressed trace file,
+    from the current position, reading only the block headers."""
+    blocks = []
+    offset = fobj.tell()
+    size = os.fstat(fobj.fileno()).st_size
+    while offset + block_header_struct.size <= size:
+        fobj.seek(offset)
+        compressed_length, _, timestamp = block_header_struct.unpack(
+            fobj.read(block_header_struct.size))
+        blocks.append((offset, timestamp))
+        offset += block_header_struct.size + compressed_length
+    return blocks
+
+def compress_trace(log_path, out_path, block_size=default_block_size):
+    """Write a trace file in the block-compressed format, like QEMU does with
+    "-trace compress=on"."""
+    with open(log_path, 'rb') as log, open(out_path, 'wb') as out:
+        if read_trace_header(log) == compressed_log_version:
+            raise ValueError('%s is already compressed' % log_path)
+        out.write(struct.pack(log_header_fmt, header_event_id, header_magic,
+                              compressed_log_version))
+        # Blocks start at the event records following block_size bytes
+        start = log.tell()
+        timestamp = None
+        boundaries = []
+        for offset, _, record_timestamp in scan_trace_records(log, {}):
+            if timestamp is None:
+                timestamp = record_timestamp
+            elif offset - start >= block_size:
+                boundaries.append((start, offset, timestamp))
+                start, timestamp = offset, record_timestamp
+        boundaries.append((start, os.fstat(log.fileno()).st_size, timestamp or 0))
+
+        for start, end, timestamp in boundaries:
+            if start == end:
+                continue
+            log.seek(start)
+            data = log.read(end - start)
+            compressed = zlib.compress(data, 1)
+            out.write(block_header_struct.pack(len(compressed), len(data),
+                                               timestamp))
+            out.write(compressed)
+
+def read_trace_records(edict, idtoname, fobj, end=None, event_names=None,
+                       start_time=None, end_time=None):
     """Deserialize trace records from a file, yielding record tuples (event_num, timestamp, pid, arg1, ..., arg6).
 
     Note that `idtoname` is modified if the file contains mapping records.
 
+    The file is read in chunks of read_chunk_size bytes and each record is
+    decoded from memory, with a decoder built once per event ID.  Reading
+    stops at the end of the file or at a truncated record.
+
+    If `event_names` is given, the records of other events are skipped by
+    their length, without decoding their arguments.  Records outside of the
+    window from `start_time` to `end_time` are skipped the same way, and
+    reading stops after window_end_records consecutive records later than
+    `end_time`.
+
     Args:
         edict (str -> Event): events dict, indexed by name
         idtoname (int -> str): event names dict, indexed by event ID
         fobj (file): input file
+        end (int): file offset at which to stop reading, if given
+        event_names (set of str): names of the events to yield, if given
+        start_time (int): timestamp of the first records to yield, if given
+        end_time (int): timestamp of the last records to yield, if given
 
     """
+    if end is not None:
+        fobj = BoundedReader(fobj, end)
+    if start_time is None:
+        start_time = 0
+    if end_time is None:
+        end_time = 1 << 64
+    decoders = {}
+    buf = b''
+    pos = 0
+    past_end_records = 0
+    header_size = event_struct.size
+    unpack_header = event_struct.unpack_from
     while True:
-        t = fobj.read(8)
-        if len(t) == 0:
-            break
+        if len(buf) - pos < header_size:
+            buf, pos = fill_buffer(fobj, buf, pos, header_size)
+            if len(buf) - pos < mapping_struct.size:
+                break
 
-        (rectype, ) = struct.unpack('=Q', t)
+        (rectype,) = u64_struct.unpack_from(buf, pos)
         if rectype == record_type_mapping:
-            event_id, name = get_mapping(fobj)
-            idtoname[event_id] = name
+            _, event_id, length = mapping_struct.unpack_from(buf, pos)
+            size = mapping_struct.size + length
+            buf, pos = fill_buffer(fobj, buf, pos, size)
+            if len(buf) - pos < size:
+                break
+            idtoname[event_id] = buf[pos + mapping_struct.size:pos + size].decode()
+            decoders.pop(event_id, None)
+            pos += size
+            continue
+
+        if len(buf) - pos < header_size:
+            break
+        _, event_id, timestamp, length, pid = unpack_header(buf, pos)
+        if timestamp > end_time:
+            past_end_records += 1
+            if past_end_records > window_end_records:
+                break
         else:
-            rec = read_record(edict, idtoname, fobj)
+            past_end_records = 0
+        size = u64_struct.size + length
+        if len(buf) - pos < size:
+            buf, pos = fill_buffer(fobj, buf, pos, size)
+            if len(buf) - pos < size:
+                break
+        if timestamp < start_time or timestamp > end_time:
+            pos += size
+            continue
+
+        try:
+            name, decode = decoders[event_id]
+        except KeyError:
+            if event_names is not None and \
+               get_event_name(idtoname, event_id) not in event_names:
+                name, decode = decoders[event_id] = None, None
+            else:
+                name, decode = decoders[event_id] = get_decoder(edict, idtoname, event_id)
+        if decode is not None:
+            yield (name, timestamp, pid) + decode(buf, pos + header_size)
+        pos += size
+
+def scan_trace_records(fobj, idtoname):
+    """Yield (offset, event_id, timestamp) for each event record of a file,
+    from the current position, without decoding the arguments.
+
+    Note that `idtoname` is modified if the file contains mapping records.
+    """
+    buf = b''
+    pos = 0
+    base = fobj.tell()  # file offset of buf[0]
+    header_size = event_struct.size
+    while True:
+        if len(buf) - pos < header_size:
+            base += pos
+            buf, pos = fill_buffer(fobj, buf, pos, header_size)
+            if len(buf) - pos < mapping_struct.size:
+                break
+
+        (rectype,) = u64_struct.unpack_from(buf, pos)
+        if rectype == record_type_mapping:
+            _, event_id, length = mapping_struct.unpack_from(buf, pos)
+            size = mapping_struct.size + length
+            if len(buf) - pos < size:
+                base += pos
+                buf, pos = fill_buffer(fobj, buf, pos, size)
+                if len(buf) - pos < size:
+                    break
+            idtoname[event_id] = buf[pos + mapping_struct.size:pos + size].decode()
+            pos += size
+            continue
+
+        if len(buf) - pos < header_size:
+            break
+        _, event_id, timestamp, length, _ = event_struct.unpack_from(buf, pos)
+        size = u64_struct.size + length
+        if len(buf) - pos < size:
+            base += pos
+            buf, pos = fill_buffer(fobj, buf, pos, size)
+            if len(buf) - pos < size:
+                break
+
+        yield base + pos, event_id, timestamp
+        pos += size
+
+def is_record_chain(buf, pos, idtoname, at_eof):
+    """Return whether the event records starting at buf[pos] look valid for
+    resync_records records, or until the end of the file if `at_eof`."""
+    header_size = event_struct.size
+    for _ in range(resync_records):
+        if len(buf) - pos < header_size:
+            return at_eof
+        rectype, event_id, _, length, _ = event_struct.unpack_from(buf, pos)
+        if (rectype != record_type_event or
+            (event_id not in idtoname and event_id != dropped_event_id) or
+            length < header_size - u64_struct.size or
+            length > resync_max_record_size):
+            return False
+        pos += u64_struct.size + length
+        if pos > len(buf):
+            return False
+    return True
+
+def find_record_boundary(fobj, offset, idtoname):
+    """Return the offset of the first event record at or after `offset`, or
+    None if none is found in the next resync_window bytes.
+
+    Records carry no sync marker, so a candidate offset is accepted when
+    resync_records consecutive records decode with a known event ID and a
+    plausible length.  This is only meant for traces without mapping records
+    after the start of the file, as written by QEMU."""
+    fobj.seek(offset)
+    buf = fobj.read(resync_window)
+    at_eof = len(buf) < resync_window
+    for pos in range(len(buf)):
+        if is_record_chain(buf, pos, idtoname, at_eof):
+            return offset + pos
+    return None
+
+def open_index(log_path):
+    """Return the TraceIndex of a trace file, or None if it has no valid index
+    or if the trace changed since it was indexed."""
+    index_path = log_path + '.idx'
+    if not os.path.exists(index_path):
+        return None
+    try:
+        index = TraceIndex(index_path)
+    except (OSError, ValueError):
+        return None
+    if index.trace_size != os.path.getsize(log_path):
+        index.close()
+        return None
+    return index
+
+def build_index(log_path, index_path=None, interval=default_index_interval):
+    """Write the sidecar index of a trace file, see TraceIndex.
+
+    One record out of `interval` is indexed.  Returns the index path."""
+    if index_path is None:
+        index_path = log_path + '.idx'
+
+    entries = []
+    counts = []
+    block_counts = {}
+    idtoname = {dropped_event_id: "dropped"}
+    with open(log_path, 'rb') as log:
+        if read_trace_header(log) == compressed_log_version:
+            raise ValueError('compressed traces are indexed by their block '
+                             'headers, see read_block_index()')
+        for n, (offset, event_id, timestamp) in enumerate(scan_trace_records(log, idtoname)):
+            if n % interval == 0:
+                counts.extend(sorted(block_counts.items()))
+                entries.append((offset, timestamp, len(counts)))
+                block_counts = {}
+            block_counts[event_id] = block_counts.get(event_id, 0) + 1
+        trace_size = log.tell()
+    counts.extend(sorted(block_counts.items()))
+
+    with open(index_path, 'wb') as f:
+        f.write(index_header_struct.pack(index_magic, index_version, interval,
+                                         trace_size, len(entries), len(counts),
+                                         len(idtoname)))
+        for i, (offset, timestamp, first_count) in enumerate(entries):
+            end_count = entries[i + 1][2] if i + 1 < len(entries) else len(counts)
+            f.write(index_entry_struct.pack(offset, timestamp, first_count,
+                                            end_count - first_count))
+        for event_id, count in counts:
+            f.write(index_count_struct.pack(event_id, count))
+        for event_id, name in sorted(idtoname.items()):
+            name = name.encode()
+            f.write(mapping_struct.pack(record_type_mapping, event_id, len(name)) + name)
+    return index_path
 
-            yield rec
+class TraceIndex(object):
+    """Sparse index of a trace file, stored in a sidecar file.
+
+    The index divides the trace into blocks of `interval` records.  For each
+    block, it holds the file offset and the timestamp of its first record,
+    and the number of records of each event ID in it.  It also holds the
+    event ID mapping of the whole trace, so that the records can be read
+    starting from any block with read_trace_records().  `trace_size` is the
+    size of the trace file when it was indexed.
+
+    The index file is memory-mapped and entries are only decoded on demand, so
+    looking up a timestamp costs O(log n) even for huge traces.  Timestamps
+    are assumed to increase along the file; records written concurrently by
+    several threads can be slightly out of order, so callers interested in a
+    time window should start one block early.
+
+    Build the index with build_index() or scripts/simpletrace-index.py.
+    """
+
+    def __init__(self, index_path):
+        self.fobj = open(index_path, 'rb')
+        self.data = None
+        try:
+            self.read_header()
+        except (ValueError, struct.error):
+            self.close()
+            raise ValueError('Not a valid trace index!')
+
+    def read_header(self):
+        # mmap raises ValueError for an empty file
+        self.data = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.interval, self.trace_size, self.num_entries,
+         num_counts, num_mappings) = index_header_struct.unpack_from(self.data, 0)
+        if magic != index_magic or version != index_version:
+            raise ValueError('Not a valid trace index!')
+
+        self.entries_offset = index_header_struct.size
+        self.counts_offset = self.entries_offset + self.num_entries * index_entry_struct.size
+        offset = self.counts_offset + num_counts * index_count_struct.size
+        self.idtoname = {}
+        for _ in range(num_mappings):
+            _, event_id, length = mapping_struct.unpack_from(self.data, offset)
+            offset += mapping_struct.size
+            self.idtoname[event_id] = self.data[offset:offset + length].decode()
+            offset += length
+        if offset > len(self.data):
+            raise ValueError('Not a valid trace index!')
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.fobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.num_entries
+
+    def entry(self, block):
+        """Return (offset, timestamp) of the first record of a block."""
+        offset, timestamp, _, _ = index_entry_struct.unpack_from(
+            self.data, self.entries_offset + block * index_entry_struct.size)
+        return offset, timestamp
+
+    def block_counts(self, block):
+        """Return the number of records of each event name in a block."""
+        _, _, first_count, num_counts = index_entry_struct.unpack_from(
+            self.data, self.entries_offset + block * index_entry_struct.size)
+        counts = {}
+        for i in range(first_count, first_count + num_counts):
+            event_id, count = index_count_struct.unpack_from(
+                self.data, self.counts_offset + i * index_count_struct.size)
+            counts[self.idtoname.get(event_id, event_id)] = count
+        return counts
+
+    def event_counts(self):
+        """Return the number of records of each event name in the trace."""
+        counts = {}
+        for block in range(self.num_entries):
+            for name, count in self.block_counts(block).items():
+                counts[name] = counts.get(name, 0) + count
+        return counts
+
+    def find_block(self, timestamp):
+        """Return the last block whose first record is not later than
+        `timestamp`, or 0 if there is none."""
+        low, high = 0, self.num_entries
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[1] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return max(low - 1, 0)
+
+    def blocks_with_events(self, names):
+        """Return the blocks that contain records of any of the given event
+        names."""
+        names = set(names)
+        return [block for block in range(self.num_entries)
+                if names.intersection(self.block_counts(block))]
 
 class Analyzer(object):
     """A trace file analyzer which processes trace records.
@@ -151,8 +698,22 @@ class Analyzer(object):
 
       def runstate_set(self, timestamp, pid, new_state):
           ...
+
+    An analyzer that only handles a few events can list their names in the
+    event_names attribute.  The records of the other events are then skipped
+    without being decoded, and catchall() is not invoked for them::
+
+      event_names = ('qemu_mutex_lock', 'qemu_mutex_unlock')
+
+    An analyzer that defines a merge(other) method can run on several CPUs
+    with process_parallel(), which runs a copy of the analyzer on each part
+    of the trace and merges them, in trace order, into the analyzer it is
+    given.  `other` has processed the part following the records merged so
+    far, and its end() method has not been called.
     """
 
+    event_names = None
+
     def begin(self):
         """Called at the start of the trace."""
         pass
@@ -165,15 +726,21 @@ class Analyzer(object):
         """Called at the end of the trace."""
         pass
 
-def process(events, log, analyzer, read_header=True):
-    """Invoke an analyzer on each event in a log."""
+def open_trace(events, log, read_header=True):
+    """Prepare a log for read_trace_records().
+
+    `events` and `log` may be file names or already opened files.  Returns
+    the log file, positioned at the first record, and the edict and idtoname
+    dicts expected by read_trace_records().  Compressed logs are returned
+    wrapped in a BlockReader."""
     if isinstance(events, str):
         events = read_events(open(events, 'r'), events)
     if isinstance(log, str):
         log = open(log, 'rb')
 
     if read_header:
-        read_trace_header(log)
+        if read_trace_header(log) == compressed_log_version:
+            log = BlockReader(log)
 
     dropped_event = Event.build("Dropped_Event(uint64_t num_events_dropped)")
     edict = {"dropped": dropped_event}
@@ -187,6 +754,10 @@ def process(events, log, analyzer, read_header=True):
         for event_id, event in enumerate(events):
             idtoname[event_id] = event.name
 
+    return log, edict, idtoname
+
+def process_records(edict, records, analyzer):
+    """Invoke the methods of an analyzer on each record of an iterable."""
     def build_fn(analyzer, event):
         if isinstance(event, str):
             return analyzer.catchall
@@ -196,7 +767,7 @@ def process(events, log, analyzer, read_header=True):
             return analyzer.catchall
 
         event_argcount = len(event.args)
-        fn_argcount = len(inspect.getargspec(fn)[0]) - 1
+        fn_argcount = len(getargspec(fn)[0]) - 1
         if fn_argcount == event_argcount + 1:
             # Include timestamp as first argument
             return lambda _, rec: fn(*(rec[1:2] + rec[3:3 + event_argcount]))
@@ -207,16 +778,588 @@ def process(events, log, analyzer, read_header=True):
             # Just arguments, no timestamp or pid
             return lambda _, rec: fn(*rec[3:3 + event_argcount])
 
-    analyzer.begin()
     fn_cache = {}
-    for rec in read_trace_records(edict, idtoname, log):
+    for rec in records:
         event_num = rec[0]
         event = edict[event_num]
         if event_num not in fn_cache:
             fn_cache[event_num] = build_fn(analyzer, event)
         fn_cache[event_num](event, rec)
+
+def find_time_offset(log, first_offset, idtoname, timestamp):
+    """Return the offset of an event record of a trace file, shortly before
+    the first record at `timestamp`, by bisecting the file.
+
+    The bisection probes offsets with find_record_boundary() and stops when
+    the remaining range is smaller than resync_window bytes."""
+    low = first_offset
+    high = os.fstat(log.fileno()).st_size
+    while high - low > resync_window:
+        middle = (low + high) // 2
+        offset = find_record_boundary(log, middle, idtoname)
+        if offset is None or offset >= high:
+            high = middle
+            continue
+        log.seek(offset)
+        _, _, record_timestamp, _, _ = event_struct.unpack(
+            log.read(event_struct.size))
+        if record_timestamp < timestamp:
+            low = offset
+        else:
+            high = middle
+    return low
+
+def seek_time(log, idtoname, timestamp, index=None):
+    """Position a log returned by open_trace() shortly before its first
+    record at `timestamp`, and return it.
+
+    The records are located with a TraceIndex if one is given, with the
+    block headers of compressed traces, or else by bisecting the file with
+    find_time_offset().  Since records written by concurrent threads can be
+    slightly out of order, reading starts one index block early.  Logs that
+    can't seek, such as a FollowReader, are returned unchanged."""
+    fobj = log.fobj if isinstance(log, BlockReader) else log
+    if not hasattr(fobj, 'seek') or not hasattr(fobj, 'fileno'):
+        return log
+
+    # Read the mapping records at the start of the trace
+    first = next(scan_trace_records(log, idtoname), None)
+    if first is None:
+        return log
+
+    if isinstance(log, BlockReader):
+        fobj.seek(struct.calcsize(log_header_fmt))
+        blocks = read_block_index(fobj)
+        block = 0
+        for i, (_, block_timestamp) in enumerate(blocks):
+            if block_timestamp and block_timestamp > timestamp:
+                break
+            block = i
+        fobj.seek(blocks[max(block - 1, 0)][0])
+        return BlockReader(fobj)
+
+    if index is not None:
+        offset = index.entry(max(index.find_block(timestamp) - 1, 0))[0]
+    else:
+        offset = find_time_offset(log, first[0], idtoname, timestamp)
+    log.seek(offset)
+    return log
+
+def process(events, log, analyzer, read_header=True, follow=False,
+            start_time=None, end_time=None):
+    """Invoke an analyzer on each event in a log.
+
+    With `follow`, the log is read through a FollowReader: the analyzer
+    keeps receiving records as they are written, until it is interrupted
+    with KeyboardInterrupt.  Its end() method is invoked in either case.
+
+    With `start_time` and `end_time`, only the records in that window of
+    timestamps are processed.  The reading starts close to `start_time`,
+    see seek_time(), using the index of the log if it has an up-to-date
+    one."""
+    index = None
+    if start_time is not None and isinstance(log, str) and not follow:
+        index = open_index(log)
+    if follow:
+        if isinstance(log, str):
+            log = open(log, 'rb')
+        log = FollowReader(log)
+    log, edict, idtoname = open_trace(events, log, read_header)
+    if start_time is not None:
+        log = seek_time(log, idtoname, start_time, index)
+        if index is not None:
+            index.close()
+
+    analyzer.begin()
+    try:
+        records = read_trace_records(edict, idtoname, log,
+                                     event_names=analyzer.event_names,
+                                     start_time=start_time, end_time=end_time)
+        process_records(edict, records, analyzer)
+    except KeyboardInterrupt:
+        if not follow:
+            raise
     analyzer.end()
 
+def split_trace(log, first_offset, idtoname, parts, index=None):
+    """Return the offsets at which a trace file can be split into about
+    `parts` parts of equal size, starting with `first_offset`, the offset of
+    the first event record.
+
+    The offsets are taken from the blocks of a TraceIndex if given, or else
+    found with find_record_boundary().  Compressed logs are split at their
+    blocks instead, `first_offset` being the offset of the first block."""
+    if isinstance(log, BlockReader):
+        log.fobj.seek(first_offset)
+        blocks = read_block_index(log.fobj)
+        offsets = [blocks[len(blocks) * i // parts][0]
+                   for i in range(parts) if len(blocks) * i // parts < len(blocks)]
+    elif index is not None:
+        blocks = len(index)
+        offsets = [index.entry(blocks * i // parts)[0]
+                   for i in range(parts) if blocks * i // parts < blocks]
+    else:
+        size = os.fstat(log.fileno()).st_size
+        offsets = [first_offset]
+        for i in range(1, parts):
+            offset = first_offset + (size - first_offset) * i // parts
+            offset = find_record_boundary(log, offset, idtoname)
+            if offset is not None:
+                offsets.append(offset)
+    return sorted(set([first_offset] + offsets))
+
+# Trace shared by the worker processes of process_parallel().  Event objects
+# can't be pickled, so the workers inherit it when they are forked.
+worker_trace = {}
+
+def init_worker(edict, idtoname, log_path, compressed):
+    worker_trace.update(edict=edict, idtoname=idtoname, log_path=log_path,
+                        compressed=compressed)
+
+def process_part(args):
+    """Run an analyzer on the records of a trace file between two offsets.
+    Worker function of process_parallel()."""
+    start, end, analyzer = args
+    edict = worker_trace['edict']
+    idtoname = worker_trace['idtoname']
+    with open(worker_trace['log_path'], 'rb') as log:
+        log.seek(start)
+        analyzer.begin()
+        if worker_trace['compressed']:
+            if end is not None:
+                log = BoundedReader(log, end)
+            records = read_trace_records(edict, idtoname, BlockReader(log),
+                                         event_names=analyzer.event_names)
+        else:
+            records = read_trace_records(edict, idtoname, log, end,
+                                         analyzer.event_names)
+        process_records(edict, records, analyzer)
+    return analyzer
+
+def process_parallel(events, log_path, analyzer, jobs=None, read_header=True,
+                     index=None):
+    """Invoke an analyzer on each event in a log, using several processes.
+
+    The trace file is split at record boundaries into `jobs` parts (by
+    default, one per CPU).  A copy of the analyzer processes each part in a
+    worker process, then the copies are merged into `analyzer` with its
+    merge() method and its end() method is invoked.  The analyzer must be
+    picklable, and its methods must not depend on the records of the
+    previous parts.  Analyzers without a merge() method are run in this
+    process with process().
+
+    The boundaries are taken from the sidecar index of the trace if it is up
+    to date, or from `index` (a TraceIndex), and found by resynchronizing on
+    the records otherwise, see find_record_boundary().  Compressed logs are
+    split at their blocks."""
+    import multiprocessing
+
+    if not hasattr(analyzer, 'merge'):
+        process(events, log_path, analyzer, read_header)
+        return
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    own_index = None
+    if index is None:
+        index = own_index = open_index(log_path)
+
+    with open(log_path, 'rb') as raw_log:
+        log, edict, idtoname = open_trace(events, raw_log, read_header)
+        compressed = isinstance(log, BlockReader)
+        if compressed:
+            # Read the mapping records of the first block
+            next(scan_trace_records(log, idtoname), None)
+            offsets = split_trace(log, struct.calcsize(log_header_fmt),
+                                  idtoname, jobs)
+        else:
+            first = next(scan_trace_records(log, idtoname), None)
+            if first is None or jobs <= 1:
+                offsets = []
+            else:
+                offsets = split_trace(log, first[0], idtoname, jobs, index)
+    if own_index is not None:
+        own_index.close()
+
+    if len(offsets) <= 1:
+        process(events, log_path, analyzer, read_header)
+        return
+
+    bounds = zip(offsets, offsets[1:] + [None])
+    pool = multiprocessing.get_context('fork').Pool(
+        min(jobs, len(offsets)), init_worker,
+        (edict, idtoname, log_path, compressed))
+    try:
+        results = pool.map(process_part, [(start, end, analyzer)
+                                          for start, end in bounds])
+    finally:
+        pool.close()
+        pool.join()
+
+    analyzer.begin()
+    for result in results:
+        analyzer.merge(result)
+    analyzer.end()
+
+# numpy types of the integer argument types of trace events, see
+# export_columns().  Pointers and unlisted types are exported as uint64.
+column_types = {
+    'bool': 'bool',
+    'char': 'int8',
+    'short': 'int16',
+    'int': 'int32',
+    'long': 'int64',
+    'unsigned': 'uint32',
+    'unsigned char': 'uint8',
+    'unsigned short': 'uint16',
+    'unsigned int': 'uint32',
+    'unsigned long': 'uint64',
+    'int8_t': 'int8',
+    'int16_t': 'int16',
+    'int32_t': 'int32',
+    'int64_t': 'int64',
+    'uint8_t': 'uint8',
+    'uint16_t': 'uint16',
+    'uint32_t': 'uint32',
+    'uint64_t': 'uint64',
+    'ssize_t': 'int64',
+    'off_t': 'int64',
+}
+
+def column_type(type):
+    """Return the numpy type of the column of an integer argument type."""
+    type = ' '.join(word for word in type.split() if word != 'const')
+    if type.endswith('*'):
+        return 'uint64'
+    return column_types.get(type, 'uint64')
+
+def export_columns(events, log, path, event_names=None, read_header=True,
+                   compress=False):
+    """Export the records of a log as one set of columns per event, in a
+    numpy .npz file.
+
+    For each event, the file holds the arrays "<event>/timestamp" (uint64),
+    "<event>/pid" (uint32) and one array "<event>/<argument>" per argument,
+    with the numpy type of the argument (see column_type()).  String
+    arguments are dictionary-encoded: "<event>/<argument>" holds int32 codes
+    into the bytes array "<event>/<argument>.values".  load_columns() decodes
+    them.
+
+    Only the events in `event_names` are exported if it is given.  numpy is
+    only needed by this function and load_columns().
+    """
+    import array
+    import numpy as np
+
+    log, edict, idtoname = open_trace(events, log, read_header)
+
+    # Per event: timestamps, pids, then per argument either an integer array
+    # or the codes array and the dict of string values
+    columns = {}
+    for rec in read_trace_records(edict, idtoname, log, event_names=event_names):
+        name = rec[0]
+        event_columns = columns.get(name)
+        if event_columns is None:
+            event_columns = [array.array('Q'), array.array('Q')]
+            for type, arg in edict[name].args:
+                if is_string(type):
+                    event_columns.append((array.array('l'), {}))
+                else:
+                    event_columns.append(array.array('Q'))
+            columns[name] = event_columns
+
+        event_columns[0].append(rec[1])
+        event_columns[1].append(rec[2])
+        for column, value in zip(event_columns[2:], rec[3:]):
+            if isinstance(column, tuple):
+                codes, values = column
+                code = values.get(value)
+                if code is None:
+                    code = values[value] = len(values)
+                codes.append(code)
+            else:
+                column.append(value)
+
+    arrays = {}
+    for name, event_columns in columns.items():
+        arrays[name + '/timestamp'] = np.frombuffer(event_columns[0], dtype=np.uint64)
+        arrays[name + '/pid'] = np.frombuffer(event_columns[1], dtype=np.uint64).astype(np.uint32)
+        for (type, arg), column in zip(edict[name].args, event_columns[2:]):
+            key = '%s/%s' % (name, arg)
+            if isinstance(column, tuple):
+                codes, values = column
+                arrays[key] = np.array(codes, dtype=np.int32)
+                arrays[key + '.values'] = np.array(sorted(values, key=values.get), dtype=bytes)
+            else:
+                arrays[key] = np.frombuffer(column, dtype=np.uint64).astype(column_type(type))
+
+    if compress:
+        np.savez_compressed(path, **arrays)
+    else:
+        np.savez(path, **arrays)
+
+def load_columns(path):
+    """Load a file written by export_columns().
+
+    Returns a dict of dicts: event name -> column name -> numpy array.
+    String columns are decoded into arrays of bytes."""
+    import numpy as np
+
+    columns = {}
+    with np.load(path) as data:
+        for key in data.files:
+            name, column = key.split('/', 1)
+            if column.endswith('.values'):
+                continue
+            array = data[key]
+            if key + '.values' in data.files:
+                array = data[key + '.values'][array]
+            columns.setdefault(name, {})[column] = array
+    return columns
+
+class LatencyHistogram(object):
+    """Histogram of non-negative integers with a bounded relative error.
+
+    Like HDR histograms, values are counted in log-linear buckets: values
+    below `sub_buckets` have their own bucket, and each larger power of two
+    is split into sub_buckets / 2 buckets of equal width.  Percentiles are
+    therefore within 2 / sub_buckets of the exact value, and the memory used
+    only depends on the range of the values, not on their number.
+    `sub_buckets` must be a power of two."""
+
+    def __init__(self, sub_buckets=128):
+        self.sub_bits = sub_buckets.bit_length() - 1
+        self.sub_buckets = sub_buckets
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value):
+        """Return the index of the bucket of a value."""
+        shift = max(value.bit_length() - self.sub_bits, 0)
+        return (shift << self.sub_bits) + (value >> shift)
+
+    def bucket_bounds(self, index):
+        """Return the lowest and highest value of a bucket."""
+        shift = index >> self.sub_bits
+        low = (index & (self.sub_buckets - 1)) << shift
+        return low, low + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        index = self.bucket(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the values of another histogram with the same sub_buckets."""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def mean(self):
+        return self.total / float(self.count) if self.count else 0.0
+
+    def percentile(self, percent):
+        """Return the highest value of the bucket holding the given
+        percentile, at most the largest recorded value."""
+        if not self.count:
+            return 0
+        rank = max(int(self.count * percent / 100.0 + 0.5), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def summary(self, percents=(50, 90, 99, 99.9)):
+        """Return a dict of the count, min, mean, max and percentiles."""
+        summary = {'count': self.count, 'min': self.min or 0,
+                   'mean': self.mean(), 'max': self.max or 0}
+        for percent in percents:
+            summary['p%s' % percent] = self.percentile(percent)
+        return summary
+
+class Pairing(object):
+    """Description of a pair of start and end events, see PairingAnalyzer.
+
+    An end record is paired with the last unpaired start record of the same
+    process whose `key` arguments have the same values, e.g. the `tag` of a
+    9p request.  `key` names arguments of the start event; a name of the form
+    "start_arg=end_arg" is for arguments whose names differ in the end event.
+    The latencies are counted in one histogram per value of the `group`
+    arguments of the start event, e.g. per mutex.
+
+    At most `max_pending` start records wait for their end; when there are
+    more, the oldest one is dropped and counted as unmatched.  The keys
+    remembered to pair records across the parts of process_parallel() are
+    bounded the same way."""
+
+    def __init__(self, start, end, key=(), group=(), name=None,
+                 max_pending=1 << 20):
+        self.start = start
+        self.end = end
+        self.start_key = tuple(arg.split('=')[0] for arg in key)
+        self.end_key = tuple(arg.split('=')[-1] for arg in key)
+        self.group = tuple(group)
+        self.name = name or start
+        self.max_pending = max_pending
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse a pairing given as start:end[:key,...[:group,...]]."""
+        fields = spec.split(':')
+        if len(fields) < 2 or len(fields) > 4 or not all(fields[:2]):
+            raise ValueError('invalid pairing %s' % spec)
+        key = fields[2].split(',') if len(fields) > 2 and fields[2] else ()
+        group = fields[3].split(',') if len(fields) > 3 and fields[3] else ()
+        return cls(fields[0], fields[1], key, group)
+
+class PairingState(object):
+    """Latency histograms and unpaired records of a Pairing."""
+
+    def __init__(self, pairing):
+        self.pairing = pairing
+        self.histograms = {}
+        self.pending = {}   # key -> (timestamp, group) of the start record
+        # Keys of the most recent start records, at most max_pending of them,
+        # in the order of their last start record (the values are unused)
+        self.started = {}
+        # (key, timestamp) of the unpaired end records before any start
+        # record of their key, which may pair with an earlier part in merge()
+        self.orphans = []
+        self.unmatched = 0
+        self.orphan_count = 0
+
+    def start(self, key, timestamp, group):
+        if key in self.pending:
+            del self.pending[key]
+            self.unmatched += 1
+        elif len(self.pending) >= self.pairing.max_pending:
+            del self.pending[next(iter(self.pending))]
+            self.unmatched += 1
+        self.pending[key] = (timestamp, group)
+        self.add_started(key)
+
+    def add_started(self, key):
+        self.started.pop(key, None)
+        self.started[key] = None
+        if len(self.started) > self.pairing.max_pending:
+            del self.started[next(iter(self.started))]
+
+    def end(self, key, timestamp):
+        start = self.pending.pop(key, None)
+        if start is None:
+            self.orphan_count += 1
+            if (key not in self.started and
+                len(self.orphans) < self.pairing.max_pending):
+                self.orphans.append((key, timestamp))
+            return
+        start_timestamp, group = start
+        histogram = self.histograms.get(group)
+        if histogram is None:
+            histogram = self.histograms[group] = LatencyHistogram()
+        histogram.record(max(timestamp - start_timestamp, 0))
+
+    def merge(self, other):
+        """Merge the state of the following part of the trace.
+
+        A start record still pending here is paired with the first end
+        record of its key in `other` if that comes before any start record
+        of the key, and is unmatched if a start record comes first."""
+        for key, timestamp in other.orphans:
+            if key in self.pending:
+                other.orphan_count -= 1
+                self.end(key, timestamp)
+            elif key not in self.started:
+                self.orphans.append((key, timestamp))
+        del self.orphans[self.pairing.max_pending:]
+        for key in [key for key in self.pending if key in other.started]:
+            del self.pending[key]
+            self.unmatched += 1
+        for key in other.started:
+            self.add_started(key)
+        self.orphan_count += other.orphan_count
+        for group, histogram in other.histograms.items():
+            if group in self.histograms:
+                self.histograms[group].merge(histogram)
+            else:
+                self.histograms[group] = histogram
+        self.unmatched += other.unmatched
+        for key, start in other.pending.items():
+            self.start(key, *start)
+
+class PairingAnalyzer(Analyzer):
+    """Analyzer measuring the latency between paired start and end events.
+
+    The analyzer is driven by a list of Pairing objects.  After processing,
+    `states` maps the name of each pairing to a PairingState, whose
+    histograms map the values of the group arguments to a
+    LatencyHistogram.  The records of other events are skipped without being
+    decoded, and analyzers can be merged, so the analyzer also works with
+    process_parallel()."""
+
+    def __init__(self, pairings):
+        self.pairings = list(pairings)
+        self.event_names = set()
+        for pairing in self.pairings:
+            self.event_names.update((pairing.start, pairing.end))
+
+    def begin(self):
+        self.states = dict((pairing.name, PairingState(pairing))
+                           for pairing in self.pairings)
+        self.handlers = {}
+
+    def build_handlers(self, event):
+        """Return the functions handling the records of an event."""
+        arg_index = dict((name, 3 + i) for i, (_, name) in enumerate(event.args))
+        handlers = []
+        for pairing in self.pairings:
+            state = self.states[pairing.name]
+            if event.name == pairing.start:
+                key = [arg_index[arg] for arg in pairing.start_key]
+                group = [arg_index[arg] for arg in pairing.group]
+                handlers.append(lambda rec, state=state, key=key, group=group:
+                                state.start((rec[2],) + tuple(rec[i] for i in key),
+                                            rec[1], tuple(rec[i] for i in group)))
+            if event.name == pairing.end:
+                key = [arg_index[arg] for arg in pairing.end_key]
+                handlers.append(lambda rec, state=state, key=key:
+                                state.end((rec[2],) + tuple(rec[i] for i in key),
+                                          rec[1]))
+        return handlers
+
+    def catchall(self, event, rec):
+        handlers = self.handlers.get(event.name)
+        if handlers is None:
+            handlers = self.handlers[event.name] = self.build_handlers(event)
+        for handler in handlers:
+            handler(rec)
+
+    def merge(self, other):
+        for name, state in other.states.items():
+            self.states[name].merge(state)
+
+    def __getstate__(self):
+        # The handlers are closures, rebuilt on demand
+        state = self.__dict__.copy()
+        state['handlers'] = {}
+        return state
+
 def run(analyzer):
     """Execute an analyzer on a trace file given on the command-line.
 
@@ -224,17 +1367,33 @@ def run(analyzer):
     advanced scripts will want to call process() instead."""
     import sys
 
+    usage = 'usage: %s [--no-header] [--follow] [--from <ns>] [--to <ns>] ' \
+            '<trace-events> <trace-file>\n' % sys.argv[0]
     read_header = True
-    if len(sys.argv) == 4 and sys.argv[1] == '--no-header':
-        read_header = False
+    follow = False
+    times = {}
+    while len(sys.argv) > 3 and sys.argv[1] in ('--no-header', '--follow',
+                                                '--from', '--to'):
+        if sys.argv[1] == '--no-header':
+            read_header = False
+        elif sys.argv[1] == '--follow':
+            follow = True
+        else:
+            try:
+                times[sys.argv[1]] = int(sys.argv[2], 0)
+            except ValueError:
+                sys.stderr.write(usage)
+                sys.exit(1)
+            del sys.argv[2]
         del sys.argv[1]
-    elif len(sys.argv) != 3:
-        sys.stderr.write('usage: %s [--no-header] <trace-events> ' \
-                         '<trace-file>\n' % sys.argv[0])
+    if len(sys.argv) != 3:
+        sys.stderr.write(usage)
         sys.exit(1)
 
     events = read_events(open(sys.argv[1], 'r'), sys.argv[1])
-    process(events, sys.argv[2], analyzer, read_header=read_header)
+    process(events, sys.argv[2], analyzer, read_header=read_header,
+            follow=follow, start_time=times.get('--from'),
+            end_time=times.get('--to'))
 
 if __name__ == '__main__':
     class Formatter(Analyzer):
@@ -0,0 +1,135 @@
+"""Performance regression benchmark for SymQEMU.
+
+Each selected test binary is run several times through SymQEMU, one run at a time so that runs do not compete for
+resources, and the median wall time, CPU time, maximum RSS and solver time of the runs are recorded. The medians are
+compared with those of a baseline JSON file, and the benchmark fails if a binary got slower (or used more memory) than
+the baseline by more than a threshold. Runs that exceed the timeout of their binary are not part of the medians; the
+benchmark fails if there are any.
+
+Usage: python3 benchmark.py [--runs <n>] [--baseline <file>] [--update-baseline] [--threshold <fraction>]
+                            [--tag <tag>]... [<binary name>...]
+"""
+
+import argparse
+import json
+import pathlib
+import statistics
+import sys
+import tempfile
+import typing
+
+import regression
+import util
+
+DEFAULT_BASELINE_FILE = pathlib.Path(__file__).parent / 'benchmark_baseline.json'
+
+
+class Measurement(typing.NamedTuple):
+    """Medians over the runs of one binary that did not time out (None if they all did)"""
+    wall_time: typing.Optional[float]
+    cpu_time: typing.Optional[float]
+    max_rss: typing.Optional[int]
+    solver_time: typing.Optional[float]
+    timeouts: int = 0
+    """Number of runs killed because they exceeded the timeout of the binary"""
+
+
+def measure(test_binary: regression.TestBinary, runs: int) -> Measurement:
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix=f'symqemu_benchmark_{test_binary.name}_') as temp_dir:
+            # The test cases are counted in the output directory, so the standard error goes next to it
+            output_dir = pathlib.Path(temp_dir) / 'output'
+            output_dir.mkdir()
+            results.append(util.run_symqemu_on_test_binary(
+                binary_name=test_binary.name,
+                output_dir=output_dir,
+                timeout=test_binary.timeout,
+                stderr_file=pathlib.Path(temp_dir) / 'stderr',
+            ))
+
+    completed = [result for result in results if not result.timed_out]
+    if not completed:
+        return Measurement(wall_time=None, cpu_time=None, max_rss=None, solver_time=None, timeouts=len(results))
+    solver_times = [result.solver_time for result in completed if result.solver_time is not None]
+    return Measurement(
+        wall_time=statistics.median(result.wall_time for result in completed),
+        cpu_time=statistics.median(result.user_time + result.sys_time for result in completed),
+        max_rss=int(statistics.median(result.max_rss for result in completed)),
+        solver_time=statistics.median(solver_times) if solver_times else None,
+        timeouts=len(results) - len(completed),
+    )
+
+
+def compare(name: str, measurement: Measurement, baseline: dict, threshold: float,
+            rss_threshold: float) -> typing.List[str]:
+    """Return a description of each regression of `measurement` with respect to `baseline`."""
+    regressions = []
+    for metric, metric_threshold in (('wall_time', threshold), ('max_rss', rss_threshold)):
+        value = getattr(measurement, metric)
+        baseline_value = baseline.get(metric)
+        if value is not None and baseline_value and value > baseline_value * (1 + metric_threshold):
+            regressions.append(f'{name}: {metric} {value:g} exceeds baseline {baseline_value:g} '
+                               f'by {100 * (value / baseline_value - 1):.1f}% (threshold {100 * metric_threshold:.0f}%)')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark SymQEMU on the test binaries and compare with a baseline.')
+    parser.add_argument('binary_names', nargs='*', help='binaries to benchmark (default: all)')
+    parser.add_argument('--runs', type=int, default=5, help='number of runs per binary')
+    parser.add_argument('--baseline', type=pathlib.Path, default=DEFAULT_BASELINE_FILE, help='baseline JSON file')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='write the measurements to the baseline file instead of comparing with it')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='maximum accepted relative wall time increase (default: 0.1)')
+    parser.add_argument('--rss-threshold', type=float, default=0.1,
+                        help='maximum accepted relative maximum RSS increase (default: 0.1)')
+    parser.add_argument('--tag', action='append', default=[], help='only benchmark the binaries with this tag')
+    args = parser.parse_args(sys.argv[1:])
+
+    test_binaries = regression.select_test_binaries(regression.discover_test_binaries(), tags=args.tag)
+    if args.binary_names:
+        test_binaries = [test_binary for test_binary in test_binaries if test_binary.name in args.binary_names]
+
+    measurements = {}
+    timeouts = []
+    for test_binary in test_binaries:
+        measurement = measure(test_binary, args.runs)
+        if measurement.timeouts:
+            timeouts.append(f'{test_binary.name}: {measurement.timeouts} of {args.runs} runs timed out '
+                            f'after {test_binary.timeout}s')
+            print(timeouts[-1])
+            continue
+        measurements[test_binary.name] = measurement._asdict()
+        print(f'{test_binary.name}: wall time {measurement.wall_time:.2f}s, cpu time {measurement.cpu_time:.2f}s, '
+              f'max RSS {measurement.max_rss} KiB, solver time {measurement.solver_time}')
+
+    if args.update_baseline:
+        baseline = {}
+        if args.baseline.exists():
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        baseline.update(measurements)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'Baseline written to {args.baseline}' + (', except for the binaries that timed out' if timeouts else ''))
+        sys.exit(1 if timeouts else 0)
+
+    if not args.baseline.exists():
+        print(f"Error: {args.baseline} does not exist, create it with --update-baseline")
+        sys.exit(1)
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for name, measurement in measurements.items():
+        if name not in baseline:
+            print(f'{name}: no baseline')
+            continue
+        regressions += compare(name, Measurement(**measurement), baseline[name], args.threshold, args.rss_threshold)
+
+    for description in regressions:
+        print(description)
+    sys.exit(1 if regressions or timeouts else 0)
@@ -0,0 +1,109 @@
+"""Block coverage bitmaps and coverage-guided scheduling of inputs.
+
+When the environment variable SYMQEMU_COVERAGE_FILE is set, SymQEMU writes an AFL-style edge coverage bitmap of the
+run to that file: one saturating hit counter per (hashed) transition between two translation blocks. See
+include/exec/sym-coverage.h.
+
+Usage: python3 block_coverage.py <coverage file>...
+    prints, for each bitmap, the number of edges it covers and the number of new coverage bits it adds to the
+    preceding ones
+"""
+
+import heapq
+import itertools
+import pathlib
+import sys
+import typing
+
+MAP_SIZE = 1 << 16
+"""Size of a coverage bitmap in bytes, must match SYM_COVERAGE_MAP_SIZE"""
+
+
+def _hit_count_bucket(count: int) -> int:
+    """Map a hit count to a single bit, like AFL does, so that loops iterating a few more times are not new coverage."""
+    if count == 0:
+        return 0
+    for bit, upper_bound in enumerate((1, 2, 3, 7, 15, 31, 127)):
+        if count <= upper_bound:
+            return 1 << bit
+    return 1 << 7
+
+
+_HIT_COUNT_BUCKETS = bytes(_hit_count_bucket(count) for count in range(256))
+
+
+def read_bitmap(path: pathlib.Path) -> typing.Optional[bytes]:
+    """Read the coverage bitmap at `path`. Return None if the file does not exist or is not a coverage bitmap."""
+    try:
+        bitmap = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    if len(bitmap) != MAP_SIZE:
+        return None
+    return bitmap
+
+
+def covered_edges(bitmap: bytes) -> int:
+    return MAP_SIZE - bitmap.count(0)
+
+
+def coverage_signature(bitmap: bytes) -> bytes:
+    """Return `bitmap` with its hit counts bucketed. Two runs with the same signature cover the same edges, with hit
+    counts in the same buckets."""
+    return bitmap.translate(_HIT_COUNT_BUCKETS)
+
+
+class CoverageMap:
+    """The union of the coverage of many runs."""
+
+    def __init__(self):
+        # Bucketed bitmaps are handled as big integers, which makes the set operations fast.
+        self.seen = 0
+
+    def new_bits(self, bitmap: bytes) -> int:
+        """Return the number of coverage bits of `bitmap` that are not in the map."""
+        bits = int.from_bytes(coverage_signature(bitmap), 'little')
+        return bin(bits & ~self.seen).count('1')
+
+    def update(self, bitmap: bytes) -> int:
+        """Add `bitmap` to the map and return the number of new coverage bits it brought."""
+        bits = int.from_bytes(coverage_signature(bitmap), 'little')
+        new_bits = bin(bits & ~self.seen).count('1')
+        self.seen |= bits
+        return new_bits
+
+
+class CoverageScheduler:
+    """A queue of inputs ordered by the new coverage found by the run that generated them.
+
+    Inputs generated by runs that discovered more coverage are explored first. Inputs with the same score are explored
+    in insertion order, so without coverage information this is a FIFO queue.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(self, input_file: pathlib.Path, score: int = 0) -> None:
+        heapq.heappush(self.heap, (-score, next(self.counter), input_file))
+
+    def pop(self) -> pathlib.Path:
+        _, _, input_file = heapq.heappop(self.heap)
+        return input_file
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <coverage file>...")
+        sys.exit(1)
+
+    coverage_map = CoverageMap()
+    for path in map(pathlib.Path, sys.argv[1:]):
+        bitmap = read_bitmap(path)
+        if bitmap is None:
+            print(f"Error: {path} is not a coverage bitmap")
+            sys.exit(1)
+        print(f'{path}: {covered_edges(bitmap)} edges, {coverage_map.update(bitmap)} new coverage bits')
@@ -0,0 +1,305 @@
+"""Parallel concolic exploration campaign driver.
+
+A campaign keeps a queue of inputs for one of the test binaries. Each input is run through SymQEMU by a pool of
+worker processes, and every test case generated by a run is added to the queue as a new input to explore. The queue
+is ordered by the new block coverage found by the run that generated each input (see `block_coverage.py`).
+
+Usage: python3 campaign.py [options] <binary name> <campaign dir>
+"""
+
+import argparse
+import concurrent.futures
+import os
+import pathlib
+import shutil
+import sys
+import time
+import typing
+
+import block_coverage
+import dedup
+import forkserver
+import regions
+import runlog
+import tb_cache
+import util
+
+DEDUP_INDEX_FILE_NAME = 'dedup.sqlite'
+QUEUE_DIR_NAME = 'queue'
+RUN_LOG_FILE_NAME = 'runs.jsonl'
+NEW_DIR_NAME = 'new'
+WORKERS_DIR_NAME = 'workers'
+
+
+class CampaignLimits(typing.NamedTuple):
+    """Conditions that stop a campaign. `None` means no limit."""
+    max_time: typing.Optional[float] = None
+    """Wall-clock time in seconds"""
+    max_cpu_time: typing.Optional[float] = None
+    """CPU time (user + sys) in seconds, summed over all SymQEMU runs"""
+    max_queue: typing.Optional[int] = None
+    """Total number of inputs that may be added to the queue"""
+    run_timeout: typing.Optional[float] = None
+    """Wall-clock time in seconds after which a single SymQEMU run is killed"""
+    run_memory_limit: typing.Optional[int] = None
+    """Address space limit in bytes of a single SymQEMU run"""
+
+
+class RunOutcome(typing.NamedTuple):
+    input_file: pathlib.Path
+    test_cases: typing.List[pathlib.Path]
+    result: util.RunResult
+    coverage: typing.Optional[bytes]
+
+
+# The fork server of the current worker process, when the campaign uses fork servers
+_fork_server = None
+
+
+def run_input(binary_name: str, campaign_dir: pathlib.Path, run_id: int, input_file: pathlib.Path,
+              timeout: typing.Optional[float] = None, memory_limit: typing.Optional[int] = None,
+              use_fork_server: bool = False, tb_cache_file: typing.Optional[pathlib.Path] = None,
+              symbolic_regions: typing.Optional[typing.List[util.Region]] = None) -> RunOutcome:
+    """Run SymQEMU on one input. This is executed in a worker process.
+
+    Each worker process has its own SYMCC_OUTPUT_DIR. After the run, the generated test cases are moved out of it to
+    the `new` directory of the campaign, with a name prefixed by `run_id`, so that the next run of this worker starts
+    from an empty output directory.
+
+    With `use_fork_server`, each worker process starts a SymQEMU fork server on its first run and reuses it for the
+    following ones (see `forkserver.py`). The translation cache file `tb_cache_file`, if given, is shared by all the
+    fork servers (see `tb_cache.py`); it is not used without them.
+    """
+    global _fork_server
+
+    output_dir = campaign_dir / WORKERS_DIR_NAME / str(os.getpid())
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    output_dir.mkdir(parents=True)
+
+    coverage_file = output_dir.with_suffix('.coverage')
+    if coverage_file.exists():
+        coverage_file.unlink()
+
+    if use_fork_server:
+        if _fork_server is None:
+            _fork_server = forkserver.ForkServer(binary_name=binary_name, input_file=output_dir.with_suffix('.input'),
+                                                 output_dir=output_dir, coverage_file=coverage_file,
+                                                 tb_cache_file=tb_cache_file, symbolic_regions=symbolic_regions,
+                                                 memory_limit=memory_limit, stderr_file=output_dir.with_suffix('.stderr'))
+            _fork_server.start()
+        result = _fork_server.run(input_file, timeout=timeout)
+    else:
+        result = util.run_symqemu_on_test_binary(binary_name=binary_name, output_dir=output_dir,
+                                                 input_file=input_file, coverage_file=coverage_file,
+                                                 symbolic_regions=symbolic_regions, timeout=timeout,
+                                                 memory_limit=memory_limit, stderr_file=output_dir.with_suffix('.stderr'))
+
+    test_cases = []
+    for test_case in sorted(output_dir.iterdir()):
+        destination = campaign_dir / NEW_DIR_NAME / f'{run_id:06d}-{test_case.name}'
+        test_case.rename(destination)
+        test_cases.append(destination)
+
+    return RunOutcome(input_file=input_file, test_cases=test_cases, result=result,
+                      coverage=block_coverage.read_bitmap(coverage_file))
+
+
+class Campaign:
+    """Drives the exploration of a test binary by a pool of SymQEMU workers.
+
+    The campaign directory contains the queue of inputs (`queue`), the test cases that have been generated but not
+    queued yet (`new`), the output directory of each worker (`workers`) and a log of all runs (`runs.jsonl`, see
+    `runlog.py`).
+
+    Generated test cases whose content has already been seen are dropped instead of being queued. The content hashes
+    are kept in `dedup_index_path`, which defaults to a file in the campaign directory but may be shared between
+    campaigns.
+    """
+
+    def __init__(self, binary_name: str, campaign_dir: pathlib.Path, jobs: int = os.cpu_count(),
+                 limits: CampaignLimits = CampaignLimits(), seeds: typing.Iterable[pathlib.Path] = (),
+                 dedup_index_path: typing.Optional[pathlib.Path] = None, use_fork_server: bool = False,
+                 tb_cache_dir: typing.Optional[pathlib.Path] = None,
+                 symbolic_regions: typing.Optional[typing.List[util.Region]] = None):
+        self.binary_name = binary_name
+        self.campaign_dir = campaign_dir
+        self.jobs = jobs
+        self.limits = limits
+        self.seeds = list(seeds) or [util.BINARIES_DIR / binary_name / 'input']
+        self.dedup_index_path = dedup_index_path or campaign_dir / DEDUP_INDEX_FILE_NAME
+        self.dedup_index = None
+        self.use_fork_server = use_fork_server
+        self.tb_cache_file = (tb_cache.cache_file_for_binary(tb_cache_dir, util.BINARIES_DIR / binary_name / 'binary')
+                              if tb_cache_dir is not None else None)
+        self.symbolic_regions = symbolic_regions
+        self.run_log = runlog.RunLog(campaign_dir / RUN_LOG_FILE_NAME)
+
+        self.queue = block_coverage.CoverageScheduler()
+        self.coverage_map = block_coverage.CoverageMap()
+        self.queued_count = 0
+        self.submitted_count = 0
+        self.runs_count = 0
+        self.duplicates_count = 0
+        self.timeouts_count = 0
+        self.cpu_time = 0.0
+        self.start_time = None
+
+    @property
+    def queue_dir(self) -> pathlib.Path:
+        return self.campaign_dir / QUEUE_DIR_NAME
+
+    def elapsed_time(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def limit_reached(self) -> bool:
+        if self.limits.max_time is not None and self.elapsed_time() >= self.limits.max_time:
+            return True
+        if self.limits.max_cpu_time is not None and self.cpu_time >= self.limits.max_cpu_time:
+            return True
+        return False
+
+    def queue_full(self) -> bool:
+        return self.limits.max_queue is not None and self.queued_count >= self.limits.max_queue
+
+    def next_queued_file(self) -> pathlib.Path:
+        """The path to which the next call to enqueue() moves its test case."""
+        return self.queue_dir / f'{self.queued_count:06d}'
+
+    def enqueue(self, file: pathlib.Path, score: int = 0) -> None:
+        """Move `file` into the queue directory and schedule it for exploration with priority `score`."""
+        queued_file = self.next_queued_file()
+        self.queued_count += 1
+        shutil.move(str(file), str(queued_file))
+        self.queue.push(queued_file, score)
+
+    def handle_outcome(self, outcome: RunOutcome) -> None:
+        self.runs_count += 1
+        self.cpu_time += outcome.result.user_time + outcome.result.sys_time
+        if outcome.result.timed_out:
+            self.timeouts_count += 1
+
+        score = 0
+        if outcome.coverage is not None:
+            score = self.coverage_map.update(outcome.coverage)
+
+        new_outputs = 0
+        for test_case in outcome.test_cases:
+            if self.queue_full():
+                test_case.unlink()
+            elif self.dedup_index.add(test_case, self.next_queued_file()):
+                new_outputs += 1
+                self.enqueue(test_case, score)
+            else:
+                self.duplicates_count += 1
+                test_case.unlink()
+
+        self.run_log.append(runlog.make_record(self.binary_name, outcome.input_file, outcome.result, new_outputs))
+
+    def run(self) -> None:
+        """Explore the queue until it is exhausted or a limit is reached."""
+        for directory in (self.queue_dir, self.campaign_dir / NEW_DIR_NAME, self.campaign_dir / WORKERS_DIR_NAME):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        # Runs only append the blocks that are not cached yet, but concurrent runs may still append the same ones
+        if self.tb_cache_file is not None and self.tb_cache_file.exists():
+            tb_cache.compact(self.tb_cache_file)
+
+        self.start_time = time.monotonic()
+
+        with dedup.DedupIndex(self.dedup_index_path) as self.dedup_index:
+            self._explore()
+
+        shutil.rmtree(self.campaign_dir / WORKERS_DIR_NAME)
+
+    def enqueue_seeds(self) -> None:
+        for seed_index, seed in enumerate(self.seeds):
+            if not self.queue_full():
+                seed_copy = self.campaign_dir / NEW_DIR_NAME / f'seed-{seed_index:06d}'
+                shutil.copyfile(seed, seed_copy)
+                if self.dedup_index.add(seed_copy, self.next_queued_file()):
+                    self.enqueue(seed_copy)
+                else:
+                    seed_copy.unlink()
+
+    def _explore(self) -> None:
+        self.enqueue_seeds()
+
+        running = set()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            while True:
+                while self.queue and len(running) < self.jobs and not self.limit_reached():
+                    input_file = self.queue.pop()
+                    running.add(executor.submit(run_input, self.binary_name, self.campaign_dir,
+                                                self.submitted_count, input_file,
+                                                self.limits.run_timeout, self.limits.run_memory_limit,
+                                                self.use_fork_server, self.tb_cache_file,
+                                                self.symbolic_regions))
+                    self.submitted_count += 1
+
+                if not running:
+                    break
+
+                done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    self.handle_outcome(future.result())
+
+    def print_summary(self) -> None:
+        print(f'runs: {self.runs_count}, queued inputs: {self.queued_count}, unexplored inputs: {len(self.queue)}, '
+              f'duplicate test cases: {self.duplicates_count}, timed out runs: {self.timeouts_count}, '
+              f'wall time: {self.elapsed_time():.1f}s, cpu time: {self.cpu_time:.1f}s')
+
+
+def parse_args(argv: typing.List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Run a parallel SymQEMU exploration campaign on a test binary.')
+    parser.add_argument('binary_name', help='name of a directory in binaries/')
+    parser.add_argument('campaign_dir', type=pathlib.Path, help='directory where the campaign state is stored')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of parallel SymQEMU workers')
+    parser.add_argument('--seed', type=pathlib.Path, action='append', default=[],
+                        help='initial input (may be repeated, defaults to the input file of the binary)')
+    parser.add_argument('--dedup-index', type=pathlib.Path,
+                        help='content-hash index of already seen test cases (defaults to a file in the campaign dir)')
+    parser.add_argument('--fork-server', action='store_true',
+                        help='run the inputs in a SymQEMU fork server per worker instead of starting SymQEMU each time')
+    parser.add_argument('--tb-cache', type=pathlib.Path,
+                        help='directory of the translation cache shared by campaigns (requires --fork-server)')
+    parser.add_argument('--symbolic-regions', type=regions.parse_regions,
+                        help='only make these byte ranges of the inputs symbolic, e.g. 0-16,64-128 (see regions.py)')
+    parser.add_argument('--max-time', type=float, help='stop after this many seconds of wall-clock time')
+    parser.add_argument('--max-cpu-time', type=float, help='stop after this many seconds of SymQEMU CPU time')
+    parser.add_argument('--max-queue', type=int, help='stop queuing inputs after this many have been queued')
+    parser.add_argument('--run-timeout', type=float, help='kill a SymQEMU run after this many seconds')
+    parser.add_argument('--run-memory-limit', type=int, help='address space limit of a SymQEMU run, in MiB')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+
+    if not (util.BINARIES_DIR / args.binary_name).exists():
+        print(f"Error: {util.BINARIES_DIR / args.binary_name} does not exist")
+        sys.exit(1)
+
+    if args.tb_cache is not None and not args.fork_server:
+        print("Error: --tb-cache requires --fork-server, only fork servers use the translation cache")
+        sys.exit(1)
+
+    campaign = Campaign(
+        binary_name=args.binary_name,
+        campaign_dir=args.campaign_dir,
+        jobs=args.jobs,
+        limits=CampaignLimits(
+            max_time=args.max_time,
+            max_cpu_time=args.max_cpu_time,
+            max_queue=args.max_queue,
+            run_timeout=args.run_timeout,
+            run_memory_limit=args.run_memory_limit * 1024 * 1024 if args.run_memory_limit is not None else None,
+        ),
+        seeds=args.seed,
+        dedup_index_path=args.dedup_index,
+        use_fork_server=args.fork_server,
+        tb_cache_dir=args.tb_cache,
+        symbolic_regions=args.symbolic_regions,
+    )
+    campaign.run()
+    campaign.print_summary()
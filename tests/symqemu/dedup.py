@@ -0,0 +1,106 @@
+"""Persistent content-hash index of test cases.
+
+The index remembers the SHA-256 hash of every test case it has been given, in an SQLite database, so that test cases
+that are byte-identical to one seen before (in the same run, in an earlier run or in another campaign sharing the
+index) can be filtered out before they are re-executed.
+
+Usage: python3 dedup.py [--remove-duplicates] <index file> <test case dir>...
+"""
+
+import argparse
+import pathlib
+import sqlite3
+import sys
+import time
+import typing
+
+import util
+
+
+class DedupIndex:
+    """An SQLite-backed set of test case content hashes."""
+
+    def __init__(self, path: pathlib.Path):
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS test_cases ('
+            '    hash TEXT PRIMARY KEY,'
+            '    path TEXT NOT NULL,'
+            '    first_seen REAL NOT NULL'
+            ')'
+        )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'DedupIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        (count,) = self.connection.execute('SELECT COUNT(*) FROM test_cases').fetchone()
+        return count
+
+    def __contains__(self, file_hash: str) -> bool:
+        row = self.connection.execute('SELECT 1 FROM test_cases WHERE hash = ?', (file_hash,)).fetchone()
+        return row is not None
+
+    def recorded_path(self, file_hash: str) -> typing.Optional[pathlib.Path]:
+        """Return the path recorded for the first test case with hash `file_hash`, or None if it was never seen."""
+        row = self.connection.execute('SELECT path FROM test_cases WHERE hash = ?', (file_hash,)).fetchone()
+        return pathlib.Path(row[0]) if row is not None else None
+
+    def add(self, file: pathlib.Path, path: typing.Optional[pathlib.Path] = None) -> bool:
+        """Record `file` in the index. Return True if its content had never been seen before.
+
+        `path` is the path recorded for `file`, by default `file` itself; pass the final path of a test case that is
+        about to be moved.
+        """
+        return bool(self.filter_new([file], [path or file]))
+
+    def filter_new(self, files: typing.Iterable[pathlib.Path],
+                   paths: typing.Optional[typing.Iterable[pathlib.Path]] = None) -> typing.List[pathlib.Path]:
+        """Record `files` in the index and return those whose content had never been seen before.
+
+        If several of `files` have the same novel content, only the first one is returned. `paths` are the paths
+        recorded for `files`, by default the files themselves.
+        """
+        files = list(files)
+        new_files = []
+        now = time.time()
+        with self.connection:
+            for file, path in zip(files, files if paths is None else paths):
+                cursor = self.connection.execute(
+                    'INSERT OR IGNORE INTO test_cases (hash, path, first_seen) VALUES (?, ?, ?)',
+                    (util.hash_file(file), str(path), now)
+                )
+                if cursor.rowcount == 1:
+                    new_files.append(file)
+        return new_files
+
+
+def parse_args(argv: typing.List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Filter test cases against a persistent content-hash index.')
+    parser.add_argument('index', type=pathlib.Path, help='index file, created if it does not exist')
+    parser.add_argument('directories', type=pathlib.Path, nargs='+', help='directories containing test cases')
+    parser.add_argument('--remove-duplicates', action='store_true',
+                        help='delete the test cases that were already in the index instead of listing the new ones')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+
+    files = [file for directory in args.directories for file in sorted(directory.iterdir()) if file.is_file()]
+
+    with DedupIndex(args.index) as index:
+        new_files = set(index.filter_new(files))
+
+    for file in files:
+        if file not in new_files and args.remove_duplicates:
+            file.unlink()
+        elif file in new_files and not args.remove_duplicates:
+            print(file)
@@ -0,0 +1,445 @@
+"""Distributed exploration campaigns.
+
+A coordinator owns the queue of a campaign (see `campaign.py`) and serves it over TCP to workers, which may run on
+other hosts. Each worker runs SymQEMU on one input at a time and uploads its results in batches; start several workers
+per host to use all its cores. The workers need the same `binaries` directory as the coordinator.
+
+The protocol is one JSON request and one JSON response per connection, each on a single line. Every request has a
+`type` and the `worker` id of its sender:
+
+- `hello`: the response holds the settings of the campaign (binary, run timeout and memory limit, symbolic regions).
+- `get_work` with a `count`: the coordinator leases up to `count` inputs to the worker, as `inputs`, a list of
+  `{"id": ..., "data": <base64>}`. When its queue is empty, it steals the most recently leased half of the inputs of
+  the worker with the longest backlog instead. `done` tells that the campaign is over.
+- `upload` with `results`, a list of `{"id": ..., "result": <RunResult fields>, "coverage": <base64 zlib-compressed
+  bitmap or null>, "test_cases": [<base64>...]}`: the coordinator ends the leases and queues the new test cases. With
+  `final`, the worker is leaving and its remaining leases are queued again. The whole upload is rejected if one of
+  its results is invalid or is for an input that is not leased to the worker.
+
+Every response also holds `revoked`, the ids of the inputs leased to the worker that were stolen since its last
+request; the worker drops them from its local queue. The worker may have run them already: the thief runs them again,
+and the results of the worker for them are dropped, so that each input has a single outcome. The leases of a worker
+that has not been heard from for `--worker-timeout` seconds are queued again.
+
+A request that the coordinator can't handle gets a response with an `error` message instead.
+
+Usage: python3 distributed.py coordinator [--host <host>] [--port <port>] [options] <binary name> <campaign dir>
+       python3 distributed.py worker [-j <workers>] [--batch-size <runs>] [--fork-server] [--tb-cache <dir>]
+                                     <host>:<port> <work dir>
+"""
+
+import argparse
+import base64
+import collections
+import json
+import multiprocessing
+import os
+import pathlib
+import shutil
+import socket
+import socketserver
+import sys
+import time
+import typing
+import zlib
+
+import campaign
+import regions
+import tb_cache
+import util
+
+DEFAULT_PORT = 7860
+POLL_INTERVAL = 1.0
+"""Seconds an idle worker waits before asking for work again"""
+
+
+class CoordinatorError(Exception):
+    pass
+
+
+def send_request(address: typing.Tuple[str, int], request: dict) -> dict:
+    with socket.create_connection(address) as connection:
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        with connection.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise CoordinatorError('connection closed by the coordinator')
+    response = json.loads(line)
+    if 'error' in response:
+        raise CoordinatorError(response['error'])
+    return response
+
+
+def is_input_id(input_id: str) -> bool:
+    """Return whether `input_id` can be the id of an input, i.e. the name of a file in the queue directory."""
+    return isinstance(input_id, str) and input_id not in ('', '.', '..') and pathlib.PurePath(input_id).name == input_id
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            response = self.server.coordinator.handle_request(json.loads(self.rfile.readline()))
+        except Exception as error:
+            # Uploads are checked before any of their results is applied, see `Coordinator.decode_results`
+            response = {'error': f'invalid request: {error!r}'}
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class Coordinator(campaign.Campaign):
+    """A campaign whose inputs are run by remote workers instead of a local process pool.
+
+    Requests are handled one at a time in the campaign process, so the campaign state needs no locking.
+    """
+
+    def __init__(self, binary_name: str, campaign_dir: pathlib.Path, address: typing.Tuple[str, int],
+                 limits: campaign.CampaignLimits = campaign.CampaignLimits(),
+                 seeds: typing.Iterable[pathlib.Path] = (), dedup_index_path: typing.Optional[pathlib.Path] = None,
+                 symbolic_regions: typing.Optional[typing.List[util.Region]] = None,
+                 worker_timeout: float = 3600):
+        super().__init__(binary_name=binary_name, campaign_dir=campaign_dir, jobs=0, limits=limits, seeds=seeds,
+                         dedup_index_path=dedup_index_path, symbolic_regions=symbolic_regions)
+        self.address = address
+        self.worker_timeout = worker_timeout
+        # Inputs leased to each worker, by id, in lease order
+        self.leases: typing.Dict[str, typing.Dict[str, pathlib.Path]] = collections.defaultdict(dict)
+        # Inputs stolen from each worker since its last request, and since it was first heard from
+        self.revoked: typing.Dict[str, typing.Set[str]] = collections.defaultdict(set)
+        self.stolen: typing.Dict[str, typing.Set[str]] = collections.defaultdict(set)
+        self.last_contact: typing.Dict[str, float] = {}
+        self.received_count = 0
+        self.steals_count = 0
+        self.stale_results_count = 0
+
+    def done(self) -> bool:
+        return self.limit_reached() or (not self.queue and not any(self.leases.values()))
+
+    def handle_request(self, request: dict) -> dict:
+        worker = request['worker']
+        self.last_contact[worker] = time.monotonic()
+
+        if request['type'] == 'hello':
+            response = {
+                'binary': self.binary_name,
+                'run_timeout': self.limits.run_timeout,
+                'run_memory_limit': self.limits.run_memory_limit,
+                'symbolic_regions': self.symbolic_regions,
+            }
+        elif request['type'] == 'get_work':
+            response = {'inputs': self.lease_inputs(worker, request['count'])}
+        elif request['type'] == 'upload':
+            self.receive_results(worker, request['results'])
+            if request.get('final'):
+                self.release_worker(worker)
+            response = {}
+        else:
+            raise ValueError(f'unknown request type {request["type"]}')
+
+        response['revoked'] = sorted(self.revoked.pop(worker, ()))
+        response['done'] = self.done()
+        return response
+
+    def lease_inputs(self, worker: str, count: int) -> typing.List[dict]:
+        if self.limit_reached():
+            return []
+
+        input_files = []
+        while self.queue and len(input_files) < count:
+            input_files.append(self.queue.pop())
+        if not input_files:
+            input_files = self.steal(worker, count)
+
+        for input_file in input_files:
+            self.leases[worker][input_file.name] = input_file
+        return [{'id': input_file.name, 'data': base64.b64encode(input_file.read_bytes()).decode()}
+                for input_file in input_files]
+
+    def steal(self, thief: str, count: int) -> typing.List[pathlib.Path]:
+        """Take up to `count` inputs from the most recently leased half of the longest backlog of another worker.
+
+        The oldest lease of a worker is never stolen, since the worker is probably running it.
+        """
+        victim = max((worker for worker in self.leases if worker != thief),
+                     key=lambda worker: len(self.leases[worker]), default=None)
+        stolen_count = min(count, len(self.leases[victim]) // 2) if victim is not None else 0
+        if stolen_count <= 0:
+            return []
+
+        stolen_ids = list(self.leases[victim])[-stolen_count:]
+        self.steals_count += len(stolen_ids)
+        self.revoked[victim].update(stolen_ids)
+        self.stolen[victim].update(stolen_ids)
+        return [self.leases[victim].pop(input_id) for input_id in stolen_ids]
+
+    def decode_results(self, worker: str, results: typing.List[dict]) -> typing.List[tuple]:
+        """Check and decode the results uploaded by `worker`, before any of them is applied.
+
+        Return (input id, RunResult, coverage bitmap or None, test case contents) tuples for the inputs leased to
+        `worker`. The results for inputs stolen from `worker` are left out. Raise ValueError if a result is for another
+        input, and ValueError, TypeError or zlib.error if it is malformed.
+        """
+        decoded = []
+        input_ids = set()
+        for result in results:
+            input_id = result['id']
+            if input_id in input_ids or (input_id not in self.leases[worker] and input_id not in self.stolen[worker]):
+                raise ValueError(f'input {input_id!r} is not leased to worker {worker}')
+            input_ids.add(input_id)
+
+            run_result = util.RunResult(**result['result'])
+            run_result.exit_reason  # raises ValueError for an unknown signal
+            if not all(isinstance(value, (int, float)) for value in (run_result.wall_time, run_result.user_time,
+                                                                      run_result.sys_time, run_result.max_rss,
+                                                                      run_result.test_cases)):
+                raise TypeError(f'invalid run result {result["result"]!r}')
+            coverage = result['coverage']
+            coverage = zlib.decompress(base64.b64decode(coverage, validate=True)) if coverage is not None else None
+            test_cases = [base64.b64decode(data, validate=True) for data in result['test_cases']]
+
+            if input_id in self.leases[worker]:
+                decoded.append((input_id, run_result, coverage, test_cases))
+        return decoded
+
+    def receive_results(self, worker: str, results: typing.List[dict]) -> None:
+        decoded_results = self.decode_results(worker, results)
+        self.stale_results_count += len(results) - len(decoded_results)
+
+        for input_id, run_result, coverage, test_case_contents in decoded_results:
+            test_cases = []
+            for data in test_case_contents:
+                test_case = self.campaign_dir / campaign.NEW_DIR_NAME / f'{self.received_count:06d}'
+                self.received_count += 1
+                test_case.write_bytes(data)
+                test_cases.append(test_case)
+
+            self.handle_outcome(campaign.RunOutcome(
+                input_file=self.leases[worker].pop(input_id),
+                test_cases=test_cases,
+                result=run_result,
+                coverage=coverage,
+            ))
+
+    def release_worker(self, worker: str) -> None:
+        """Queue the inputs leased to `worker` again and forget about it."""
+        for input_file in self.leases.pop(worker, {}).values():
+            self.queue.push(input_file)
+        self.revoked.pop(worker, None)
+        self.stolen.pop(worker, None)
+        self.last_contact.pop(worker, None)
+
+    def release_lost_workers(self) -> None:
+        now = time.monotonic()
+        for worker, last_contact in list(self.last_contact.items()):
+            if now - last_contact > self.worker_timeout:
+                print(f'worker {worker} timed out, its inputs are queued again')
+                self.release_worker(worker)
+
+    def _explore(self) -> None:
+        self.enqueue_seeds()
+
+        with socketserver.TCPServer(self.address, _RequestHandler) as server:
+            server.coordinator = self
+            server.timeout = POLL_INTERVAL
+            # The actual port, when the system chose it
+            self.address = server.server_address[:2]
+            print(f'coordinator listening on {self.address[0]}:{self.address[1]}')
+
+            # Once the campaign is done, the workers learn it from their next response and leave.
+            while not (self.done() and not any(self.leases.values())):
+                server.handle_request()
+                self.release_lost_workers()
+
+    def print_summary(self) -> None:
+        super().print_summary()
+        print(f'stolen inputs: {self.steals_count}, dropped results of stolen inputs: {self.stale_results_count}')
+
+
+class Worker:
+    """Runs the inputs leased by a coordinator, one at a time, in `work_dir`."""
+
+    def __init__(self, address: typing.Tuple[str, int], work_dir: pathlib.Path, batch_size: int = 8,
+                 prefetch: int = 4, upload_interval: float = 30, use_fork_server: bool = False,
+                 tb_cache_dir: typing.Optional[pathlib.Path] = None):
+        self.address = address
+        self.work_dir = work_dir
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.upload_interval = upload_interval
+        self.use_fork_server = use_fork_server
+        self.tb_cache_dir = tb_cache_dir
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}'
+        self.local_queue: typing.Deque[typing.Tuple[str, pathlib.Path]] = collections.deque()
+        self.pending_results = []
+        self.runs_count = 0
+
+    def request(self, request_type: str, **arguments) -> dict:
+        response = send_request(self.address, {'type': request_type, 'worker': self.worker_id, **arguments})
+        revoked = set(response['revoked'])
+        if revoked:
+            for input_id, input_file in self.local_queue:
+                if input_id in revoked:
+                    input_file.unlink()
+            self.local_queue = collections.deque(item for item in self.local_queue if item[0] not in revoked)
+            # The coordinator drops them anyway
+            self.pending_results = [result for result in self.pending_results if result['id'] not in revoked]
+        return response
+
+    def upload(self, final: bool = False) -> bool:
+        """Upload the pending results. Return whether the campaign is done."""
+        response = self.request('upload', results=self.pending_results, final=final)
+        self.pending_results = []
+        return response['done']
+
+    def run(self) -> None:
+        inputs_dir = self.work_dir / 'inputs'
+        for directory in (inputs_dir, self.work_dir / campaign.NEW_DIR_NAME):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        settings = self.request('hello')
+        binary_name = settings['binary']
+        tb_cache_file = (tb_cache.cache_file_for_binary(self.tb_cache_dir, util.BINARIES_DIR / binary_name / 'binary')
+                         if self.tb_cache_dir is not None else None)
+        last_upload = time.monotonic()
+
+        try:
+            while True:
+                if not self.local_queue:
+                    if self.pending_results and self.upload():
+                        break
+                    response = self.request('get_work', count=self.prefetch)
+                    for leased_input in response['inputs']:
+                        if not is_input_id(leased_input['id']):
+                            raise CoordinatorError(f'invalid input id {leased_input["id"]!r}')
+                        input_file = inputs_dir / leased_input['id']
+                        input_file.write_bytes(base64.b64decode(leased_input['data']))
+                        self.local_queue.append((leased_input['id'], input_file))
+                    if response['done'] and not self.local_queue:
+                        break
+                    if not self.local_queue:
+                        time.sleep(POLL_INTERVAL)
+                    continue
+
+                input_id, input_file = self.local_queue.popleft()
+                outcome = campaign.run_input(binary_name, self.work_dir, self.runs_count, input_file,
+                                             settings['run_timeout'], settings['run_memory_limit'],
+                                             self.use_fork_server, tb_cache_file, settings['symbolic_regions'])
+                self.runs_count += 1
+                self.pending_results.append({
+                    'id': input_id,
+                    'result': outcome.result._asdict(),
+                    'coverage': (base64.b64encode(zlib.compress(outcome.coverage)).decode()
+                                 if outcome.coverage is not None else None),
+                    'test_cases': [base64.b64encode(test_case.read_bytes()).decode()
+                                   for test_case in outcome.test_cases],
+                })
+                for test_case in outcome.test_cases:
+                    test_case.unlink()
+                input_file.unlink()
+
+                if (len(self.pending_results) >= self.batch_size
+                        or time.monotonic() - last_upload >= self.upload_interval):
+                    last_upload = time.monotonic()
+                    if self.upload():
+                        break
+
+            self.upload(final=True)
+        except (OSError, CoordinatorError) as error:
+            # The coordinator exits once the campaign is done, possibly before our last request.
+            if self.pending_results:
+                print(f'worker {self.worker_id}: lost the coordinator ({error}), '
+                      f'{len(self.pending_results)} results not uploaded')
+
+        for directory in (inputs_dir, self.work_dir / campaign.NEW_DIR_NAME, self.work_dir / campaign.WORKERS_DIR_NAME):
+            shutil.rmtree(directory, ignore_errors=True)
+        print(f'worker {self.worker_id}: {self.runs_count} runs')
+
+
+def run_worker(address: typing.Tuple[str, int], work_dir: pathlib.Path, **options) -> None:
+    Worker(address, work_dir / str(os.getpid()), **options).run()
+
+
+def parse_address(address: str) -> typing.Tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a SymQEMU exploration campaign over several hosts.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    coordinator_parser = subparsers.add_parser('coordinator', help='serve the queue of a campaign to workers')
+    coordinator_parser.add_argument('binary_name', help='name of a directory in binaries/')
+    coordinator_parser.add_argument('campaign_dir', type=pathlib.Path,
+                                    help='directory where the campaign state is stored')
+    coordinator_parser.add_argument('--host', default='localhost', help='address to listen on (default: localhost)')
+    coordinator_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'default: {DEFAULT_PORT}')
+    coordinator_parser.add_argument('--seed', type=pathlib.Path, action='append', default=[],
+                                    help='initial input (may be repeated, defaults to the input file of the binary)')
+    coordinator_parser.add_argument('--dedup-index', type=pathlib.Path,
+                                    help='content-hash index of already seen test cases')
+    coordinator_parser.add_argument('--symbolic-regions', type=regions.parse_regions,
+                                    help='only make these byte ranges of the inputs symbolic (see regions.py)')
+    coordinator_parser.add_argument('--max-time', type=float, help='stop after this many seconds of wall-clock time')
+    coordinator_parser.add_argument('--max-cpu-time', type=float,
+                                    help='stop after this many seconds of SymQEMU CPU time')
+    coordinator_parser.add_argument('--max-queue', type=int, help='stop queuing inputs after this many have been queued')
+    coordinator_parser.add_argument('--run-timeout', type=float, help='kill a SymQEMU run after this many seconds')
+    coordinator_parser.add_argument('--run-memory-limit', type=int, help='address space limit of a SymQEMU run, in MiB')
+    coordinator_parser.add_argument('--worker-timeout', type=float, default=3600,
+                                    help='seconds without news after which the inputs of a worker are queued again')
+
+    worker_parser = subparsers.add_parser('worker', help='run inputs served by a coordinator')
+    worker_parser.add_argument('address', type=parse_address, help='<host>:<port> of the coordinator')
+    worker_parser.add_argument('work_dir', type=pathlib.Path, help='directory for the files of the workers')
+    worker_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of workers to start')
+    worker_parser.add_argument('--batch-size', type=int, default=8, help='number of runs uploaded together')
+    worker_parser.add_argument('--prefetch', type=int, default=4, help='number of inputs leased at once')
+    worker_parser.add_argument('--upload-interval', type=float, default=30,
+                               help='upload results at least this often, in seconds')
+    worker_parser.add_argument('--fork-server', action='store_true', help='run the inputs in a SymQEMU fork server')
+    worker_parser.add_argument('--tb-cache', type=pathlib.Path,
+                               help='directory of the translation cache (requires --fork-server)')
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.command == 'coordinator':
+        if not (util.BINARIES_DIR / args.binary_name).exists():
+            print(f"Error: {util.BINARIES_DIR / args.binary_name} does not exist")
+            sys.exit(1)
+
+        coordinator = Coordinator(
+            binary_name=args.binary_name,
+            campaign_dir=args.campaign_dir,
+            address=(args.host, args.port),
+            limits=campaign.CampaignLimits(
+                max_time=args.max_time,
+                max_cpu_time=args.max_cpu_time,
+                max_queue=args.max_queue,
+                run_timeout=args.run_timeout,
+                run_memory_limit=args.run_memory_limit * 1024 * 1024 if args.run_memory_limit is not None else None,
+            ),
+            seeds=args.seed,
+            dedup_index_path=args.dedup_index,
+            symbolic_regions=args.symbolic_regions,
+            worker_timeout=args.worker_timeout,
+        )
+        coordinator.run()
+        coordinator.print_summary()
+    else:
+        if args.tb_cache is not None and not args.fork_server:
+            print("Error: --tb-cache requires --fork-server, only fork servers use the translation cache")
+            sys.exit(1)
+
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(args.address, args.work_dir), kwargs={
+                'batch_size': args.batch_size,
+                'prefetch': args.prefetch,
+                'upload_interval': args.upload_interval,
+                'use_fork_server': args.fork_server,
+                'tb_cache_dir': args.tb_cache,
+            })
+            for _ in range(args.jobs)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
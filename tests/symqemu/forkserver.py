@@ -0,0 +1,175 @@
+"""Client for the SymQEMU fork server.
+
+With the environment variable SYMQEMU_FORKSERVER set, SymQEMU loads the guest binary, then forks a new child for each
+run requested over a pipe, instead of being started from scratch for every input (see linux-user/forkserver.c). This
+saves the emulator startup and guest loading time, which dominates the run time of small targets.
+
+All runs of a fork server share the same input file, output directory, coverage file and standard error, because
+they are fixed when SymQEMU starts: `ForkServer.run` copies each input into the input file and expects the output
+directory to be emptied between runs.
+
+With a translation cache file (see `tb_cache.py`), the fork server translates the cached blocks before forking, so
+that the runs only translate the blocks that are not in the cache yet.
+"""
+
+import os
+import pathlib
+import resource
+import select
+import shutil
+import signal
+import struct
+import subprocess
+import time
+import typing
+
+import util
+
+CONTROL_FD = 198
+STATUS_FD = CONTROL_FD + 1
+
+_PID = struct.Struct('=i')
+_HELLO = struct.Struct('=I')
+_REPORT = struct.Struct('=iIQQQ')
+"""ForkServerReport: status, reserved, user time (us), sys time (us), max RSS (KiB)"""
+
+
+class ForkServerError(Exception):
+    pass
+
+
+def _read_exactly(fd: int, size: int, timeout: typing.Optional[float] = None) -> typing.Optional[bytes]:
+    """Read `size` bytes from `fd`. Return None if the timeout expires first. Raise ForkServerError on EOF."""
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    data = b''
+    while len(data) < size:
+        if deadline is not None:
+            ready, _, _ = select.select([fd], [], [], max(0.0, deadline - time.monotonic()))
+            if not ready:
+                return None
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            raise ForkServerError('the fork server exited')
+        data += chunk
+    return data
+
+
+class ForkServer:
+    """A SymQEMU fork server for one test binary."""
+
+    def __init__(self, binary_name: str, input_file: pathlib.Path, output_dir: pathlib.Path,
+                 coverage_file: typing.Optional[pathlib.Path] = None,
+                 tb_cache_file: typing.Optional[pathlib.Path] = None,
+                 symbolic_regions: typing.Optional[typing.Sequence[util.Region]] = None,
+                 memory_limit: typing.Optional[int] = None,
+                 stderr_file: typing.Optional[pathlib.Path] = None):
+        self.binary_name = binary_name
+        self.input_file = input_file
+        self.output_dir = output_dir
+        self.coverage_file = coverage_file
+        self.tb_cache_file = tb_cache_file
+        self.symbolic_regions = symbolic_regions
+        self.memory_limit = memory_limit
+        self.stderr_file = stderr_file
+        self.process = None
+        self.control_fd = None
+        self.status_fd = None
+
+    def start(self, timeout: float = 60) -> None:
+        if not self.input_file.exists():
+            shutil.copyfile(util.BINARIES_DIR / self.binary_name / 'input', self.input_file)
+
+        control_read, self.control_fd = os.pipe()
+        self.status_fd, status_write = os.pipe()
+
+        def setup_child():
+            os.dup2(control_read, CONTROL_FD)
+            os.dup2(status_write, STATUS_FD)
+            if self.memory_limit is not None:
+                resource.setrlimit(resource.RLIMIT_AS, (self.memory_limit, self.memory_limit))
+
+        environment_variables = util.symqemu_environment(self.output_dir, self.input_file, self.coverage_file,
+                                                          self.tb_cache_file, self.symbolic_regions)
+        environment_variables['SYMQEMU_FORKSERVER'] = '1'
+
+        # Standard error is opened in append mode so that truncating the file between runs works.
+        stderr = open(self.stderr_file, 'ab') if self.stderr_file is not None else None
+        try:
+            self.process = subprocess.Popen(
+                util.symqemu_command(self.binary_name, self.input_file),
+                env=environment_variables,
+                stderr=stderr,
+                preexec_fn=setup_child,
+                # The pipes duplicated by setup_child must survive, and they would be closed after it runs. The other
+                # file descriptors created by Python are not inheritable anyway.
+                close_fds=False,
+                start_new_session=True
+            )
+        finally:
+            os.close(control_read)
+            os.close(status_write)
+            if stderr is not None:
+                stderr.close()
+
+        if _read_exactly(self.status_fd, _HELLO.size, timeout) is None:
+            self.stop()
+            raise ForkServerError('no hello message from the fork server')
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        os.close(self.control_fd)
+        os.close(self.status_fd)
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        self.process = None
+
+    def __enter__(self) -> 'ForkServer':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def run(self, input_file: pathlib.Path, timeout: typing.Optional[float] = None) -> util.RunResult:
+        """Run the guest on a copy of `input_file`. Generated test cases are added to the output directory."""
+        if input_file != self.input_file:
+            shutil.copyfile(input_file, self.input_file)
+        if self.coverage_file is not None and self.coverage_file.exists():
+            self.coverage_file.unlink()
+        if self.stderr_file is not None:
+            os.truncate(self.stderr_file, 0)
+
+        test_cases_before = len(list(self.output_dir.iterdir()))
+        start_time = time.monotonic()
+
+        os.write(self.control_fd, _HELLO.pack(0))
+        (child_pid,) = _PID.unpack(_read_exactly(self.status_fd, _PID.size))
+
+        timed_out = False
+        report = _read_exactly(self.status_fd, _REPORT.size, timeout)
+        if report is None:
+            timed_out = True
+            try:
+                os.kill(child_pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            report = _read_exactly(self.status_fd, _REPORT.size)
+
+        wall_time = time.monotonic() - start_time
+        status, _, user_time_us, sys_time_us, max_rss = _REPORT.unpack(report)
+
+        return util.RunResult(
+            exit_code=os.WEXITSTATUS(status) if os.WIFEXITED(status) else None,
+            signal=os.WTERMSIG(status) if os.WIFSIGNALED(status) else None,
+            timed_out=timed_out,
+            wall_time=wall_time,
+            user_time=user_time_us / 1e6,
+            sys_time=sys_time_us / 1e6,
+            max_rss=max_rss,
+            test_cases=len(list(self.output_dir.iterdir())) - test_cases_before,
+            solver_time=util.read_solver_time(self.stderr_file) if self.stderr_file is not None else None,
+        )
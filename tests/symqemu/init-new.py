@@ -4,8 +4,14 @@ import util
 
 if __name__ == '__main__':
 
+    if len(sys.argv) == 3 and sys.argv[1] == '--manifest-only':
+        manifest_only = True
+        del sys.argv[1]
+    else:
+        manifest_only = False
+
     if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <binary name>")
+        print(f"Usage: {sys.argv[0]} [--manifest-only] <binary name>")
         sys.exit(1)
 
     binary_name = sys.argv[1]
@@ -16,13 +22,23 @@ if __name__ == '__main__':
         sys.exit(1)
 
     output_dir = binary_dir / 'expected_outputs'
+    manifest_file = binary_dir / util.EXPECTED_OUTPUTS_MANIFEST_NAME
 
-    if output_dir.exists():
-        print(f"Error: {output_dir} already exists")
-        sys.exit(1)
+    if manifest_only:
+        if not output_dir.exists():
+            print(f"Error: {output_dir} does not exist")
+            sys.exit(1)
+    else:
+        if output_dir.exists():
+            print(f"Error: {output_dir} already exists")
+            sys.exit(1)
+
+        output_dir.mkdir()
+
+        util.run_symqemu_on_test_binary(binary_name=binary_name, output_dir=output_dir)
 
-    output_dir.mkdir()
+        print(f"Expected outputs for {binary_name} generated in {output_dir}")
 
-    util.run_symqemu_on_test_binary(binary_name=binary_name, output_dir=output_dir)
+    util.write_manifest(output_dir, manifest_file)
 
-    print(f"Expected outputs for {binary_name} generated in {output_dir}")
+    print(f"Manifest of the expected outputs of {binary_name} written to {manifest_file}")
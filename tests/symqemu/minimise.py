@@ -0,0 +1,118 @@
+"""Test case minimisation.
+
+Each test case is shrunk by delta debugging while keeping its coverage signature: the edges that the binary covers
+when it runs on the test case, with hit counts bucketed like AFL does (see `block_coverage.py`). The candidates are
+run through SymQEMU with an entirely concrete input (an empty list of symbolic regions, see `regions.py`), so no
+constraints are solved, and the candidates of a round run in parallel.
+
+A round removes chunks of the test case: all the variants of the test case without one chunk are run, and the first
+one that keeps the signature replaces the test case. When no variant keeps it, the chunks are halved, down to single
+bytes.
+
+Usage: python3 minimise.py [-j <jobs>] [--run-timeout <seconds>] (--output-dir <dir> | --in-place)
+                           <binary name> <test case or directory>...
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import os
+import pathlib
+import sys
+import tempfile
+import typing
+
+import block_coverage
+import util
+
+
+def run_signature(binary_name: str, data: bytes, timeout: typing.Optional[float] = None) -> typing.Optional[bytes]:
+    """Return the coverage signature of the run of `binary_name` on `data`, or None if the run timed out."""
+    with tempfile.TemporaryDirectory(prefix=f'symqemu_minimise_{binary_name}_') as temp_dir:
+        temp_dir = pathlib.Path(temp_dir)
+        input_file = temp_dir / 'input'
+        input_file.write_bytes(data)
+        output_dir = temp_dir / 'output'
+        output_dir.mkdir()
+        coverage_file = temp_dir / 'coverage'
+
+        result = util.run_symqemu_on_test_binary(binary_name=binary_name, output_dir=output_dir,
+                                                 input_file=input_file, coverage_file=coverage_file,
+                                                 symbolic_regions=[], timeout=timeout)
+        bitmap = block_coverage.read_bitmap(coverage_file)
+
+    if result.timed_out or bitmap is None:
+        return None
+    return block_coverage.coverage_signature(bitmap)
+
+
+def minimise(data: bytes, signature: bytes,
+             run_signatures: typing.Callable[[typing.List[bytes]], typing.Iterable[typing.Optional[bytes]]]) -> bytes:
+    """Return the smallest variant of `data` found by delta debugging whose coverage signature is `signature`.
+
+    `run_signatures` returns the coverage signatures of a list of candidates; it is called once per round, so that it
+    can run the candidates in parallel.
+    """
+    chunk_size = max(len(data) // 2, 1)
+    while data:
+        candidates = [data[:start] + data[start + chunk_size:] for start in range(0, len(data), chunk_size)]
+        for candidate, candidate_signature in zip(candidates, run_signatures(candidates)):
+            if candidate_signature == signature:
+                data = candidate
+                chunk_size = min(chunk_size, max(len(data) // 2, 1))
+                break
+        else:
+            if chunk_size == 1:
+                break
+            chunk_size //= 2
+    return data
+
+
+def collect_test_cases(paths: typing.Iterable[pathlib.Path]) -> typing.List[pathlib.Path]:
+    """Return the given files, and the files of the given directories."""
+    test_cases = []
+    for path in paths:
+        if path.is_dir():
+            test_cases += sorted(file for file in path.iterdir() if file.is_file())
+        else:
+            test_cases.append(path)
+    return test_cases
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shrink test cases while keeping their coverage signature.')
+    parser.add_argument('binary_name', help='name of a directory in binaries/')
+    parser.add_argument('test_cases', type=pathlib.Path, nargs='+', help='test cases, or directories of test cases')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of parallel SymQEMU runs')
+    parser.add_argument('--run-timeout', type=float, help='kill a SymQEMU run after this many seconds')
+    destination = parser.add_mutually_exclusive_group(required=True)
+    destination.add_argument('--output-dir', type=pathlib.Path, help='directory where minimised test cases are written')
+    destination.add_argument('--in-place', action='store_true', help='replace the test cases by their minimised version')
+    args = parser.parse_args(sys.argv[1:])
+
+    if not (util.BINARIES_DIR / args.binary_name).exists():
+        print(f"Error: {util.BINARIES_DIR / args.binary_name} does not exist")
+        sys.exit(1)
+
+    if args.output_dir is not None:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    total_size = minimised_size = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        run_signatures = functools.partial(executor.map, functools.partial(run_signature, args.binary_name,
+                                                                           timeout=args.run_timeout))
+        for test_case in collect_test_cases(args.test_cases):
+            data = test_case.read_bytes()
+            signature = run_signature(args.binary_name, data, args.run_timeout)
+            if signature is None:
+                print(f'{test_case}: no coverage signature (the run timed out), kept as is')
+                minimised = data
+            else:
+                minimised = minimise(data, signature, run_signatures)
+                print(f'{test_case}: {len(data)} -> {len(minimised)} bytes')
+
+            total_size += len(data)
+            minimised_size += len(minimised)
+            (test_case if args.in_place else args.output_dir / test_case.name).write_bytes(minimised)
+
+    print(f'total: {total_size} -> {minimised_size} bytes')
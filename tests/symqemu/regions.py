@@ -0,0 +1,113 @@
+"""Selection of the symbolic byte ranges of an input.
+
+With the environment variable SYMQEMU_SYMBOLIC_REGIONS, SymQEMU only keeps the input bytes in the given ranges
+symbolic and treats the other ones as concrete (see linux-user/input-regions.c). Bytes that no branch depends on, such
+as most of a file header, only make the expressions bigger and the solver queries slower.
+
+This tool finds the ranges that matter by bisection. A range influences the branches of the binary if SymQEMU
+generates at least one test case when only that range is symbolic, since every generated test case flips a branch
+that depends on the symbolic bytes. Ranges without influence are dropped, and the others are split in halves until
+they are at most `--min-size` bytes long. Bytes that only influence a branch together with bytes of another range (a
+checksum over the whole input, for instance) may be missed.
+
+Usage: python3 regions.py [-j <jobs>] [--min-size <bytes>] [--input <file>] [--run-timeout <seconds>] <binary name>
+    prints the influential ranges in the syntax of SYMQEMU_SYMBOLIC_REGIONS
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import os
+import pathlib
+import sys
+import tempfile
+import typing
+
+import util
+
+
+def parse_regions(spec: str) -> typing.List[util.Region]:
+    """Parse ranges in the syntax of SYMQEMU_SYMBOLIC_REGIONS: `<start>-<end>,...`, with the end excluded."""
+    regions = []
+    for region in spec.split(','):
+        if not region:
+            continue
+        start, end = (int(bound, 0) for bound in region.split('-'))
+        if end < start:
+            raise ValueError(f'invalid region {region}')
+        regions.append((start, end))
+    return merge_regions(regions)
+
+
+def format_regions(regions: typing.Iterable[util.Region]) -> str:
+    return ','.join(f'{start}-{end}' for start, end in regions)
+
+
+def merge_regions(regions: typing.Iterable[util.Region]) -> typing.List[util.Region]:
+    """Sort the regions and merge the overlapping and adjacent ones."""
+    merged = []
+    for start, end in sorted(regions):
+        if start == end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def influences(binary_name: str, input_file: pathlib.Path, region: util.Region,
+               timeout: typing.Optional[float] = None) -> bool:
+    """Whether SymQEMU generates test cases for `binary_name` when only `region` of `input_file` is symbolic."""
+    with tempfile.TemporaryDirectory(prefix=f'symqemu_regions_{binary_name}_') as output_dir:
+        result = util.run_symqemu_on_test_binary(binary_name=binary_name, output_dir=pathlib.Path(output_dir),
+                                                 input_file=input_file, symbolic_regions=[region], timeout=timeout)
+    return result.test_cases > 0
+
+
+def bisect_regions(size: int, min_size: int,
+                   check: typing.Callable[[typing.List[util.Region]], typing.Iterable[bool]]) -> typing.List[util.Region]:
+    """Return the influential regions of an input of `size` bytes.
+
+    `check` tells for a list of regions whether each of them influences the branches of the binary. It is called
+    once per level of the bisection, so that it can check the regions of a level in parallel.
+    """
+    candidates = [(0, size)] if size > 0 else []
+    influential = []
+    while candidates:
+        next_candidates = []
+        for (start, end), is_influential in zip(candidates, check(candidates)):
+            if not is_influential:
+                continue
+            if end - start <= min_size:
+                influential.append((start, end))
+            else:
+                middle = (start + end) // 2
+                next_candidates += [(start, middle), (middle, end)]
+        candidates = next_candidates
+    return merge_regions(influential)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the byte ranges of an input that influence the branches of '
+                                                 'a test binary.')
+    parser.add_argument('binary_name', help='name of a directory in binaries/')
+    parser.add_argument('--input', type=pathlib.Path, help='input to bisect (defaults to the input file of the binary)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of parallel SymQEMU runs')
+    parser.add_argument('--min-size', type=int, default=16, help='size below which ranges are not split further')
+    parser.add_argument('--run-timeout', type=float, help='kill a SymQEMU run after this many seconds')
+    args = parser.parse_args(sys.argv[1:])
+
+    if not (util.BINARIES_DIR / args.binary_name).exists():
+        print(f"Error: {util.BINARIES_DIR / args.binary_name} does not exist")
+        sys.exit(1)
+
+    input_file = args.input or util.BINARIES_DIR / args.binary_name / 'input'
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        check = functools.partial(executor.map, functools.partial(influences, args.binary_name, input_file,
+                                                                  timeout=args.run_timeout))
+        regions = bisect_regions(input_file.stat().st_size, args.min_size, check)
+
+    symbolic_size = sum(end - start for start, end in regions)
+    print(f'{symbolic_size} of {input_file.stat().st_size} bytes influence the branches', file=sys.stderr)
+    print(format_regions(regions))
@@ -0,0 +1,165 @@
+"""Discovery and parallel runner for the SymQEMU regression tests.
+
+Every directory of `binaries` that contains the files `binary`, `args` and `input` is a test binary. It may also
+contain a `metadata.json` file with the following optional keys:
+
+- `timeout`: seconds after which the SymQEMU run is killed and the test fails
+- `max_missing`: number of expected test cases that may be missing from the outputs (default 0)
+- `max_unexpected`: number of generated test cases that may be absent from the expected outputs (default 0)
+- `tags`: list of strings used to select binaries
+
+Each test binary is run through SymQEMU in its own worker process, with its own temporary output directory, and the
+generated test cases are compared to the expected outputs of the binary. The suite takes about as long as its slowest
+binary.
+
+Usage: python3 regression.py [-j <jobs>] [--tag <tag>]... [--shard <index>/<count>] [<binary name>...]
+    runs the given binaries, or all the binaries that match the tags and belong to the shard
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import typing
+import zlib
+
+import util
+
+METADATA_FILE_NAME = 'metadata.json'
+REQUIRED_FILE_NAMES = ('binary', 'args', 'input')
+
+
+class TestBinary(typing.NamedTuple):
+    name: str
+    timeout: typing.Optional[float] = None
+    max_missing: int = 0
+    max_unexpected: int = 0
+    tags: typing.FrozenSet[str] = frozenset()
+
+    @property
+    def directory(self) -> pathlib.Path:
+        return util.BINARIES_DIR / self.name
+
+    @property
+    def has_expected_outputs(self) -> bool:
+        return ((self.directory / util.EXPECTED_OUTPUTS_MANIFEST_NAME).exists()
+                or (self.directory / 'expected_outputs').exists())
+
+
+def load_test_binary(binary_dir: pathlib.Path) -> TestBinary:
+    metadata = {}
+    metadata_file = binary_dir / METADATA_FILE_NAME
+    if metadata_file.exists():
+        with open(metadata_file, 'r') as f:
+            metadata = json.load(f)
+
+    return TestBinary(
+        name=binary_dir.name,
+        timeout=metadata.get('timeout'),
+        max_missing=metadata.get('max_missing', 0),
+        max_unexpected=metadata.get('max_unexpected', 0),
+        tags=frozenset(metadata.get('tags', ())),
+    )
+
+
+def discover_test_binaries() -> typing.List[TestBinary]:
+    """Return all the test binaries of the `binaries` directory, sorted by name."""
+    return [
+        load_test_binary(binary_dir) for binary_dir in sorted(util.BINARIES_DIR.iterdir())
+        if all((binary_dir / file_name).is_file() for file_name in REQUIRED_FILE_NAMES)
+    ]
+
+
+def parse_shard(shard: str) -> typing.Tuple[int, int]:
+    """Parse a shard specification `<index>/<count>`, where 0 <= index < count."""
+    index, count = map(int, shard.split('/'))
+    if not 0 <= index < count:
+        raise ValueError(f'invalid shard {shard}')
+    return index, count
+
+
+def select_test_binaries(test_binaries: typing.Iterable[TestBinary], tags: typing.Collection[str] = (),
+                         shard: typing.Optional[typing.Tuple[int, int]] = None) -> typing.List[TestBinary]:
+    """Keep the test binaries that have one of `tags` (if any are given) and belong to `shard`.
+
+    A binary belongs to a shard according to a hash of its name, so adding binaries to the corpus does not move the
+    existing ones to other shards.
+    """
+    selected = []
+    for test_binary in test_binaries:
+        if tags and not test_binary.tags & set(tags):
+            continue
+        if shard is not None and zlib.crc32(test_binary.name.encode()) % shard[1] != shard[0]:
+            continue
+        selected.append(test_binary)
+    return selected
+
+
+class CheckResult(typing.NamedTuple):
+    test_binary: TestBinary
+    run_result: util.RunResult
+    missing: typing.Counter[str]
+    """Hashes of expected test cases that were not generated"""
+    unexpected: typing.Counter[str]
+    """Hashes of generated test cases that were not expected"""
+
+    @property
+    def passed(self) -> bool:
+        return (not self.run_result.timed_out
+                and sum(self.missing.values()) <= self.test_binary.max_missing
+                and sum(self.unexpected.values()) <= self.test_binary.max_unexpected)
+
+
+def check_binary(test_binary: TestBinary) -> CheckResult:
+    """Run SymQEMU on `test_binary` in a temporary output directory and compare the outputs to the expected ones."""
+    with tempfile.TemporaryDirectory(prefix=f'symqemu_output_{test_binary.name}_') as output_dir:
+        run_result = util.run_symqemu_on_test_binary(binary_name=test_binary.name, output_dir=pathlib.Path(output_dir),
+                                                     timeout=test_binary.timeout)
+        actual_hashes = util.hash_directory(pathlib.Path(output_dir))
+
+    expected_hashes = util.expected_output_hashes(test_binary.name)
+    return CheckResult(
+        test_binary=test_binary,
+        run_result=run_result,
+        missing=expected_hashes - actual_hashes,
+        unexpected=actual_hashes - expected_hashes,
+    )
+
+
+def run_checks(test_binaries: typing.Iterable[TestBinary], jobs: int) -> typing.List[CheckResult]:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(check_binary, test_binaries))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the SymQEMU regression tests in parallel.')
+    parser.add_argument('binary_names', nargs='*', help='binaries to test (default: all)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of parallel workers')
+    parser.add_argument('--tag', action='append', default=[], help='only test the binaries with this tag')
+    parser.add_argument('--shard', type=parse_shard, help='only test the binaries of shard <index>/<count>')
+    args = parser.parse_args(sys.argv[1:])
+
+    test_binaries = discover_test_binaries()
+    if args.binary_names:
+        test_binaries = [test_binary for test_binary in test_binaries if test_binary.name in args.binary_names]
+    test_binaries = select_test_binaries(test_binaries, tags=args.tag, shard=args.shard)
+
+    skipped = [test_binary for test_binary in test_binaries if not test_binary.has_expected_outputs]
+    results = run_checks([test_binary for test_binary in test_binaries if test_binary.has_expected_outputs], args.jobs)
+
+    for test_binary in skipped:
+        print(f'{test_binary.name}: skipped (no expected outputs)')
+
+    for result in results:
+        status = 'ok' if result.passed else 'FAIL'
+        if result.run_result.timed_out:
+            status += ' (timed out)'
+        print(f'{result.test_binary.name}: {status} ({result.run_result.wall_time:.1f}s, '
+              f'{sum(result.missing.values())} missing, {sum(result.unexpected.values())} unexpected test cases)')
+
+    failures = [result for result in results if not result.passed]
+    print(f'{len(results) - len(failures)} passed, {len(failures)} failed, {len(skipped)} skipped')
+    sys.exit(1 if failures else 0)
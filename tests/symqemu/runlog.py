@@ -0,0 +1,152 @@
+"""Structured log of SymQEMU runs and throughput summary.
+
+A run log is a JSON Lines file with one record per SymQEMU run (see `make_record` for the fields). Campaigns write one
+to `<campaign dir>/runs.jsonl`.
+
+Usage: python3 runlog.py [--curve] <run log>
+    prints the throughput of the logged runs; with --curve, prints instead the time-to-new-output curve as CSV
+    (seconds since the first run started, total number of new outputs)
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+import time
+import typing
+
+import util
+
+
+def make_record(binary_name: str, input_file: pathlib.Path, result: util.RunResult,
+                new_outputs: typing.Optional[int] = None) -> dict:
+    """Build the log record of a run of `binary_name` on `input_file`.
+
+    `new_outputs` is the number of generated test cases that had not been seen before, when the caller knows it.
+    """
+    return {
+        'time': time.time(),
+        'binary': binary_name,
+        'input': str(input_file),
+        'input_sha256': util.hash_file(input_file),
+        'duration': result.wall_time,
+        'user_time': result.user_time,
+        'sys_time': result.sys_time,
+        'max_rss': result.max_rss,
+        'outputs': result.test_cases,
+        'new_outputs': new_outputs,
+        'solver_time': result.solver_time,
+        'exit_reason': result.exit_reason,
+    }
+
+
+class RunLog:
+    """An append-only JSON Lines run log."""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+
+    def append(self, record: dict) -> None:
+        # A single write of a whole line, so that concurrent writers do not interleave within a record.
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def records(self) -> typing.Iterator[dict]:
+        with open(self.path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class Summary(typing.NamedTuple):
+    runs: int
+    elapsed_time: float
+    """Seconds between the start of the first run and the end of the last one"""
+    outputs: int
+    new_outputs: int
+    solver_time: float
+    run_time: float
+    """Sum of the durations of the runs"""
+    exit_reasons: typing.Dict[str, int]
+    new_output_curve: typing.List[typing.Tuple[float, int]]
+    """(seconds since the start of the first run, total new outputs) after each run that found new outputs"""
+
+    @property
+    def outputs_per_second(self) -> float:
+        return self.outputs / self.elapsed_time if self.elapsed_time else 0.0
+
+    @property
+    def new_outputs_per_second(self) -> float:
+        return self.new_outputs / self.elapsed_time if self.elapsed_time else 0.0
+
+    @property
+    def runs_per_hour(self) -> float:
+        return self.runs * 3600 / self.elapsed_time if self.elapsed_time else 0.0
+
+
+def summarize(records: typing.Iterable[dict]) -> Summary:
+    """Compute the throughput of the runs in `records`.
+
+    Records without a `new_outputs` count are considered to have produced only new outputs.
+    """
+    records = sorted(records, key=lambda record: record['time'])
+
+    start_time = min((record['time'] - record['duration'] for record in records), default=0.0)
+    end_time = max((record['time'] for record in records), default=0.0)
+
+    outputs = 0
+    new_outputs = 0
+    solver_time = 0.0
+    run_time = 0.0
+    exit_reasons = {}
+    new_output_curve = []
+
+    for record in records:
+        outputs += record['outputs']
+        run_time += record['duration']
+        solver_time += record['solver_time'] or 0.0
+        exit_reasons[record['exit_reason']] = exit_reasons.get(record['exit_reason'], 0) + 1
+
+        record_new_outputs = record['new_outputs'] if record['new_outputs'] is not None else record['outputs']
+        if record_new_outputs:
+            new_outputs += record_new_outputs
+            new_output_curve.append((record['time'] - start_time, new_outputs))
+
+    return Summary(
+        runs=len(records),
+        elapsed_time=end_time - start_time,
+        outputs=outputs,
+        new_outputs=new_outputs,
+        solver_time=solver_time,
+        run_time=run_time,
+        exit_reasons=exit_reasons,
+        new_output_curve=new_output_curve,
+    )
+
+
+def print_summary(summary: Summary) -> None:
+    print(f'runs: {summary.runs} in {summary.elapsed_time:.1f}s ({summary.runs_per_hour:.1f} runs/hour)')
+    print(f'test cases: {summary.outputs} ({summary.outputs_per_second:.3f}/s), '
+          f'new: {summary.new_outputs} ({summary.new_outputs_per_second:.3f}/s)')
+    if summary.run_time:
+        print(f'solver time: {summary.solver_time:.1f}s ({100 * summary.solver_time / summary.run_time:.1f}% of run time)')
+    for exit_reason, count in sorted(summary.exit_reasons.items()):
+        print(f'exit reason {exit_reason}: {count} runs')
+    if summary.new_output_curve:
+        print(f'time to last new output: {summary.new_output_curve[-1][0]:.1f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize the throughput of logged SymQEMU runs.')
+    parser.add_argument('run_log', type=pathlib.Path)
+    parser.add_argument('--curve', action='store_true', help='print the time-to-new-output curve as CSV')
+    args = parser.parse_args(sys.argv[1:])
+
+    summary = summarize(RunLog(args.run_log).records())
+
+    if args.curve:
+        print('seconds,new_outputs')
+        for elapsed_time, new_outputs in summary.new_output_curve:
+            print(f'{elapsed_time:.3f},{new_outputs}')
+    else:
+        print_summary(summary)
@@ -0,0 +1,169 @@
+"""Management of the SymQEMU translation cache.
+
+When the environment variable SYMQEMU_TB_CACHE_FILE is set, SymQEMU appends the guest blocks it translated during a
+run to that file, and a SymQEMU fork server translates all the blocks of the file before it starts forking (see
+include/exec/sym-tb-cache.h). A cache directory holds one such file per guest binary, named after the SHA-256 hash of
+the binary, so that a modified binary never uses stale translations.
+
+Usage: python3 tb_cache.py <cache dir> list
+       python3 tb_cache.py <cache dir> prune --max-size <bytes>
+           removes duplicate entries, then the least recently used cache files until the directory fits in the size
+       python3 tb_cache.py <cache dir> invalidate (--all | <binary or hash>...)
+"""
+
+import argparse
+import contextlib
+import fcntl
+import os
+import pathlib
+import struct
+import sys
+import time
+import typing
+
+import util
+
+CACHE_FILE_SUFFIX = '.tbcache'
+
+ENTRY = struct.Struct('=QQIIII')
+"""SymTBCacheEntry: pc, cs_base, flags, cflags, size, reserved"""
+
+
+class CacheInfo(typing.NamedTuple):
+    binary_hash: str
+    path: pathlib.Path
+    size: int
+    entries: int
+    unique_entries: int
+    last_used: float
+
+
+def cache_file_for_binary(cache_dir: pathlib.Path, binary: pathlib.Path) -> pathlib.Path:
+    """Return the cache file of `binary` in `cache_dir`, marking it as used now."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f'{util.hash_file(binary)}{CACHE_FILE_SUFFIX}'
+    if path.exists():
+        os.utime(path)
+    return path
+
+
+def read_entries(path: pathlib.Path) -> typing.List[bytes]:
+    """Return the raw entries of the cache file at `path`, ignoring a truncated last entry."""
+    data = path.read_bytes()
+    usable_size = len(data) - len(data) % ENTRY.size
+    return [data[offset:offset + ENTRY.size] for offset in range(0, usable_size, ENTRY.size)]
+
+
+@contextlib.contextmanager
+def locked(path: pathlib.Path, operation: int = fcntl.LOCK_EX) -> typing.Iterator[typing.BinaryIO]:
+    """Open the cache file at `path` and lock it with flock `operation`, as SymQEMU does before appending to it.
+
+    A file that was replaced or removed while waiting for the lock is opened again.
+    """
+    while True:
+        f = open(path, 'rb')
+        fcntl.flock(f, operation)
+        try:
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    with f:
+        yield f
+
+
+def compact(path: pathlib.Path) -> None:
+    """Remove the duplicate entries of the cache file at `path`, keeping the order of first occurrence.
+
+    The file is locked while it is rewritten, so that the entries appended by concurrent runs are not lost.
+    """
+    with locked(path):
+        entries = list(dict.fromkeys(read_entries(path)))
+        last_used = path.stat().st_mtime
+        temporary_path = path.with_suffix('.tmp')
+        temporary_path.write_bytes(b''.join(entries))
+        os.utime(temporary_path, (last_used, last_used))
+        os.replace(temporary_path, path)
+
+
+def list_caches(cache_dir: pathlib.Path) -> typing.List[CacheInfo]:
+    """Return the cache files of `cache_dir`, least recently used first."""
+    caches = []
+    for path in cache_dir.glob(f'*{CACHE_FILE_SUFFIX}'):
+        entries = read_entries(path)
+        stat = path.stat()
+        caches.append(CacheInfo(
+            binary_hash=path.name[:-len(CACHE_FILE_SUFFIX)],
+            path=path,
+            size=stat.st_size,
+            entries=len(entries),
+            unique_entries=len(set(entries)),
+            last_used=stat.st_mtime,
+        ))
+    return sorted(caches, key=lambda cache: cache.last_used)
+
+
+def prune(cache_dir: pathlib.Path, max_size: int) -> typing.List[CacheInfo]:
+    """Compact the cache files, then remove the least recently used ones until `cache_dir` holds at most `max_size`
+    bytes. Return the removed cache files."""
+    for cache in list_caches(cache_dir):
+        compact(cache.path)
+
+    caches = list_caches(cache_dir)
+    total_size = sum(cache.size for cache in caches)
+    removed = []
+    for cache in caches:
+        if total_size <= max_size:
+            break
+        cache.path.unlink()
+        total_size -= cache.size
+        removed.append(cache)
+    return removed
+
+
+def invalidate(cache_dir: pathlib.Path, binaries_or_hashes: typing.Iterable[str] = (), all_caches: bool = False) -> None:
+    """Remove the cache files of the given binaries (paths or hashes), or all of them."""
+    if all_caches:
+        paths = [cache.path for cache in list_caches(cache_dir)]
+    else:
+        paths = []
+        for binary_or_hash in binaries_or_hashes:
+            if pathlib.Path(binary_or_hash).is_file():
+                binary_or_hash = util.hash_file(pathlib.Path(binary_or_hash))
+            paths.append(cache_dir / f'{binary_or_hash}{CACHE_FILE_SUFFIX}')
+
+    for path in paths:
+        if path.exists():
+            path.unlink()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect and manage a SymQEMU translation cache directory.')
+    parser.add_argument('cache_dir', type=pathlib.Path)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='list the cache files, least recently used first')
+    prune_parser = subparsers.add_parser('prune', help='compact the cache and limit its size')
+    prune_parser.add_argument('--max-size', type=int, required=True, help='maximum size of the cache, in bytes')
+    invalidate_parser = subparsers.add_parser('invalidate', help='remove cache files')
+    invalidate_parser.add_argument('binaries', nargs='*', help='guest binaries or their SHA-256 hashes')
+    invalidate_parser.add_argument('--all', action='store_true', help='remove all cache files')
+    args = parser.parse_args(sys.argv[1:])
+
+    if not args.cache_dir.is_dir():
+        print(f"Error: {args.cache_dir} is not a directory")
+        sys.exit(1)
+
+    if args.command == 'list':
+        for cache in list_caches(args.cache_dir):
+            last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cache.last_used))
+            print(f'{cache.binary_hash}: {cache.size} bytes, {cache.unique_entries} blocks '
+                  f'({cache.entries - cache.unique_entries} duplicate entries), last used {last_used}')
+    elif args.command == 'prune':
+        for cache in prune(args.cache_dir, args.max_size):
+            print(f'removed {cache.binary_hash} ({cache.size} bytes)')
+    elif args.command == 'invalidate':
+        if not args.all and not args.binaries:
+            print("Error: give binaries or hashes to invalidate, or --all")
+            sys.exit(1)
+        invalidate(args.cache_dir, args.binaries, all_caches=args.all)
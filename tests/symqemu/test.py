@@ -1,35 +1,42 @@
-import filecmp
-import pathlib
-import shutil
+import os
 import unittest
 
-import util
+import regression
 
 
 class SymQemuTests(unittest.TestCase):
-    SYMQEMU_OUTPUT_DIR = pathlib.Path(__file__).parent / "symqemu_output"
+    """One `test_<binary name>` method is generated for each test binary discovered in `binaries`.
 
-    def setUp(self):
-        self.SYMQEMU_OUTPUT_DIR.mkdir()
+    The environment variables SYMQEMU_TEST_TAGS (comma-separated) and SYMQEMU_TEST_SHARD (`<index>/<count>`) restrict
+    the generated tests, in the same way as the `--tag` and `--shard` options of regression.py.
+    """
 
-    def tearDown(self):
-        shutil.rmtree(self.SYMQEMU_OUTPUT_DIR)
+    def run_symqemu_and_assert_correct_result(self, test_binary: regression.TestBinary):
+        if not test_binary.has_expected_outputs:
+            self.skipTest(f'{test_binary.name} has no expected outputs')
 
-    def run_symqemu_and_assert_correct_result(self, binary_name):
+        # Each run gets its own temporary output directory, so the tests can run concurrently (see regression.py).
+        result = regression.check_binary(test_binary)
 
-        util.run_symqemu_on_test_binary(binary_name=binary_name, output_dir=self.SYMQEMU_OUTPUT_DIR)
+        self.assertFalse(result.run_result.timed_out, f'SymQEMU timed out after {test_binary.timeout}s')
+        # The test cases are compared by content only: their names depend on the order in which they are generated.
+        self.assertLessEqual(sum(result.missing.values()), test_binary.max_missing,
+                             f'expected test cases not generated: {result.missing}')
+        self.assertLessEqual(sum(result.unexpected.values()), test_binary.max_unexpected,
+                             f'unexpected test cases generated: {result.unexpected}')
 
-        # `filecmp.dircmp` does a "shallow" comparison, but this is not a problem here because
-        # the timestamps should always be different, so the actual content of the files will be compared.
-        # See https://docs.python.org/3/library/filecmp.html#filecmp.dircmp
-        expected_vs_actual_output_comparison = filecmp.dircmp(self.SYMQEMU_OUTPUT_DIR, util.BINARIES_DIR / binary_name / 'expected_outputs')
-        self.assertEqual(expected_vs_actual_output_comparison.diff_files, [])
-        self.assertEqual(expected_vs_actual_output_comparison.left_only, [])
-        self.assertEqual(expected_vs_actual_output_comparison.right_only, [])
-        self.assertEqual(expected_vs_actual_output_comparison.funny_files, [])
 
-    def test_simple(self):
-        self.run_symqemu_and_assert_correct_result('simple')
+def add_test_methods():
+    tags = [tag for tag in os.environ.get('SYMQEMU_TEST_TAGS', '').split(',') if tag]
+    shard = os.environ.get('SYMQEMU_TEST_SHARD')
+    shard = regression.parse_shard(shard) if shard else None
 
-    def test_printf(self):
-        self.run_symqemu_and_assert_correct_result('printf')
+    for test_binary in regression.select_test_binaries(regression.discover_test_binaries(), tags=tags, shard=shard):
+        def test(self, test_binary=test_binary):
+            self.run_symqemu_and_assert_correct_result(test_binary)
+
+        test_name = 'test_' + ''.join(c if c.isalnum() else '_' for c in test_binary.name)
+        setattr(SymQemuTests, test_name, test)
+
+
+add_test_methods()
@@ -0,0 +1,311 @@
+import contextlib
+import fcntl
+import io
+import itertools
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import block_coverage
+import campaign
+import dedup
+import distributed
+import minimise
+import regions
+import runlog
+import tb_cache
+import util
+
+
+class DedupIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_file(self, name: str, content: bytes) -> pathlib.Path:
+        path = self.dir / name
+        path.write_bytes(content)
+        return path
+
+    def test_filter_new(self):
+        a = self.write_file('a', b'first')
+        b = self.write_file('b', b'second')
+        a_copy = self.write_file('a_copy', b'first')
+
+        with dedup.DedupIndex(self.dir / 'index.sqlite') as index:
+            self.assertEqual(index.filter_new([a, b, a_copy]), [a, b])
+            self.assertEqual(len(index), 2)
+
+    def test_index_is_persistent(self):
+        a = self.write_file('a', b'first')
+
+        with dedup.DedupIndex(self.dir / 'index.sqlite') as index:
+            self.assertTrue(index.add(a))
+
+        with dedup.DedupIndex(self.dir / 'index.sqlite') as index:
+            self.assertFalse(index.add(self.write_file('a_copy', b'first')))
+            self.assertTrue(index.add(self.write_file('c', b'third')))
+
+    def test_recorded_path(self):
+        a = self.write_file('a', b'first')
+        b = self.write_file('b', b'second')
+
+        with dedup.DedupIndex(self.dir / 'index.sqlite') as index:
+            self.assertTrue(index.add(a))
+            self.assertTrue(index.add(b, self.dir / 'queue' / 'b'))
+            self.assertFalse(index.add(self.write_file('b_copy', b'second'), self.dir / 'queue' / 'b_copy'))
+            self.assertEqual(index.recorded_path(util.hash_file(a)), a)
+            self.assertEqual(index.recorded_path(util.hash_file(b)), self.dir / 'queue' / 'b')
+            self.assertIsNone(index.recorded_path('0' * 64))
+
+
+class BlockCoverageTests(unittest.TestCase):
+
+    @staticmethod
+    def bitmap(counters: dict) -> bytes:
+        bitmap = bytearray(block_coverage.MAP_SIZE)
+        for index, count in counters.items():
+            bitmap[index] = count
+        return bytes(bitmap)
+
+    def test_update_counts_new_bits(self):
+        coverage_map = block_coverage.CoverageMap()
+        self.assertEqual(coverage_map.update(self.bitmap({1: 1, 2: 1})), 2)
+        self.assertEqual(coverage_map.update(self.bitmap({1: 1})), 0)
+        # Same edge, hit count in a different bucket
+        self.assertEqual(coverage_map.update(self.bitmap({1: 8})), 1)
+        # Same edge, hit count in the same bucket
+        self.assertEqual(coverage_map.update(self.bitmap({1: 9})), 0)
+
+    def test_scheduler_orders_by_score_then_insertion(self):
+        scheduler = block_coverage.CoverageScheduler()
+        for name, score in (('a', 0), ('b', 5), ('c', 0), ('d', 5)):
+            scheduler.push(pathlib.Path(name), score)
+        self.assertEqual([scheduler.pop().name for _ in range(len(scheduler))], ['b', 'd', 'a', 'c'])
+
+
+class CoordinatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.coordinator = distributed.Coordinator('simple', pathlib.Path(self.temp_dir.name), ('localhost', 0))
+        self.coordinator.queue_dir.mkdir()
+        for index in range(6):
+            input_file = self.coordinator.queue_dir / f'{index:06d}'
+            input_file.write_bytes(bytes([index]))
+            self.coordinator.queue.push(input_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_work(self, worker: str, count: int) -> dict:
+        return self.coordinator.handle_request({'type': 'get_work', 'worker': worker, 'count': count})
+
+    def test_idle_worker_steals_most_recent_leases(self):
+        self.assertEqual(len(self.get_work('a', 6)['inputs']), 6)
+
+        response = self.get_work('b', 2)
+        self.assertEqual([leased_input['id'] for leased_input in response['inputs']], ['000004', '000005'])
+        self.assertEqual(self.get_work('a', 1)['revoked'], ['000004', '000005'])
+
+    def test_leaving_worker_releases_its_leases(self):
+        self.get_work('a', 4)
+        self.coordinator.handle_request({'type': 'upload', 'worker': 'a', 'results': [], 'final': True})
+        self.assertEqual(len(self.coordinator.queue), 6)
+        self.assertFalse(self.coordinator.done())
+
+    @staticmethod
+    def result(input_id: str) -> dict:
+        run_result = util.RunResult(exit_code=0, signal=None, timed_out=False, wall_time=1.0, user_time=0.5,
+                                    sys_time=0.1, max_rss=1000, test_cases=0)
+        return {'id': input_id, 'result': run_result._asdict(), 'coverage': None, 'test_cases': []}
+
+    def test_invalid_upload_changes_nothing(self):
+        self.get_work('a', 2)
+        for bad_result in ({**self.result('000001'), 'coverage': 'not base64'}, self.result('../000001'),
+                           self.result('000002'), self.result('000000')):
+            with self.assertRaises((ValueError, TypeError)):
+                self.coordinator.handle_request({'type': 'upload', 'worker': 'a',
+                                                 'results': [self.result('000000'), bad_result]})
+        self.assertEqual(list(self.coordinator.leases['a']), ['000000', '000001'])
+        self.assertEqual(self.coordinator.runs_count, 0)
+
+    def test_results_of_stolen_inputs_are_dropped(self):
+        self.get_work('a', 6)
+        self.get_work('b', 2)
+        self.coordinator.handle_request({'type': 'upload', 'worker': 'a', 'results': [self.result('000005')]})
+        self.assertEqual(self.coordinator.stale_results_count, 1)
+        self.assertEqual(self.coordinator.runs_count, 0)
+        self.assertEqual(list(self.coordinator.leases['b']), ['000004', '000005'])
+
+
+class DistributedCampaignTests(unittest.TestCase):
+    """A coordinator and two workers on localhost, running a fake SymQEMU."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    @staticmethod
+    def run_input(binary_name, work_dir, run_id, input_file, *args) -> campaign.RunOutcome:
+        # Every input shorter than 4 bytes has two children
+        data = input_file.read_bytes()
+        test_cases = []
+        if len(data) < 4:
+            for suffix in (b'a', b'b'):
+                test_case = work_dir / campaign.NEW_DIR_NAME / f'{run_id:06d}-{suffix.decode()}'
+                test_case.write_bytes(data + suffix)
+                test_cases.append(test_case)
+        time.sleep(0.01)
+        result = util.RunResult(exit_code=0, signal=None, timed_out=False, wall_time=0.01, user_time=0.01,
+                                sys_time=0.0, max_rss=1000, test_cases=len(test_cases))
+        return campaign.RunOutcome(input_file=input_file, test_cases=test_cases, result=result, coverage=None)
+
+    def test_each_input_runs_once(self):
+        seed = self.dir / 'seed'
+        seed.write_bytes(b's')
+        coordinator = distributed.Coordinator('simple', self.dir / 'campaign', ('localhost', 0), seeds=[seed])
+
+        with contextlib.redirect_stdout(io.StringIO()), \
+                unittest.mock.patch.object(distributed, 'POLL_INTERVAL', 0.05), \
+                unittest.mock.patch.object(campaign, 'run_input', self.run_input):
+            coordinator_thread = threading.Thread(target=coordinator.run)
+            coordinator_thread.start()
+            while coordinator.address[1] == 0:
+                time.sleep(0.01)
+
+            worker_threads = []
+            for worker_id in ('a', 'b'):
+                worker = distributed.Worker(coordinator.address, self.dir / worker_id, batch_size=2, prefetch=4)
+                worker.worker_id = worker_id
+                worker_threads.append(threading.Thread(target=worker.run))
+                worker_threads[-1].start()
+
+            for thread in [coordinator_thread] + worker_threads:
+                thread.join(timeout=60)
+                self.assertFalse(thread.is_alive())
+
+        expected_inputs = {b's' + bytes(suffix)
+                           for length in range(4) for suffix in itertools.product(b'ab', repeat=length)}
+        queued_inputs = [path.read_bytes() for path in coordinator.queue_dir.iterdir()]
+        self.assertEqual(sorted(queued_inputs), sorted(expected_inputs))
+        with open(self.dir / 'campaign' / campaign.RUN_LOG_FILE_NAME) as f:
+            run_inputs = [json.loads(line)['input'] for line in f]
+        self.assertEqual(sorted(run_inputs), sorted(str(path) for path in coordinator.queue_dir.iterdir()))
+        self.assertEqual(coordinator.runs_count, len(expected_inputs))
+        with dedup.DedupIndex(coordinator.dedup_index_path) as index:
+            for path in coordinator.queue_dir.iterdir():
+                self.assertEqual(index.recorded_path(util.hash_file(path)), path)
+
+
+class MinimiseTests(unittest.TestCase):
+
+    @staticmethod
+    def signature(data: bytes) -> bytes:
+        # Pretend the binary only branches on the presence and order of the bytes 'x' and 'y'
+        return bytes(byte for byte in data if byte in b'xy')
+
+    def test_minimise_keeps_signature(self):
+        data = b'aaaaxbbbbbbbbbybbbx'
+
+        def run_signatures(candidates):
+            return [self.signature(candidate) for candidate in candidates]
+
+        self.assertEqual(minimise.minimise(data, self.signature(data), run_signatures), b'xyx')
+
+
+class RegionsTests(unittest.TestCase):
+
+    def test_parse_merges_regions(self):
+        self.assertEqual(regions.parse_regions('8-12,0x0-0x4,10-16,4-6,,20-20'), [(0, 6), (8, 16)])
+
+    def test_bisect_finds_influential_bytes(self):
+        influential_bytes = {5, 6, 40}
+
+        def check(candidates):
+            return [any(start <= byte < end for byte in influential_bytes) for start, end in candidates]
+
+        self.assertEqual(regions.bisect_regions(64, min_size=4, check=check), [(4, 8), (40, 44)])
+
+
+class RunLogTests(unittest.TestCase):
+
+    @staticmethod
+    def record(end_time: float, duration: float, outputs: int, new_outputs: int) -> dict:
+        return {'time': end_time, 'duration': duration, 'outputs': outputs, 'new_outputs': new_outputs,
+                'solver_time': None, 'exit_reason': 'exit:0'}
+
+    def test_summarize(self):
+        summary = runlog.summarize([
+            self.record(end_time=110, duration=10, outputs=4, new_outputs=0),
+            self.record(end_time=105, duration=5, outputs=3, new_outputs=3),
+            self.record(end_time=120, duration=10, outputs=2, new_outputs=1),
+        ])
+        self.assertEqual(summary.runs, 3)
+        self.assertEqual(summary.elapsed_time, 20)
+        self.assertEqual(summary.outputs, 9)
+        self.assertEqual(summary.new_outputs, 4)
+        self.assertEqual(summary.runs_per_hour, 540)
+        self.assertEqual(summary.new_output_curve, [(5, 3), (20, 4)])
+
+
+class TBCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_cache(self, name: str, pcs: list, last_used: float) -> pathlib.Path:
+        path = self.dir / f'{name}{tb_cache.CACHE_FILE_SUFFIX}'
+        path.write_bytes(b''.join(tb_cache.ENTRY.pack(pc, 0, 0, 0, 16, 0) for pc in pcs))
+        os.utime(path, (last_used, last_used))
+        return path
+
+    def test_compact_keeps_first_occurrences(self):
+        path = self.write_cache('a', [3, 1, 3, 2, 1], last_used=1000)
+        tb_cache.compact(path)
+        self.assertEqual([tb_cache.ENTRY.unpack(entry)[0] for entry in tb_cache.read_entries(path)], [3, 1, 2])
+        self.assertEqual(path.stat().st_mtime, 1000)
+
+    def test_compact_keeps_concurrent_appends(self):
+        path = self.write_cache('a', [1, 1, 2], last_used=1000)
+
+        def append():
+            # As SymQEMU appends new blocks
+            with tb_cache.locked(path, fcntl.LOCK_SH), open(path, 'ab') as f:
+                f.write(tb_cache.ENTRY.pack(3, 0, 0, 0, 16, 0))
+
+        appender = threading.Thread(target=append)
+        read_entries = tb_cache.read_entries
+
+        def read_entries_while_appending(read_path):
+            appender.start()
+            appender.join(timeout=0.1)
+            return read_entries(read_path)
+
+        with unittest.mock.patch.object(tb_cache, 'read_entries', read_entries_while_appending):
+            tb_cache.compact(path)
+        appender.join()
+        self.assertEqual([tb_cache.ENTRY.unpack(entry)[0] for entry in tb_cache.read_entries(path)], [1, 2, 3])
+
+    def test_prune_removes_least_recently_used(self):
+        self.write_cache('old', [1, 2], last_used=1000)
+        self.write_cache('new', [1, 1, 2], last_used=2000)
+        removed = tb_cache.prune(self.dir, max_size=2 * tb_cache.ENTRY.size)
+        self.assertEqual([cache.binary_hash for cache in removed], ['old'])
+        self.assertEqual([(cache.binary_hash, cache.entries) for cache in tb_cache.list_caches(self.dir)], [('new', 2)])
@@ -1,35 +1,232 @@
+import collections
+import hashlib
+import json
+import logging
+import os
 import pathlib
+import resource
+import signal
 import subprocess
+import threading
+import time
+import typing
 
 SYMQEMU_EXECUTABLE = pathlib.Path(__file__).parent.parent.parent / "x86_64-linux-user" / "symqemu-x86_64"
 BINARIES_DIR = pathlib.Path(__file__).parent / "binaries"
+EXPECTED_OUTPUTS_MANIFEST_NAME = "expected_outputs.sha256"
 
+Region = typing.Tuple[int, int]
+"""Byte range [start, end) of an input"""
 
-def run_symqemu_on_test_binary(binary_name: str, output_dir: pathlib.Path) -> None:
+
+class RunResult(typing.NamedTuple):
+    """Outcome and resource usage of one SymQEMU run."""
+    exit_code: typing.Optional[int]
+    """Exit status of SymQEMU, None if it was killed by a signal"""
+    signal: typing.Optional[int]
+    """Signal that killed SymQEMU, None if it exited normally"""
+    timed_out: bool
+    """Whether SymQEMU was killed because it exceeded its timeout"""
+    wall_time: float
+    """In seconds"""
+    user_time: float
+    """In seconds"""
+    sys_time: float
+    """In seconds"""
+    max_rss: int
+    """Maximum resident set size, in kilobytes"""
+    test_cases: int
+    """Number of test cases generated by the run"""
+    solver_time: typing.Optional[float] = None
+    """Time spent in the SMT solver in seconds, if known (see `read_solver_time`)"""
+
+    @property
+    def exit_reason(self) -> str:
+        if self.timed_out:
+            return 'timeout'
+        if self.signal is not None:
+            return f'signal:{signal.Signals(self.signal).name}'
+        return f'exit:{self.exit_code}'
+
+
+def read_solver_time(stderr_file: pathlib.Path) -> typing.Optional[float]:
+    """Extract the total solving time, in seconds, from the statistics printed on stderr by the QSYM backend.
+
+    The backend prints lines such as `[STAT] SMT: { "solving_time": 480 }`, where the solving time is cumulative and
+    in microseconds. Return None if there is no such line.
+    """
+    solving_time = None
+    with open(stderr_file, 'r', errors='replace') as f:
+        for line in f:
+            if not line.startswith('[STAT] SMT:'):
+                continue
+            try:
+                statistics = json.loads(line[len('[STAT] SMT:'):])
+            except ValueError:
+                continue
+            if 'solving_time' in statistics:
+                solving_time = max(solving_time or 0, statistics['solving_time'])
+    return solving_time / 1e6 if solving_time is not None else None
+
+
+def symqemu_command(binary_name: str, input_file: pathlib.Path) -> typing.Tuple[str, ...]:
+    """Return the command that runs SymQEMU on the test binary `binary_name`, with `input_file` as input."""
     binary_dir = BINARIES_DIR / binary_name
 
     with open(binary_dir / 'args', 'r') as f:
         binary_args = f.read().strip().split(' ')
 
     def replace_placeholder_with_input(arg: str):
-        return str(binary_dir / 'input') if arg == '@@' else arg
+        return str(input_file) if arg == '@@' else arg
 
     binary_args = *map(replace_placeholder_with_input, binary_args),
 
-    command = (
-                  str(SYMQEMU_EXECUTABLE),
-                  str(binary_dir / 'binary'),
-              ) + binary_args
+    return (
+               str(SYMQEMU_EXECUTABLE),
+               str(binary_dir / 'binary'),
+           ) + binary_args
 
+
+def symqemu_environment(output_dir: pathlib.Path, input_file: pathlib.Path,
+                        coverage_file: typing.Optional[pathlib.Path] = None,
+                        tb_cache_file: typing.Optional[pathlib.Path] = None,
+                        symbolic_regions: typing.Optional[typing.Sequence[Region]] = None) -> typing.Dict[str, str]:
     environment_variables = {
         'SYMCC_OUTPUT_DIR': str(output_dir),
-        'SYMCC_INPUT_FILE': str(binary_dir / 'input')
+        'SYMCC_INPUT_FILE': str(input_file)
     }
 
-    print(f'about to run command: {" ".join(command)}')
-    print(f'with environment variables: {environment_variables}')
+    if coverage_file is not None:
+        environment_variables['SYMQEMU_COVERAGE_FILE'] = str(coverage_file)
+    if tb_cache_file is not None:
+        environment_variables['SYMQEMU_TB_CACHE_FILE'] = str(tb_cache_file)
+    if symbolic_regions is not None:
+        environment_variables['SYMQEMU_SYMBOLIC_REGIONS'] = ','.join(f'{start}-{end}'
+                                                                     for start, end in symbolic_regions)
+
+    return environment_variables
+
+
+def run_symqemu_on_test_binary(binary_name: str, output_dir: pathlib.Path,
+                               input_file: typing.Optional[pathlib.Path] = None,
+                               coverage_file: typing.Optional[pathlib.Path] = None,
+                               symbolic_regions: typing.Optional[typing.Sequence[Region]] = None,
+                               timeout: typing.Optional[float] = None,
+                               memory_limit: typing.Optional[int] = None,
+                               stderr_file: typing.Optional[pathlib.Path] = None) -> RunResult:
+    """Run SymQEMU on the test binary `binary_name`, storing generated test cases in `output_dir`.
+
+    `input_file` is the symbolic input given to the binary; it defaults to the `input` file of the binary directory.
+    If `coverage_file` is given, SymQEMU writes the block coverage bitmap of the run to it (see `block_coverage.py`).
+    If `symbolic_regions` is given, only the bytes of the input in these ranges are symbolic (see `regions.py`).
+
+    If SymQEMU runs for more than `timeout` seconds, it is killed (together with any process it started).
+    `memory_limit` is a limit in bytes on the address space of SymQEMU; allocations beyond it fail.
+
+    If `stderr_file` is given, the standard error of SymQEMU is written to it and the solver time of the run is read
+    from it.
+    """
+    if input_file is None:
+        input_file = BINARIES_DIR / binary_name / 'input'
+
+    command = symqemu_command(binary_name, input_file)
+    environment_variables = symqemu_environment(output_dir, input_file, coverage_file,
+                                                symbolic_regions=symbolic_regions)
+
+    logging.debug('about to run command: %s', ' '.join(command))
+    logging.debug('with environment variables: %s', environment_variables)
+
+    def set_memory_limit():
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    test_cases_before = len(list(output_dir.iterdir()))
+    start_time = time.monotonic()
 
-    subprocess.run(
-        command,
-        env=environment_variables
+    stderr = open(stderr_file, 'wb') if stderr_file is not None else None
+    try:
+        process = subprocess.Popen(
+            command,
+            env=environment_variables,
+            stderr=stderr,
+            preexec_fn=set_memory_limit if memory_limit is not None else None,
+            start_new_session=True
+        )
+    finally:
+        if stderr is not None:
+            stderr.close()
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    timer = threading.Timer(timeout, kill) if timeout is not None else None
+    if timer is not None:
+        timer.start()
+
+    # `os.wait4` gives us the resource usage of this specific child, unlike `resource.getrusage`.
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    wall_time = time.monotonic() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    return RunResult(
+        exit_code=os.WEXITSTATUS(status) if os.WIFEXITED(status) else None,
+        signal=os.WTERMSIG(status) if os.WIFSIGNALED(status) else None,
+        timed_out=timed_out.is_set(),
+        wall_time=wall_time,
+        user_time=usage.ru_utime,
+        sys_time=usage.ru_stime,
+        max_rss=usage.ru_maxrss,
+        test_cases=len(list(output_dir.iterdir())) - test_cases_before,
+        solver_time=read_solver_time(stderr_file) if stderr_file is not None else None,
     )
+
+
+def hash_file(path: pathlib.Path) -> str:
+    """Return the SHA-256 hex digest of the content of the file at `path`."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_directory(directory: pathlib.Path) -> typing.Counter[str]:
+    """Return the multiset of the content hashes of the files in `directory`."""
+    return collections.Counter(hash_file(file) for file in directory.iterdir() if file.is_file())
+
+
+def write_manifest(directory: pathlib.Path, manifest_file: pathlib.Path) -> None:
+    """Write the content hashes of the files in `directory` to `manifest_file`, in the format of `sha256sum`."""
+    with open(manifest_file, 'w') as f:
+        for file in sorted(directory.iterdir()):
+            if file.is_file():
+                f.write(f'{hash_file(file)}  {file.name}\n')
+
+
+def read_manifest(manifest_file: pathlib.Path) -> typing.Counter[str]:
+    """Return the multiset of the content hashes listed in `manifest_file`."""
+    with open(manifest_file, 'r') as f:
+        return collections.Counter(line.split()[0] for line in f if line.strip())
+
+
+def expected_output_hashes(binary_name: str) -> typing.Counter[str]:
+    """Return the multiset of the content hashes of the expected outputs of `binary_name`.
+
+    They are read from the manifest of the binary if there is one, otherwise computed from its `expected_outputs`
+    directory.
+    """
+    binary_dir = BINARIES_DIR / binary_name
+    manifest_file = binary_dir / EXPECTED_OUTPUTS_MANIFEST_NAME
+    if manifest_file.exists():
+        return read_manifest(manifest_file)
+    return hash_directory(binary_dir / 'expected_outputs')
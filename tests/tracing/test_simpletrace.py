@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+#
+# Tests of scripts/simpletrace.py
+#
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+#
+# Run with: python3 -m unittest discover tests/tracing
+
+import importlib
+import io
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+SCRIPTS_DIR = os.path.join(SOURCE_DIR, 'scripts')
+sys.path.append(SCRIPTS_DIR)
+import simpletrace
+from tracetool import read_events
+
+EVENTS = '''req_start(uint64_t id) "id %" PRIu64
+req_end(uint64_t id) "id %" PRIu64
+other(uint64_t x) "x %" PRIu64
+'''
+
+# Large enough not to look like record headers when splitting traces
+KEY = 0x7f0012345678
+BASE = 10 ** 12
+
+class SimpleTraceTestCase(unittest.TestCase):
+    """Writes traces of (event name, timestamp, argument) records in a
+    temporary directory.  The argument is a tuple for events with several
+    integer arguments."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.events = read_events(io.StringIO(EVENTS), 'events')
+        self.names = [event.name for event in self.events]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_trace(self, records, name='trace'):
+        data = struct.pack(simpletrace.log_header_fmt,
+                           simpletrace.header_event_id,
+                           simpletrace.header_magic, 4)
+        for event_id, event_name in enumerate(self.names):
+            data += simpletrace.mapping_struct.pack(
+                simpletrace.record_type_mapping, event_id, len(event_name))
+            data += event_name.encode()
+        for event_name, timestamp, arguments in records:
+            if not isinstance(arguments, tuple):
+                arguments = (arguments,)
+            data += simpletrace.event_struct.pack(
+                simpletrace.record_type_event, self.names.index(event_name),
+                timestamp, simpletrace.event_struct.size +
+                simpletrace.u64_struct.size * (len(arguments) - 1), 1234)
+            for argument in arguments:
+                data += simpletrace.u64_struct.pack(argument)
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+class ReadTests(SimpleTraceTestCase):
+
+    def read(self, trace, end=None):
+        with open(trace, 'rb') as f:
+            log, edict, idtoname = simpletrace.open_trace(self.events, f)
+            if end is not None:
+                end = list(simpletrace.scan_trace_records(log, idtoname))[end][0]
+                log.seek(0)
+                simpletrace.read_trace_header(log)
+            return list(simpletrace.read_trace_records(edict, idtoname, log,
+                                                       end))
+
+    def test_records_across_chunks(self):
+        records = [('req_start', BASE + i, KEY + i) for i in range(50)]
+        trace = self.write_trace(records)
+        expected = [(name, timestamp, 1234, argument)
+                    for name, timestamp, argument in records]
+        with unittest.mock.patch.object(simpletrace, 'read_chunk_size', 7):
+            self.assertEqual(self.read(trace), expected)
+            self.assertEqual(self.read(trace, end=10), expected[:10])
+
+    def test_event_names(self):
+        records = [(self.names[i % 3], BASE + i, KEY + i) for i in range(30)]
+        trace = self.write_trace(records)
+        expected = [(name, timestamp, 1234, argument)
+                    for name, timestamp, argument in records
+                    if name == 'req_end']
+        with open(trace, 'rb') as f:
+            log, edict, idtoname = simpletrace.open_trace(self.events, f)
+            self.assertEqual(list(simpletrace.read_trace_records(
+                edict, idtoname, log, event_names={'req_end'})), expected)
+
+        class ReqEndCollector(TimestampCollector):
+            event_names = ('req_end',)
+        analyzer = ReqEndCollector()
+        with open(trace, 'rb') as f:
+            simpletrace.process(self.events, f, analyzer)
+        self.assertEqual(analyzer.timestamps,
+                         [timestamp for _, timestamp, _, _ in expected])
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class ExportTests(SimpleTraceTestCase):
+
+    def test_export_columns(self):
+        records = [(self.names[i % 3], BASE + i, KEY + i)
+                   for i in range(100)]
+        trace = self.write_trace(records)
+        path = os.path.join(self.dir, 'trace.npz')
+        with open(trace, 'rb') as f:
+            simpletrace.export_columns(self.events, f, path,
+                                       event_names=('req_start', 'other'))
+        columns = simpletrace.load_columns(path)
+        self.assertEqual(sorted(columns), ['other', 'req_start'])
+        for name in columns:
+            selected = [record for record in records if record[0] == name]
+            self.assertEqual(columns[name]['timestamp'].tolist(),
+                             [timestamp for _, timestamp, _ in selected])
+            self.assertEqual(columns[name]['pid'].tolist(),
+                             [1234] * len(selected))
+        self.assertEqual(columns['other']['x'].dtype, numpy.uint64)
+        self.assertEqual(columns['req_start']['id'].tolist(),
+                         [KEY + i for i in range(0, 100, 3)])
+
+class TimestampCollector(simpletrace.Analyzer):
+    def begin(self):
+        self.timestamps = []
+
+    def catchall(self, event, rec):
+        self.timestamps.append(rec[1])
+
+class WindowTests(SimpleTraceTestCase):
+
+    def timestamps(self, trace, start_time, end_time):
+        analyzer = TimestampCollector()
+        simpletrace.process(self.events, trace, analyzer,
+                            start_time=start_time, end_time=end_time)
+        return analyzer.timestamps
+
+    def test_window_keeps_out_of_order_records(self):
+        trace = self.write_trace([('other', BASE + offset, 0x5500)
+                                  for offset in (100, 200, 305, 300, 400)])
+        self.assertEqual(self.timestamps(trace, BASE + 100, BASE + 302),
+                         [BASE + 100, BASE + 200, BASE + 300])
+
+    def test_seek_time(self):
+        trace = self.write_trace([('other', BASE + 10 * i, i)
+                                  for i in range(10000)])
+        expected = [BASE + 10 * i for i in range(4321, 5679)]
+        self.assertEqual(self.timestamps(trace, expected[0], expected[-1]),
+                         expected)
+        simpletrace.build_index(trace, interval=64)
+        self.assertEqual(self.timestamps(trace, expected[0], expected[-1]),
+                         expected)
+
+class IndexTests(SimpleTraceTestCase):
+
+    def setUp(self):
+        super(IndexTests, self).setUp()
+        self.trace = self.write_trace([('other', BASE + 10 * i, i)
+                                       for i in range(1000)])
+
+    def test_index_round_trip(self):
+        index_path = simpletrace.build_index(self.trace, interval=64)
+        self.assertEqual(index_path, self.trace + '.idx')
+        with simpletrace.open_index(self.trace) as index:
+            self.assertEqual(len(index), 16)
+            self.assertEqual(index.entry(1)[1], BASE + 640)
+            self.assertEqual(index.block_counts(15), {'other': 1000 - 15 * 64})
+
+    def test_stale_index_is_ignored(self):
+        simpletrace.build_index(self.trace, interval=64)
+        with open(self.trace, 'ab') as f:
+            f.write(b'\0')
+        self.assertIsNone(simpletrace.open_index(self.trace))
+
+    def test_unreadable_index_is_ignored(self):
+        index_path = simpletrace.build_index(self.trace, interval=64)
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        expected = [BASE + 10 * i for i in range(300, 700)]
+        for contents in (b'', b'garbage', data[:-3]):
+            with open(index_path, 'wb') as f:
+                f.write(contents)
+            self.assertIsNone(simpletrace.open_index(self.trace))
+            analyzer = TimestampCollector()
+            with open(self.trace, 'rb') as f:
+                simpletrace.process(self.events, f, analyzer,
+                                    start_time=expected[0],
+                                    end_time=expected[-1])
+            self.assertEqual(analyzer.timestamps, expected)
+
+class FollowTests(SimpleTraceTestCase):
+
+    def test_follow_appended_records(self):
+        trace = self.write_trace([('other', BASE + i, KEY + i)
+                                  for i in range(10)])
+        with open(trace, 'rb') as f:
+            data = f.read()
+        split = len(data) - 5 * 40 - 3
+        with open(trace, 'wb') as f:
+            f.write(data[:split])
+
+        def append():
+            with open(trace, 'ab') as f:
+                f.write(data[split:])
+        writer = threading.Timer(0.05, append)
+        writer.start()
+        analyzer = TimestampCollector()
+        with open(trace, 'rb') as f:
+            log = simpletrace.FollowReader(f, interval=0.01, timeout=0.5)
+            simpletrace.process(self.events, log, analyzer)
+        writer.join()
+        self.assertEqual(analyzer.timestamps, [BASE + i for i in range(10)])
+
+class MergingCollector(TimestampCollector):
+    def merge(self, other):
+        self.timestamps += other.timestamps
+
+class ParallelTests(SimpleTraceTestCase):
+
+    def setUp(self):
+        super(ParallelTests, self).setUp()
+        self.trace = self.write_trace([('other', BASE + 10 * i, i)
+                                       for i in range(1000)])
+        self.expected = [BASE + 10 * i for i in range(1000)]
+
+    def test_parallel_matches_sequential(self):
+        analyzer = MergingCollector()
+        simpletrace.process_parallel(self.events, self.trace, analyzer, jobs=4)
+        self.assertEqual(analyzer.timestamps, self.expected)
+
+    def test_analyzer_without_merge_runs_sequentially(self):
+        analyzer = TimestampCollector()
+        with unittest.mock.patch('multiprocessing.get_context') as get_context:
+            simpletrace.process_parallel(self.events, self.trace, analyzer,
+                                         jobs=4)
+        get_context.assert_not_called()
+        self.assertEqual(analyzer.timestamps, self.expected)
+
+class CompressTests(SimpleTraceTestCase):
+
+    def setUp(self):
+        super(CompressTests, self).setUp()
+        self.trace = self.write_trace([('other', BASE + 10 * i, i)
+                                       for i in range(1000)])
+        self.compressed = os.path.join(self.dir, 'trace.z')
+        simpletrace.compress_trace(self.trace, self.compressed,
+                                   block_size=1024)
+
+    def timestamps(self, trace, **kwargs):
+        analyzer = TimestampCollector()
+        with open(trace, 'rb') as f:
+            simpletrace.process(self.events, f, analyzer, **kwargs)
+        return analyzer.timestamps
+
+    def test_round_trip(self):
+        self.assertEqual(self.timestamps(self.compressed),
+                         self.timestamps(self.trace))
+        with open(self.compressed, 'rb') as f:
+            simpletrace.read_trace_header(f)
+            blocks = simpletrace.read_block_index(f)
+        timestamps = [timestamp for _, timestamp in blocks]
+        self.assertGreater(len(timestamps), 1)
+        self.assertEqual(timestamps[0], BASE)
+        self.assertEqual(timestamps, sorted(timestamps))
+        with self.assertRaises(ValueError):
+            simpletrace.compress_trace(self.compressed,
+                                       os.path.join(self.dir, 'trace.zz'))
+
+    def test_seek_time(self):
+        expected = [BASE + 10 * i for i in range(321, 679)]
+        self.assertEqual(self.timestamps(self.compressed,
+                                         start_time=expected[0],
+                                         end_time=expected[-1]),
+                         expected)
+
+    def test_parallel(self):
+        analyzer = MergingCollector()
+        simpletrace.process_parallel(self.events, self.compressed, analyzer,
+                                     jobs=4)
+        self.assertEqual(analyzer.timestamps,
+                         [BASE + 10 * i for i in range(1000)])
+
+class PairingTests(SimpleTraceTestCase):
+
+    def pair(self, trace, jobs):
+        analyzer = simpletrace.PairingAnalyzer(
+            [simpletrace.Pairing('req_start', 'req_end', key=['id'])])
+        if jobs == 1:
+            with open(trace, 'rb') as log:
+                simpletrace.process(self.events, log, analyzer)
+        else:
+            simpletrace.process_parallel(self.events, trace, analyzer,
+                                         jobs=jobs)
+        state = analyzer.states['req_start']
+        histograms = dict((group, (histogram.count, histogram.total))
+                          for group, histogram in state.histograms.items())
+        return histograms, state.unmatched, state.orphan_count, state.pending
+
+    def test_parallel_pairing_matches_sequential(self):
+        # Split in four parts of two records: a start of the key pending
+        # from the first part is replaced by the start of the second part,
+        # and the end of the third part is an orphan
+        trace = self.write_trace([
+            ('req_start', BASE, KEY), ('other', BASE + 50, 0x5500),
+            ('req_start', BASE + 100, KEY), ('req_end', BASE + 110, KEY),
+            ('req_end', BASE + 1000, KEY), ('other', BASE + 1100, 0x5500),
+            ('other', BASE + 1200, 0x5500), ('other', BASE + 1300, 0x5500),
+        ])
+        self.assertEqual(self.pair(trace, jobs=1), ({(): (1, 10)}, 1, 1, {}))
+        self.assertEqual(self.pair(trace, jobs=4), self.pair(trace, jobs=1))
+
+    def test_pairing_state_is_bounded(self):
+        pairing = simpletrace.Pairing('req_start', 'req_end', key=['id'],
+                                      max_pending=4)
+        state = simpletrace.PairingState(pairing)
+        for key in range(100):
+            state.end(KEY + key, BASE)
+            state.start(KEY + key, BASE, ())
+            state.start(KEY + key, BASE + 10, ())
+            state.end(KEY + key, BASE + 20)
+        self.assertEqual(len(state.pending), 0)
+        self.assertEqual(len(state.started), 4)
+        self.assertEqual(len(state.orphans), 4)
+        self.assertEqual((state.unmatched, state.orphan_count), (100, 100))
+
+class MutexAnalyserTests(unittest.TestCase):
+
+    def test_lock_statistics(self):
+        analyse_locks = importlib.import_module('analyse-locks-simpletrace')
+        analyser = analyse_locks.MutexAnalyser(timeline_interval=1000)
+        for start, wait, hold in ((100, 10, 50), (1200, 300, 20)):
+            analyser.qemu_mutex_lock(start, KEY, b'a.c', 1)
+            analyser.qemu_mutex_locked(start + wait, KEY, b'a.c', 2)
+            analyser.qemu_mutex_unlock(start + wait + hold, KEY, b'a.c', 3)
+        analyser.qemu_mutex_lock(2000, KEY + 1, b'b.c', 4)
+
+        self.assertEqual((analyser.locks, analyser.locked, analyser.unlocks),
+                         (3, 2, 2))
+        stats = analyser.mutex_records[KEY]['stats']
+        self.assertEqual((stats.acquire_times.min, stats.acquire_times.max,
+                          stats.acquire_times.total), (10, 300, 310))
+        self.assertEqual((stats.held_times.min, stats.held_times.max),
+                         (20, 50))
+        self.assertEqual(analyser.sites[(b'a.c', 1)].acquire_times.count, 2)
+        self.assertEqual(analyser.sites[(b'a.c', 2)].held_times.count, 2)
+        self.assertEqual(analyser.timeline, {0: [1, 10, 10],
+                                             1: [1, 300, 300]})
+        self.assertEqual([key for key, _ in analyse_locks.top(
+            [(key, record['stats'])
+             for key, record in analyser.mutex_records.items()], 1)], [KEY])
+
+class VirtFSStatsTests(SimpleTraceTestCase):
+
+    def setUp(self):
+        super(VirtFSStatsTests, self).setUp()
+        self.events_path = os.path.join(SOURCE_DIR, 'hw', '9pfs',
+                                        'trace-events')
+        with open(self.events_path) as f:
+            self.events = read_events(f, self.events_path)
+        self.names = [event.name for event in self.events]
+
+    def test_stats(self):
+        trace = self.write_trace([
+            ('v9fs_read', 1000, (1, 116, 5, 0, 4096)),
+            ('v9fs_write', 3000, (2, 118, 6, 0, 100, 1)),
+            ('v9fs_read_return', 5000, (1, 117, 4096, 0)),
+            ('v9fs_rerror', 7000, (2, 118, 5)),
+            ('v9fs_getattr', 8000, (3, 24, 5, 0)),
+        ])
+        output = subprocess.check_output(
+            [sys.executable,
+             os.path.join(SCRIPTS_DIR, 'analyse-9p-simpletrace.py'),
+             '--stats', self.events_path, trace])
+        stats = json.loads(output.decode())
+        self.assertEqual(stats['duration_ns'], 7000)
+        self.assertEqual((stats['requests'], stats['pending']), (2, 1))
+        read, write = stats['operations']['read'], stats['operations']['write']
+        self.assertEqual((read['count'], read['errors'], read['bytes']),
+                         (1, 0, 4096))
+        self.assertEqual(read['latency_ns']['max'], 4000)
+        self.assertEqual((write['count'], write['errors'], write['bytes']),
+                         (1, 1, 0))
+        self.assertEqual(len(stats['timeline']), 1)
+        self.assertEqual(stats['timeline'][0]['max_depth'], 2)
+        self.assertEqual(stats['timeline'][0]['read_bytes'], 4096)
+        self.assertEqual(sorted(fid['fid'] for fid in stats['slowest_fids']),
+                         [5, 6])
+
+if __name__ == '__main__':
+    unittest.main()
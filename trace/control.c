@@ -55,6 +55,9 @@ QemuOptsList qemu_trace_opts = {
         },{
             .name = "file",
             .type = QEMU_OPT_STRING,
+        },{
+            .name = "compress",
+            .type = QEMU_OPT_BOOL,
         },
         { /* end of list */ }
     },
@@ -321,6 +324,15 @@ char *trace_opt_parse(const char *optarg)
         trace_enable_events(qemu_opt_get(opts, "enable"));
     }
     trace_init_events(qemu_opt_get(opts, "events"));
+    if (qemu_opt_get(opts, "compress")) {
+#ifdef CONFIG_TRACE_SIMPLE
+        st_set_trace_compression(qemu_opt_get_bool(opts, "compress", false));
+#else
+        fprintf(stderr, "error: --trace compress=...: "
+                "option not supported by the selected tracing backends\n");
+        exit(1);
+#endif
+    }
     trace_file = g_strdup(qemu_opt_get(opts, "file"));
     qemu_opts_del(opts);
 
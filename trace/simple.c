@@ -12,6 +12,7 @@
 #ifndef _WIN32
 #include <pthread.h>
 #endif
+#include <zlib.h>
 #include "qemu/timer.h"
 #include "trace/control.h"
 #include "trace/simple.h"
@@ -27,6 +28,14 @@
 /** Trace file version number, bump if format changes */
 #define HEADER_VERSION 4
 
+/**
+ * Version of block-compressed trace files.  After the header, the file is a
+ * sequence of blocks, each made of a TraceBlockHeader followed by the zlib
+ * compression of records in the HEADER_VERSION format.  Blocks end on record
+ * boundaries, so each of them can be decompressed and decoded on its own.
+ */
+#define HEADER_VERSION_COMPRESSED 5
+
 /** Records were dropped event ID */
 #define DROPPED_EVENT_ID (~(uint64_t)0 - 1)
 
@@ -47,6 +56,7 @@ static bool trace_writeout_enabled;
 enum {
     TRACE_BUF_LEN = 4096 * 64,
     TRACE_BUF_FLUSH_THRESHOLD = TRACE_BUF_LEN / 4,
+    TRACE_BLOCK_LEN = 4096 * 64,
 };
 
 uint8_t trace_buf[TRACE_BUF_LEN];
@@ -57,6 +67,19 @@ static uint32_t trace_pid;
 static FILE *trace_fp;
 static char *trace_file_name;
 
+/*
+ * Block compression of the trace file.  Records are collected in block_buf
+ * and written out as a compressed block at the end of each writeout pass, or
+ * earlier if the block is full.  Only the writeout thread, or the thread that
+ * opens the trace file while writeout is halted, touches these.
+ */
+static bool trace_compress;        /* for the next trace file */
+static bool trace_fp_compressed;   /* for the current one */
+static uint8_t *block_buf;
+static size_t block_len;
+static uint8_t *block_zbuf;
+static uint64_t block_timestamp_ns;
+
 #define TRACE_RECORD_TYPE_MAPPING 0
 #define TRACE_RECORD_TYPE_EVENT   1
 
@@ -75,6 +98,12 @@ typedef struct {
     uint64_t header_version;  /* HEADER_VERSION  */
 } TraceLogHeader;
 
+typedef struct {
+    uint32_t compressed_length;   /* in bytes, following this header */
+    uint32_t length;              /* of the records once decompressed */
+    uint64_t timestamp_ns;        /* of the first event record, or 0 */
+} TraceBlockHeader;
+
 
 static void read_from_buffer(unsigned int idx, void *dataptr, size_t size);
 static unsigned int write_to_buffer(unsigned int idx, void *dataptr, size_t size);
@@ -154,6 +183,87 @@ static void wait_for_trace_records_available(void)
     g_mutex_unlock(&trace_lock);
 }
 
+/**
+ * Write out the pending block of a compressed trace file
+ *
+ * Returns -1 if the block could not be written.
+ */
+static int flush_trace_block(void)
+{
+    TraceBlockHeader header;
+    uLongf zlen = compressBound(TRACE_BLOCK_LEN);
+
+    if (!block_len) {
+        return 0;
+    }
+    if (compress2(block_zbuf, &zlen, block_buf, block_len,
+                  Z_BEST_SPEED) != Z_OK) {
+        block_len = 0;
+        return -1;
+    }
+
+    header.compressed_length = zlen;
+    header.length = block_len;
+    header.timestamp_ns = block_timestamp_ns;
+    block_len = 0;
+    block_timestamp_ns = 0;
+    if (fwrite(&header, sizeof(header), 1, trace_fp) != 1 ||
+        fwrite(block_zbuf, zlen, 1, trace_fp) != 1) {
+        return -1;
+    }
+    return 0;
+}
+
+/**
+ * Make room for a record of @size bytes in the pending block, so that blocks
+ * end on record boundaries
+ *
+ * Returns -1 if the record can't be written.
+ */
+static int start_trace_data(size_t size)
+{
+    if (!trace_fp_compressed) {
+        return 0;
+    }
+    if (block_len + size > TRACE_BLOCK_LEN && flush_trace_block() < 0) {
+        return -1;
+    }
+    return size <= TRACE_BLOCK_LEN ? 0 : -1;
+}
+
+/**
+ * Write part of a record to the trace file, or append it to the pending
+ * block after start_trace_data()
+ *
+ * Returns -1 if the data could not be written.
+ */
+static int write_trace_data(const void *data, size_t size)
+{
+    if (!trace_fp_compressed) {
+        return fwrite(data, size, 1, trace_fp) == 1 ? 0 : -1;
+    }
+    memcpy(block_buf + block_len, data, size);
+    block_len += size;
+    return 0;
+}
+
+/**
+ * Write an event record, preceded by its record type
+ */
+static void write_trace_record(TraceRecord *record)
+{
+    uint64_t type = TRACE_RECORD_TYPE_EVENT;
+
+    if (start_trace_data(sizeof(type) + record->length) < 0) {
+        return;
+    }
+    if (trace_fp_compressed && !block_timestamp_ns) {
+        block_timestamp_ns = record->timestamp_ns;
+    }
+    write_trace_data(&type, sizeof(type));
+    write_trace_data(record, record->length);
+}
+
 static gpointer writeout_thread(gpointer opaque)
 {
     TraceRecord *recordptr;
@@ -163,8 +273,6 @@ static gpointer writeout_thread(gpointer opaque)
     } dropped;
     unsigned int idx = 0;
     int dropped_count;
-    size_t unused __attribute__ ((unused));
-    uint64_t type = TRACE_RECORD_TYPE_EVENT;
 
     for (;;) {
         wait_for_trace_records_available();
@@ -179,18 +287,19 @@ static gpointer writeout_thread(gpointer opaque)
             } while (!g_atomic_int_compare_and_exchange(&dropped_events,
                                                         dropped_count, 0));
             dropped.rec.arguments[0] = dropped_count;
-            unused = fwrite(&type, sizeof(type), 1, trace_fp);
-            unused = fwrite(&dropped.rec, dropped.rec.length, 1, trace_fp);
+            write_trace_record(&dropped.rec);
         }
 
         while (get_trace_record(idx, &recordptr)) {
-            unused = fwrite(&type, sizeof(type), 1, trace_fp);
-            unused = fwrite(recordptr, recordptr->length, 1, trace_fp);
+            write_trace_record(recordptr);
             writeout_idx += recordptr->length;
             free(recordptr); /* don't use g_free, can deadlock when traced */
             idx = writeout_idx % TRACE_BUF_LEN;
         }
 
+        if (trace_fp_compressed) {
+            flush_trace_block();
+        }
         fflush(trace_fp);
     }
     return NULL;
@@ -291,15 +400,16 @@ static int st_write_event_mapping(void)
         uint64_t id = trace_event_get_id(ev);
         const char *name = trace_event_get_name(ev);
         uint32_t len = strlen(name);
-        if (fwrite(&type, sizeof(type), 1, trace_fp) != 1 ||
-            fwrite(&id, sizeof(id), 1, trace_fp) != 1 ||
-            fwrite(&len, sizeof(len), 1, trace_fp) != 1 ||
-            fwrite(name, len, 1, trace_fp) != 1) {
+        if (start_trace_data(sizeof(type) + sizeof(id) + sizeof(len) + len) < 0 ||
+            write_trace_data(&type, sizeof(type)) < 0 ||
+            write_trace_data(&id, sizeof(id)) < 0 ||
+            write_trace_data(&len, sizeof(len)) < 0 ||
+            write_trace_data(name, len) < 0) {
             return -1;
         }
     }
 
-    return 0;
+    return trace_fp_compressed ? flush_trace_block() : 0;
 }
 
 void st_set_trace_file_enabled(bool enable)
@@ -314,13 +424,22 @@ void st_set_trace_file_enabled(bool enable)
     flush_trace_file(true);
 
     if (enable) {
-        static const TraceLogHeader header = {
+        TraceLogHeader header = {
             .header_event_id = HEADER_EVENT_ID,
             .header_magic = HEADER_MAGIC,
             /* Older log readers will check for version at next location */
-            .header_version = HEADER_VERSION,
+            .header_version = trace_compress ? HEADER_VERSION_COMPRESSED
+                                             : HEADER_VERSION,
         };
 
+        if (trace_compress && !block_buf) {
+            block_buf = g_malloc(TRACE_BLOCK_LEN);
+            block_zbuf = g_malloc(compressBound(TRACE_BLOCK_LEN));
+        }
+        trace_fp_compressed = trace_compress;
+        block_len = 0;
+        block_timestamp_ns = 0;
+
         trace_fp = fopen(trace_file_name, "wb");
         if (!trace_fp) {
             return;
@@ -364,6 +483,14 @@ void st_set_trace_file(const char *file)
     st_set_trace_file_enabled(true);
 }
 
+/**
+ * Enable or disable block compression of the trace files opened from now on
+ */
+void st_set_trace_compression(bool compress)
+{
+    trace_compress = compress;
+}
+
 void st_print_trace_file_status(void)
 {
     qemu_printf("Trace file \"%s\" %s.\n",
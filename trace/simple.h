@@ -14,6 +14,7 @@
 void st_print_trace_file_status(void);
 void st_set_trace_file_enabled(bool enable);
 void st_set_trace_file(const char *file);
+void st_set_trace_compression(bool compress);
 bool st_init(void);
 void st_flush_trace_buffer(void);
 